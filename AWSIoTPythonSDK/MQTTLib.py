@@ -20,6 +20,7 @@ from AWSIoTPythonSDK.core.util.providers import EndpointProvider
 from AWSIoTPythonSDK.core.jobs.thingJobManager import jobExecutionTopicType
 from AWSIoTPythonSDK.core.jobs.thingJobManager import jobExecutionTopicReplyType
 from AWSIoTPythonSDK.core.protocol.mqtt_core import MqttCore
+from AWSIoTPythonSDK.core.protocol.internal.host import ConnectionHost
 import AWSIoTPythonSDK.core.shadow.shadowManager as shadowManager
 import AWSIoTPythonSDK.core.shadow.deviceShadow as deviceShadow
 import AWSIoTPythonSDK.core.jobs.thingJobManager as thingJobManager
@@ -269,7 +270,7 @@ class AWSIoTMQTTClient:
         """
         self._mqtt_core.configure_reconnect_back_off(baseReconnectQuietTimeSecond, maxReconnectQuietTimeSecond, stableConnectionTimeSecond)
 
-    def configureOfflinePublishQueueing(self, queueSize, dropBehavior=DROP_NEWEST):
+    def configureOfflinePublishQueueing(self, queueSize, dropBehavior=DROP_NEWEST, persistentStorageDir=None, segmentSizeBytes=1048576):
         """
         **Description**
 
@@ -285,6 +286,16 @@ class AWSIoTMQTTClient:
           # Configure the offline queue for publish requests to be 20 in size and drop the oldest
            request when the queue is full.
           myAWSIoTMQTTClient.configureOfflinePublishQueueing(20, AWSIoTPyMQTT.DROP_OLDEST)
+          # Configure an infinite offline queue that keeps publish requests on disk
+          myAWSIoTMQTTClient.configureOfflinePublishQueueing(-1, persistentStorageDir="/var/lib/myDevice/offlineQueue")
+
+        .. note::
+
+          With a persistent storage directory, publish requests are appended to memory-mapped segment files
+          in that directory and drained from there, so they survive a restart of the process: requests left
+          by a previous run are published after the next successful connect. Subscribe and unsubscribe requests
+          are always queued in memory. When the queue is full and drops the oldest requests, a whole segment
+          of the oldest requests is dropped at once.
 
         **Parameters**
 
@@ -295,12 +306,17 @@ class AWSIoTMQTTClient:
          Could be :code:`AWSIoTPythonSDK.core.util.enums.DropBehaviorTypes.DROP_OLDEST` or
          :code:`AWSIoTPythonSDK.core.util.enums.DropBehaviorTypes.DROP_NEWEST`.
 
+        *persistentStorageDir* - Directory to keep queued publish requests in. It is created if needed.
+         If None, the queue is kept in memory only.
+
+        *segmentSizeBytes* - Size of each segment file of the persistent queue, in bytes.
+
         **Returns**
 
         None
 
         """
-        self._mqtt_core.configure_offline_requests_queue(queueSize, dropBehavior)
+        self._mqtt_core.configure_offline_requests_queue(queueSize, dropBehavior, persistentStorageDir, segmentSizeBytes)
 
     def configureDrainingFrequency(self, frequencyInHz):
         """
@@ -332,6 +348,280 @@ class AWSIoTMQTTClient:
         """
         self._mqtt_core.configure_draining_interval_sec(1/float(frequencyInHz))
 
+    def configureAdaptiveDraining(self, maxRatePerSecond=100, maxInFlight=20, ackTimeoutSecond=5):
+        """
+        **Description**
+
+        Used to drain the queued requests as fast as the connection allows instead of at a fixed frequency.
+        Up to *maxInFlight* drained QoS1 publishes may wait for their PUBACK at the same time. Within that limit,
+        the number of publishes in flight grows while PUBACK latency stays low. It shrinks when the latency
+        builds up or PUBACKs do not arrive within *ackTimeoutSecond*. Requests are never sent faster than
+        *maxRatePerSecond*. Should be called before connect. Calling configureDrainingFrequency afterwards
+        switches back to draining at a fixed frequency.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Drain at up to 50 requests/second with up to 10 publishes waiting for PUBACK
+          myAWSIoTMQTTClient.configureAdaptiveDraining(50, 10)
+
+        .. note::
+
+          AWS IoT limits the number of publishes per second per connection. Keep *maxRatePerSecond* under that
+          limit, taking the live traffic of the client into account. *maxInFlight* should not exceed the
+          maximum number of in-flight messages of the client (20).
+
+        **Parameters**
+
+        *maxRatePerSecond* - Maximum draining speed, in requests/second.
+
+        *maxInFlight* - Maximum number of drained QoS1 publishes waiting for their PUBACK.
+
+        *ackTimeoutSecond* - Time in seconds after which a missing PUBACK counts as a sign of congestion.
+
+        **Returns**
+
+        None
+
+        """
+        self._mqtt_core.configure_adaptive_draining(maxRatePerSecond, maxInFlight, ackTimeoutSecond)
+
+    def getDrainingMetrics(self):
+        """
+        **Description**
+
+        Used to get the progress of the current (or last) draining of the offline requests queue.
+
+        **Syntax**
+
+        .. code:: python
+
+          metrics = myAWSIoTMQTTClient.getDrainingMetrics()
+          print("%d drained, %d to go" % (metrics["drained"], metrics["remaining"]))
+
+        **Parameters**
+
+        None
+
+        **Returns**
+
+        A dict with the draining *mode* ("fixed" or "adaptive"), the number of requests *drained* and *remaining*,
+        the *elapsed_sec* and the average *rate_per_sec* of the draining. In adaptive mode it also has the
+        current *window*, the publishes *in_flight*, the number of publishes *acked* and *ack_timeouts*, the
+        average *ack_latency_sec* and the configured *max_rate_per_sec*.
+
+        """
+        return self._mqtt_core.get_draining_metrics()
+
+    def configureEventDispatchBatching(self, maxBatchSize, maxLatencySecond):
+        """
+        **Description**
+
+        Used to configure how incoming events (messages and acks) are handed from the network thread to the
+        callback dispatching thread. Events are dispatched in batches of at most *maxBatchSize* events. The
+        dispatching thread sleeps only when there is nothing to dispatch, and never longer than
+        *maxLatencySecond*. Should be called before connect. Default is 256 events and 0.01 seconds.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Dispatch up to 512 events per batch, waking up at least every 5 ms
+          myAWSIoTMQTTClient.configureEventDispatchBatching(512, 0.005)
+
+        **Parameters**
+
+        *maxBatchSize* - Maximum number of events dispatched before the dispatching thread checks for a stop request.
+
+        *maxLatencySecond* - Maximum time in seconds the dispatching thread sleeps before checking for new events.
+
+        **Returns**
+
+        None
+
+        """
+        self._mqtt_core.configure_event_dispatch_batching(maxBatchSize, maxLatencySecond)
+
+    def configureMessageCallbackWorkers(self, numberOfWorkers, maxQueueSize=1000):
+        """
+        **Description**
+
+        Used to run message callbacks (subscription callbacks and onMessage) on a pool of worker threads instead
+        of the thread that processes acks and connection events, so slow application code does not delay them.
+        Messages on the same topic are always handled by the same worker, in the order they were received.
+        Each worker queues at most *maxQueueSize* messages; when that queue is full, event dispatching waits
+        for the worker. Should be called before connect. By default, message callbacks are not run on workers.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Run message callbacks on 4 worker threads, each queueing up to 500 messages
+          myAWSIoTMQTTClient.configureMessageCallbackWorkers(4, 500)
+          # Run message callbacks on the event dispatching thread again
+          myAWSIoTMQTTClient.configureMessageCallbackWorkers(0)
+
+        **Parameters**
+
+        *numberOfWorkers* - Number of worker threads. 0 disables the worker pool.
+
+        *maxQueueSize* - Maximum number of messages queued per worker.
+
+        **Returns**
+
+        None
+
+        """
+        self._mqtt_core.configure_message_callback_workers(numberOfWorkers, maxQueueSize)
+
+    def getMessageCallbackMetrics(self):
+        """
+        **Description**
+
+        Used to get the metrics of the message callback workers configured with configureMessageCallbackWorkers.
+
+        **Syntax**
+
+        .. code:: python
+
+          metrics = myAWSIoTMQTTClient.getMessageCallbackMetrics()
+          print(metrics["max_queued"], metrics["back_pressure_waits"])
+
+        **Parameters**
+
+        None
+
+        **Returns**
+
+        A dict with the number of *workers*, the *max_queue_size* per worker, the number of messages currently
+        *queued*, the highest number of messages queued at once (*max_queued*), the number of messages
+        *dispatched* so far and the number of times event dispatching had to wait for a full worker queue
+        (*back_pressure_waits*). None if no workers are configured.
+
+        """
+        return self._mqtt_core.get_message_callback_metrics()
+
+    def configureConnectionHost(self, connectionHost):
+        """
+        **Description**
+
+        Used to run the network I/O and event dispatching of this client on a shared connection host instead of
+        threads of its own. Many clients configured with the same host cost the threads of that host only.
+        Message callbacks then run on the dispatch threads of the host, so long-running callbacks delay the
+        other clients on it. Should be called before connect. Requires Python 3.4+.
+
+        **Syntax**
+
+        .. code:: python
+
+          connectionHost = AWSIoTPyMQTT.AWSIoTMQTTConnectionHost()
+          myAWSIoTMQTTClient.configureConnectionHost(connectionHost)
+
+        **Parameters**
+
+        *connectionHost* - :code:`AWSIoTPythonSDK.MQTTLib.AWSIoTMQTTConnectionHost` object. None goes back to
+        threads of its own.
+
+        **Returns**
+
+        None
+
+        """
+        self._mqtt_core.configure_connection_host(connectionHost._connection_host if connectionHost else None)
+
+    def configureWriteCoalescing(self, maxBytesPerWrite, maxDelaySecond=0):
+        """
+        **Description**
+
+        Used to configure how outgoing MQTT packets queued together are sent. Packets waiting to be sent are
+        gathered into one socket write (one TLS record) of up to *maxBytesPerWrite* bytes instead of a write per
+        packet, which saves framing overhead and system calls for high-rate publishing. Publishes can optionally be
+        held back for up to *maxDelaySecond* for more packets to join the same write, trading latency for
+        throughput; other packets such as subscribes and acknowledgements are never held back. By default, up to
+        16384 bytes are coalesced without any delay.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Coalesce up to 16 KB per write, waiting up to 5 ms for more packets to be queued
+          myAWSIoTMQTTClient.configureWriteCoalescing(16384, 0.005)
+          # Send every packet with a write of its own
+          myAWSIoTMQTTClient.configureWriteCoalescing(0)
+
+        **Parameters**
+
+        *maxBytesPerWrite* - Maximum number of bytes gathered into one write. 0 disables coalescing.
+
+        *maxDelaySecond* - Maximum time in seconds a publish waits for other packets to join its write while less
+        than *maxBytesPerWrite* bytes are queued. 0 sends right away.
+
+        **Returns**
+
+        None
+
+        """
+        self._mqtt_core.configure_write_coalescing(maxBytesPerWrite, maxDelaySecond)
+
+    def configureWebsocketFrameAggregation(self, maxBytesPerFrame):
+        """
+        **Description**
+
+        Used to configure how many bytes of queued outgoing MQTT packets are packed into one WebSocket frame when
+        connecting over WebSocket. Packets waiting to be sent then share a frame header and a masking pass instead
+        of getting a frame each. Over WebSocket, this takes the place of the *maxBytesPerWrite* of
+        configureWriteCoalescing, whose *maxDelaySecond* still applies. By default, up to 16384 bytes are packed
+        into a frame. Has no effect on connections that do not use WebSocket.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Pack up to 32 KB of queued packets into a frame
+          myAWSIoTMQTTClient.configureWebsocketFrameAggregation(32768)
+          # Send every packet in a frame of its own
+          myAWSIoTMQTTClient.configureWebsocketFrameAggregation(0)
+
+        **Parameters**
+
+        *maxBytesPerFrame* - Maximum number of bytes of MQTT packets packed into one frame. 0 disables aggregation.
+
+        **Returns**
+
+        None
+
+        """
+        self._mqtt_core.configure_ws_frame_aggregation(maxBytesPerFrame)
+
+    def getTLSSessionMetrics(self):
+        """
+        **Description**
+
+        Used to get the metrics of the TLS handshakes of this client. On Python 3.6+ the client keeps its TLS
+        context and the session of the last connection, so that reconnects can resume the session instead of
+        going through a full handshake with certificate verification.
+
+        **Syntax**
+
+        .. code:: python
+
+          metrics = myAWSIoTMQTTClient.getTLSSessionMetrics()
+          print(metrics["resumed_handshakes"], metrics["average_resumed_handshake_sec"])
+
+        **Parameters**
+
+        None
+
+        **Returns**
+
+        A dict with the number of *handshakes* so far, how many of them resumed an earlier session
+        (*resumed_handshakes*), the duration of the last one (*last_handshake_sec*) and the average duration of
+        full and of resumed handshakes (*average_full_handshake_sec*, *average_resumed_handshake_sec*).
+
+        """
+        return self._mqtt_core.get_tls_session_metrics()
+
     def configureConnectDisconnectTimeout(self, timeoutSecond):
         """
         **Description**
@@ -616,7 +906,8 @@ class AWSIoTMQTTClient:
 
         *topic* - Topic name to publish to.
 
-        *payload* - Payload to publish.
+        *payload* - Payload to publish. A str, bytes, bytearray or memoryview. Large bytes-like payloads are sent
+        without being copied, so a bytearray or memoryview payload must not be modified until the publish completes.
 
         *QoS* - Quality of Service. Could be 0 or 1.
 
@@ -647,7 +938,8 @@ class AWSIoTMQTTClient:
 
         *topic* - Topic name to publish to.
 
-        *payload* - Payload to publish.
+        *payload* - Payload to publish. A str, bytes, bytearray or memoryview. Large bytes-like payloads are sent
+        without being copied, so a bytearray or memoryview payload must not be modified until the publish completes.
 
         *QoS* - Quality of Service. Could be 0 or 1.
 
@@ -860,6 +1152,91 @@ class AWSIoTMQTTClient:
         """
         pass
 
+
+class AWSIoTMQTTConnectionHost(object):
+
+    def __init__(self, numberOfDispatchWorkers=4):
+        """
+
+        The class that hosts the connections of many :code:`AWSIoTPythonSDK.MQTTLib.AWSIoTMQTTClient` objects in one
+        process. All hosted connections share one network thread, which waits on their sockets with the most
+        efficient selector of the platform (epoll on Linux), and a small pool of threads that dispatch their
+        events and callbacks. Without a host, every connected client runs a network thread and an event
+        dispatching thread of its own. Reconnect with progressive backoff works as it does without a host.
+        Requires Python 3.4+.
+
+        **Syntax**
+
+        .. code:: python
+
+          import AWSIoTPythonSDK.MQTTLib as AWSIoTPyMQTT
+
+          connectionHost = AWSIoTPyMQTT.AWSIoTMQTTConnectionHost(numberOfDispatchWorkers=8)
+          for clientID in clientIDs:
+              myAWSIoTMQTTClient = AWSIoTPyMQTT.AWSIoTMQTTClient(clientID)
+              myAWSIoTMQTTClient.configureConnectionHost(connectionHost)
+
+        **Parameters**
+
+        *numberOfDispatchWorkers* - Number of threads that dispatch events and run callbacks for all hosted clients.
+
+        **Returns**
+
+        :code:`AWSIoTPythonSDK.MQTTLib.AWSIoTMQTTConnectionHost` object
+
+        """
+        self._connection_host = ConnectionHost(numberOfDispatchWorkers)
+
+    def getMetrics(self):
+        """
+        **Description**
+
+        Used to get the metrics of the connection host.
+
+        **Syntax**
+
+        .. code:: python
+
+          metrics = connectionHost.getMetrics()
+          print(metrics["connections"], metrics["dispatch_queued"])
+
+        **Parameters**
+
+        None
+
+        **Returns**
+
+        A dict with the number of hosted *connections*, how many of them are *reconnecting*, the number of
+        *dispatch_workers* and the number of tasks waiting for them (*dispatch_queued*).
+
+        """
+        return self._connection_host.get_metrics()
+
+    def stop(self):
+        """
+        **Description**
+
+        Used to stop the threads of the connection host. Hosted clients should be disconnected first. The host
+        starts again when a client connects through it.
+
+        **Syntax**
+
+        .. code:: python
+
+          connectionHost.stop()
+
+        **Parameters**
+
+        None
+
+        **Returns**
+
+        None
+
+        """
+        self._connection_host.stop()
+
+
 class _AWSIoTMQTTDelegatingClient(object):
 
     def __init__(self, clientID, protocolType=MQTTv3_1_1, useWebsocket=False, cleanSession=True, awsIoTMQTTClient=None):
@@ -1079,6 +1456,90 @@ class _AWSIoTMQTTDelegatingClient(object):
         # AWSIoTMQTTClient.configureBackoffTime
         self._AWSIoTMQTTClient.configureAutoReconnectBackoffTime(baseReconnectQuietTimeSecond, maxReconnectQuietTimeSecond, stableConnectionTimeSecond)
 
+    def configureConnectionHost(self, connectionHost):
+        """
+        **Description**
+
+        Used to run the network I/O and event dispatching of this client on a shared connection host instead of
+        threads of its own. Should be called before connect. This is a public facing API inherited by application
+        level public clients.
+
+        **Syntax**
+
+        .. code:: python
+
+          connectionHost = AWSIoTPyMQTT.AWSIoTMQTTConnectionHost()
+          myShadowClient.configureConnectionHost(connectionHost)
+          myJobsClient.configureConnectionHost(connectionHost)
+
+        **Parameters**
+
+        *connectionHost* - :code:`AWSIoTPythonSDK.MQTTLib.AWSIoTMQTTConnectionHost` object.
+
+        **Returns**
+
+        None
+
+        """
+        # AWSIoTMQTTClient.configureConnectionHost
+        self._AWSIoTMQTTClient.configureConnectionHost(connectionHost)
+
+    def configureWriteCoalescing(self, maxBytesPerWrite, maxDelaySecond=0):
+        """
+        **Description**
+
+        Used to configure how many bytes of queued outgoing MQTT packets are gathered into one socket write, and
+        how long packets may wait for others to join the write. This is a public facing API inherited by
+        application level public clients.
+
+        **Syntax**
+
+        .. code:: python
+
+          myShadowClient.configureWriteCoalescing(16384, 0.005)
+          myJobsClient.configureWriteCoalescing(16384, 0.005)
+
+        **Parameters**
+
+        *maxBytesPerWrite* - Maximum number of bytes gathered into one write. 0 disables coalescing.
+
+        *maxDelaySecond* - Maximum time in seconds a publish waits for other packets to join its write. 0 sends
+        right away.
+
+        **Returns**
+
+        None
+
+        """
+        # AWSIoTMQTTClient.configureWriteCoalescing
+        self._AWSIoTMQTTClient.configureWriteCoalescing(maxBytesPerWrite, maxDelaySecond)
+
+    def configureWebsocketFrameAggregation(self, maxBytesPerFrame):
+        """
+        **Description**
+
+        Used to configure how many bytes of queued outgoing MQTT packets are packed into one WebSocket frame when
+        connecting over WebSocket. This is a public facing API inherited by application level public clients.
+
+        **Syntax**
+
+        .. code:: python
+
+          myShadowClient.configureWebsocketFrameAggregation(32768)
+          myJobsClient.configureWebsocketFrameAggregation(32768)
+
+        **Parameters**
+
+        *maxBytesPerFrame* - Maximum number of bytes of MQTT packets packed into one frame. 0 disables aggregation.
+
+        **Returns**
+
+        None
+
+        """
+        # AWSIoTMQTTClient.configureWebsocketFrameAggregation
+        self._AWSIoTMQTTClient.configureWebsocketFrameAggregation(maxBytesPerFrame)
+
     def configureConnectDisconnectTimeout(self, timeoutSecond):
         """
         **Description**
@@ -1440,7 +1901,46 @@ class AWSIoTMQTTShadowClient(_AWSIoTMQTTDelegatingClient):
             self._AWSIoTMQTTClient.configureOfflinePublishQueueing(0)  # Disable queueing, no queueing for time-sensitive shadow messages
             self._AWSIoTMQTTClient.configureDrainingFrequency(10)
         # Now retrieve the configured mqttCore and init a shadowManager instance
-        self._shadowManager = shadowManager.shadowManager(self._AWSIoTMQTTClient._mqtt_core)
+        self._shadowBasicManager = shadowManager.shadowManager(self._AWSIoTMQTTClient._mqtt_core)
+        self._shadowFleetManager = None  # Created by configureFleetShadowSubscriptions
+        self._shadowManager = self._shadowBasicManager
+
+    def configureFleetShadowSubscriptions(self, enabled=True):
+        """
+        **Description**
+
+        Used to let the shadow handlers created after this call share wildcard subscriptions,
+        :code:`$aws/things/+/shadow/get/accepted` and so on, instead of each subscribing to the response topics of
+        its own shadow. Responses are routed to the handler of the shadow they are for. The number of
+        subscriptions stays at 7 however many shadows are handled, which suits gateways managing a large fleet of
+        device shadows. The policy of the client has to allow subscribing to these wildcard topic filters. The
+        client receives the responses for every shadow that it is allowed to, and drops those of shadows it has no
+        handler for. Should be called before createShadowHandlerWithName.
+
+        **Syntax**
+
+        .. code:: python
+
+          myAWSIoTMQTTShadowClient.configureFleetShadowSubscriptions()
+          shadows = [myAWSIoTMQTTShadowClient.createShadowHandlerWithName(name, True) for name in thingNames]
+
+        **Parameters**
+
+        *enabled* - Whether handlers created from now on share wildcard subscriptions. Handlers created before keep
+        the subscription mode they were created with.
+
+        **Returns**
+
+        None
+
+        """
+        if enabled:
+            if self._shadowFleetManager is None:
+                # One per client, a second one would replace the wildcard subscriptions of the first
+                self._shadowFleetManager = shadowManager.shadowFleetManager(self._AWSIoTMQTTClient._mqtt_core)
+            self._shadowManager = self._shadowFleetManager
+        else:
+            self._shadowManager = self._shadowBasicManager
 
     # Shadow management API
     def createShadowHandlerWithName(self, shadowName, isPersistentSubscribe):
@@ -0,0 +1,717 @@
+# /*
+# * Copyright 2010-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# *
+# * Licensed under the Apache License, Version 2.0 (the "License").
+# * You may not use this file except in compliance with the License.
+# * A copy of the License is located at
+# *
+# *  http://aws.amazon.com/apache2.0
+# *
+# * or in the "license" file accompanying this file. This file is distributed
+# * on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# * express or implied. See the License for the specific language governing
+# * permissions and limitations under the License.
+# */
+
+import ssl
+import asyncio
+import logging
+import AWSIoTPythonSDK
+import AWSIoTPythonSDK.core.protocol.paho.client as mqtt
+from AWSIoTPythonSDK.core.protocol.paho.client import MQTT_ERR_SUCCESS
+from AWSIoTPythonSDK.core.protocol.paho.client import MQTT_ERR_NO_CONN
+from AWSIoTPythonSDK.core.protocol.paho.client import MQTT_ERR_CONN_LOST
+from AWSIoTPythonSDK.core.protocol.connection.alpn import SSLContextBuilder
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_CONNECT_DISCONNECT_TIMEOUT_SEC
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_OPERATION_TIMEOUT_SEC
+from AWSIoTPythonSDK.core.protocol.internal.defaults import METRICS_PREFIX
+from AWSIoTPythonSDK.core.protocol.internal.defaults import ALPN_PROTCOLS
+from AWSIoTPythonSDK.core.util.providers import CertificateCredentialsProvider
+from AWSIoTPythonSDK.core.util.providers import EndpointProvider
+from AWSIoTPythonSDK.aio.transport import MqttStreamProtocol
+from AWSIoTPythonSDK.exception.AWSIoTExceptions import connectError
+from AWSIoTPythonSDK.exception.AWSIoTExceptions import connectTimeoutException
+from AWSIoTPythonSDK.exception.AWSIoTExceptions import disconnectError
+from AWSIoTPythonSDK.exception.AWSIoTExceptions import disconnectTimeoutException
+from AWSIoTPythonSDK.exception.AWSIoTExceptions import publishError
+from AWSIoTPythonSDK.exception.AWSIoTExceptions import publishTimeoutException
+from AWSIoTPythonSDK.exception.AWSIoTExceptions import subscribeError
+from AWSIoTPythonSDK.exception.AWSIoTExceptions import subscribeTimeoutException
+from AWSIoTPythonSDK.exception.AWSIoTExceptions import unsubscribeError
+from AWSIoTPythonSDK.exception.AWSIoTExceptions import unsubscribeTimeoutException
+
+# Constants
+# - Protocol types:
+MQTTv3_1 = 3
+MQTTv3_1_1 = 4
+
+# Periodic keep-alive/retry check, same granularity as the threaded paho loop
+_MISC_INTERVAL_SEC = 1.0
+# Put in the message queue when the connection goes down to end async iteration
+_END_OF_MESSAGES = object()
+# Failure return code of a topic in a SUBACK
+_SUBACK_FAILURE = 0x80
+
+_get_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)  # Python 3.7+
+
+
+class AWSIoTMQTTClient(object):
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, clientID, protocolType=MQTTv3_1_1, cleanSession=True, messageQueueSize=0):
+        """
+
+        The asyncio client class that connects to and accesses AWS IoT over MQTT v3.1/3.1.1 using
+        TLSv1.2 Mutual Authentication.
+
+        All network I/O, keep-alive and acknowledgement handling runs on the asyncio event loop
+        the client is connected from, using the same paho packet codec as
+        :code:`AWSIoTPythonSDK.MQTTLib.AWSIoTMQTTClient` but no threads, so a single process
+        can hold many connections. Auto reconnect/resubscribe and offline queueing are not
+        provided; a lost connection ends message iteration and fails pending operations.
+
+        **Syntax**
+
+        .. code:: python
+
+          from AWSIoTPythonSDK.aio.MQTTLib import AWSIoTMQTTClient
+
+          myAWSIoTMQTTClient = AWSIoTMQTTClient("testIoTPySDK")
+          myAWSIoTMQTTClient.configureEndpoint("random.iot.region.amazonaws.com", 8883)
+          myAWSIoTMQTTClient.configureCredentials("PATH/TO/ROOT_CA", "PATH/TO/PRIVATE_KEY", "PATH/TO/CERTIFICATE")
+          await myAWSIoTMQTTClient.connect()
+          await myAWSIoTMQTTClient.subscribe("myTopic", 1)
+          async for message in myAWSIoTMQTTClient:
+              print(message.topic, message.payload)
+
+        **Parameters**
+
+        *clientID* - String that denotes the client identifier used to connect to AWS IoT.
+
+        *protocolType* - MQTT version in use for this connection. Could be :code:`AWSIoTPythonSDK.aio.MQTTLib.MQTTv3_1` or :code:`AWSIoTPythonSDK.aio.MQTTLib.MQTTv3_1_1`
+
+        *cleanSession* - Boolean that denotes whether to start a clean session.
+
+        *messageQueueSize* - Maximum number of inbound messages buffered for async iteration.
+        Messages arriving while the buffer is full are dropped. 0 means unbounded.
+
+        **Returns**
+
+        :code:`AWSIoTPythonSDK.aio.MQTTLib.AWSIoTMQTTClient` object
+
+        """
+        self._paho_client = mqtt.Client(clientID, cleanSession, None, protocolType)
+        self._paho_client.on_connect = self._on_connect
+        self._paho_client.on_disconnect = self._on_disconnect
+        self._paho_client.on_message = self._on_message
+        self._paho_client.on_publish = self._on_ack
+        self._paho_client.on_subscribe = self._on_suback
+        self._paho_client.on_unsubscribe = self._on_ack
+        self._endpoint_provider = None
+        self._cert_credentials_provider = None
+        self._username = ""
+        self._password = None
+        self._enable_metrics_collection = True
+        self._connect_disconnect_timeout_sec = DEFAULT_CONNECT_DISCONNECT_TIMEOUT_SEC
+        self._operation_timeout_sec = DEFAULT_OPERATION_TIMEOUT_SEC
+        self._message_queue_size = messageQueueSize
+        self._message_queue = None
+        self._loop = None
+        self._protocol = None
+        self._connected = False
+        self._connack_future = None
+        self._pending_acks = dict()  # mid -> (future, error class)
+        self._misc_handle = None
+
+    # Configuration APIs
+    def configureLastWill(self, topic, payload, QoS, retain=False):
+        """
+        **Description**
+
+        Used to configure the last will topic, payload and QoS of the client. Should be called before connect.
+
+        **Syntax**
+
+        .. code:: python
+
+          myAWSIoTMQTTClient.configureLastWill("last/Will/Topic", "lastWillPayload", 0)
+
+        **Parameters**
+
+        *topic* - Topic name that last will publishes to.
+
+        *payload* - Payload to publish for last will.
+
+        *QoS* - Quality of Service. Could be 0 or 1.
+
+        **Returns**
+
+        None
+
+        """
+        self._paho_client.will_set(topic, payload, QoS, retain)
+
+    def clearLastWill(self):
+        """
+        **Description**
+
+        Used to clear the last will configuration that is previously set through configureLastWill.
+
+        **Syntax**
+
+        .. code:: python
+
+          myAWSIoTMQTTClient.clearLastWill()
+
+        **Parameter**
+
+        None
+
+        **Returns**
+
+        None
+
+        """
+        self._paho_client.will_clear()
+
+    def configureEndpoint(self, hostName, portNumber):
+        """
+        **Description**
+
+        Used to configure the host name and port number the client tries to connect to. Should be called
+        before connect.
+
+        **Syntax**
+
+        .. code:: python
+
+          myAWSIoTMQTTClient.configureEndpoint("random.iot.region.amazonaws.com", 8883)
+
+        **Parameters**
+
+        *hostName* - String that denotes the host name of the user-specific AWS IoT endpoint.
+
+        *portNumber* - Integer that denotes the port number to connect to. Could be :code:`8883` for
+        TLSv1.2 Mutual Authentication or :code:`443` for TLSv1.2 Mutual Authentication with ALPN extension.
+
+        **Returns**
+
+        None
+
+        """
+        self._endpoint_provider = EndpointProvider()
+        self._endpoint_provider.set_host(hostName)
+        self._endpoint_provider.set_port(portNumber)
+
+    def configureCredentials(self, CAFilePath, KeyPath, CertificatePath):
+        """
+        **Description**
+
+        Used to configure the rootCA, private key and certificate files. Should be called before connect.
+
+        **Syntax**
+
+        .. code:: python
+
+          myAWSIoTMQTTClient.configureCredentials("PATH/TO/ROOT_CA", "PATH/TO/PRIVATE_KEY", "PATH/TO/CERTIFICATE")
+
+        **Parameters**
+
+        *CAFilePath* - Path to read the root CA file.
+
+        *KeyPath* - Path to read the private key.
+
+        *CertificatePath* - Path to read the certificate.
+
+        **Returns**
+
+        None
+
+        """
+        self._cert_credentials_provider = CertificateCredentialsProvider()
+        self._cert_credentials_provider.set_ca_path(CAFilePath)
+        self._cert_credentials_provider.set_key_path(KeyPath)
+        self._cert_credentials_provider.set_cert_path(CertificatePath)
+
+    def configureConnectDisconnectTimeout(self, timeoutSecond):
+        """
+        **Description**
+
+        Used to configure the time in seconds to wait for the connection to be established and
+        a CONNACK, or for a disconnect to complete. Should be called before connect.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Configure connect/disconnect timeout to be 10 seconds
+          myAWSIoTMQTTClient.configureConnectDisconnectTimeout(10)
+
+        **Parameters**
+
+        *timeoutSecond* - Time in seconds to wait for a CONNACK or a disconnect to complete.
+
+        **Returns**
+
+        None
+
+        """
+        self._connect_disconnect_timeout_sec = timeoutSecond
+
+    def configureMQTTOperationTimeout(self, timeoutSecond):
+        """
+        **Description**
+
+        Used to configure the timeout in seconds for MQTT QoS 1 publish, subscribe and unsubscribe.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Configure MQTT operation timeout to be 5 seconds
+          myAWSIoTMQTTClient.configureMQTTOperationTimeout(5)
+
+        **Parameters**
+
+        *timeoutSecond* - Time in seconds to wait for a PUBACK/SUBACK/UNSUBACK.
+
+        **Returns**
+
+        None
+
+        """
+        self._operation_timeout_sec = timeoutSecond
+
+    def configureUsernamePassword(self, username, password=None):
+        """
+        **Description**
+
+        Used to configure the username and password used in CONNECT packet.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Configure user name and password
+          myAWSIoTMQTTClient.configureUsernamePassword("myUsername", "myPassword")
+
+        **Parameters**
+
+        *username* - Username used in the username field of CONNECT packet.
+
+        *password* - Password used in the password field of CONNECT packet.
+
+        **Returns**
+
+        None
+
+        """
+        self._username = username
+        self._password = password
+
+    def enableMetricsCollection(self):
+        """
+        **Description**
+
+        Used to enable SDK metrics collection. Username field in CONNECT packet will be used to append the SDK name
+        and SDK version in use and communicate to AWS IoT cloud. This metrics collection is enabled by default.
+
+        **Syntax**
+
+        .. code:: python
+
+          myAWSIoTMQTTClient.enableMetricsCollection()
+
+        **Parameters**
+
+        None
+
+        **Returns**
+
+        None
+
+        """
+        self._enable_metrics_collection = True
+
+    def disableMetricsCollection(self):
+        """
+        **Description**
+
+        Used to disable SDK metrics collection.
+
+        **Syntax**
+
+        .. code:: python
+
+          myAWSIoTMQTTClient.disableMetricsCollection()
+
+        **Parameters**
+
+        None
+
+        **Returns**
+
+        None
+
+        """
+        self._enable_metrics_collection = False
+
+    # MQTT functionality APIs
+    async def connect(self, keepAliveIntervalSecond=600):
+        """
+        **Description**
+
+        Connect to AWS IoT on the running event loop, with user-specific keep-alive interval configuration.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Connect to AWS IoT with default keep-alive set to 600 seconds
+          await myAWSIoTMQTTClient.connect()
+          # Connect to AWS IoT with keep-alive interval set to 1200 seconds
+          await myAWSIoTMQTTClient.connect(1200)
+
+        **Parameters**
+
+        *keepAliveIntervalSecond* - Time in seconds for interval of sending MQTT ping request.
+        Default set to 600 seconds.
+
+        **Returns**
+
+        True if the connect attempt succeeded. False if failed.
+
+        """
+        self._logger.info("Performing async connect...")
+        if self._connected:
+            return True
+        self._loop = _get_running_loop()
+        try:
+            await asyncio.wait_for(self._connect(keepAliveIntervalSecond), self._connect_disconnect_timeout_sec)
+        except asyncio.TimeoutError:
+            self._close_transport()
+            self._logger.error("Connect timed out")
+            raise connectTimeoutException()
+        except Exception:
+            self._close_transport()
+            raise
+        return True
+
+    async def _connect(self, keep_alive_sec):
+        host = self._endpoint_provider.get_host()
+        port = self._endpoint_provider.get_port()
+        self._logger.info("Connecting to %s:%d, keep-alive: %f sec", host, port, keep_alive_sec)
+        self._load_username_password()
+        self._get_message_queue()
+
+        protocol = MqttStreamProtocol(self._loop, self._on_data_received, self._on_connection_lost)
+        self._protocol = protocol
+        await self._loop.create_connection(lambda: protocol, host, port,
+                                           ssl=self._create_ssl_context(port), server_hostname=host)
+
+        self._connack_future = self._loop.create_future()
+        rc = self._paho_client.connect_transport(protocol, keep_alive_sec)
+        if MQTT_ERR_SUCCESS != rc:
+            self._logger.error("Connect error: %d", rc)
+            raise connectError(rc)
+        rc = await self._connack_future
+        if MQTT_ERR_SUCCESS != rc:
+            self._logger.error("Connect error: %d", rc)
+            raise connectError(rc)
+        self._schedule_misc()
+
+    def _create_ssl_context(self, port):
+        builder = SSLContextBuilder()\
+            .with_ca_certs(self._cert_credentials_provider.get_ca_path())\
+            .with_cert_key_pair(self._cert_credentials_provider.get_cert_path(),
+                                self._cert_credentials_provider.get_key_path())\
+            .with_cert_reqs(ssl.CERT_REQUIRED)\
+            .with_check_hostname(True)
+        if port == 443:
+            builder.with_alpn_protocols([ALPN_PROTCOLS])
+        return builder.build_shared()
+
+    def _load_username_password(self):
+        username_candidate = self._username
+        if self._enable_metrics_collection:
+            username_candidate += METRICS_PREFIX
+            username_candidate += AWSIoTPythonSDK.__version__
+        self._paho_client.username_pw_set(username_candidate, self._password)
+
+    async def disconnect(self):
+        """
+        **Description**
+
+        Disconnect from AWS IoT.
+
+        **Syntax**
+
+        .. code:: python
+
+          await myAWSIoTMQTTClient.disconnect()
+
+        **Parameters**
+
+        None
+
+        **Returns**
+
+        True if the disconnect attempt succeeded. False if failed.
+
+        """
+        self._logger.info("Performing async disconnect...")
+        protocol = self._protocol
+        if protocol is None:
+            return True
+        rc = self._paho_client.disconnect()
+        if MQTT_ERR_SUCCESS != rc and MQTT_ERR_NO_CONN != rc:
+            self._logger.error("Disconnect error: %d", rc)
+            raise disconnectError(rc)
+        try:
+            await asyncio.wait_for(protocol.wait_closed(), self._connect_disconnect_timeout_sec)
+        except asyncio.TimeoutError:
+            self._logger.error("Disconnect timed out")
+            raise disconnectTimeoutException()
+        return True
+
+    async def publish(self, topic, payload, QoS, retain=False):
+        """
+        **Description**
+
+        Publish a new message to the desired topic with QoS. For QoS 1 this waits for the PUBACK,
+        for QoS 0 it waits until the transport is ready to accept more data.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Publish a QoS0 message "myPayload" to topic "myTopic"
+          await myAWSIoTMQTTClient.publish("myTopic", "myPayload", 0)
+          # Publish a QoS1 message "myPayloadWithQos1" to topic "myTopic/sub"
+          await myAWSIoTMQTTClient.publish("myTopic/sub", "myPayloadWithQos1", 1)
+
+        **Parameters**
+
+        *topic* - Topic name to publish to.
+
+        *payload* - Payload to publish. Could be a string, bytes or a bytes-like object.
+
+        *QoS* - Quality of Service. Could be 0 or 1.
+
+        *retain* - Boolean that denotes whether the message should be retained by the broker.
+
+        **Returns**
+
+        True if the publish request has been sent to paho. False if the request did not reach paho.
+
+        """
+        self._check_connected(publishError)
+        rc, mid = self._paho_client.publish(topic, payload, QoS, retain)
+        if MQTT_ERR_SUCCESS != rc:
+            self._logger.error("Publish error: %d", rc)
+            raise publishError(rc)
+        if QoS > 0:
+            await self._wait_for_ack(mid, publishError, publishTimeoutException)
+        await self._protocol.drain()
+        return True
+
+    async def subscribe(self, topic, QoS, callback=None):
+        """
+        **Description**
+
+        Subscribe to the desired topic and wait for the SUBACK.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Subscribe to "myTopic" with QoS0, messages are read through async iteration
+          await myAWSIoTMQTTClient.subscribe("myTopic", 0)
+          # Subscribe to "myTopic/#" with QoS1 and a custom callback
+          await myAWSIoTMQTTClient.subscribe("myTopic/#", 1, customCallback)
+
+        **Parameters**
+
+        *topic* - Topic name or filter to subscribe to.
+
+        *QoS* - Quality of Service. Could be 0 or 1.
+
+        *callback* - Function or coroutine function to be called when a new message for the subscribed
+        topic comes in. Should be in form :code:`customCallback(client, userdata, message)`, like
+        the synchronous client, where client and userdata are None. Messages handled by a callback
+        are not delivered to async iteration.
+
+        **Returns**
+
+        True if the subscribe attempt succeeded. False if failed.
+
+        """
+        self._check_connected(subscribeError)
+        if callback is not None:
+            self._paho_client.message_callback_add(topic, self._create_message_callback(callback))
+        rc, mid = self._paho_client.subscribe(topic, QoS)
+        if MQTT_ERR_SUCCESS != rc:
+            self._logger.error("Subscribe error: %d", rc)
+            raise subscribeError(rc)
+        granted_qos = await self._wait_for_ack(mid, subscribeError, subscribeTimeoutException)
+        if granted_qos and granted_qos[0] == _SUBACK_FAILURE:
+            if callback is not None:
+                self._paho_client.message_callback_remove(topic)
+            self._logger.error("Subscribe rejected by the broker for topic: %s", topic)
+            raise subscribeError(_SUBACK_FAILURE)
+        return True
+
+    async def unsubscribe(self, topic):
+        """
+        **Description**
+
+        Unsubscribe to the desired topic and wait for the UNSUBACK.
+
+        **Syntax**
+
+        .. code:: python
+
+          await myAWSIoTMQTTClient.unsubscribe("myTopic")
+
+        **Parameters**
+
+        *topic* - Topic name or filter to unsubscribe to.
+
+        **Returns**
+
+        True if the unsubscribe attempt succeeded. False if failed.
+
+        """
+        self._check_connected(unsubscribeError)
+        rc, mid = self._paho_client.unsubscribe(topic)
+        if MQTT_ERR_SUCCESS != rc:
+            self._logger.error("Unsubscribe error: %d", rc)
+            raise unsubscribeError(rc)
+        await self._wait_for_ack(mid, unsubscribeError, unsubscribeTimeoutException)
+        self._paho_client.message_callback_remove(topic)
+        return True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # Inbound messages not handled by a subscription callback, until the
+        # connection goes down
+        message_queue = self._get_message_queue()
+        while True:
+            message = await message_queue.get()
+            if message is not _END_OF_MESSAGES:
+                return message
+            if not self._connected:
+                raise StopAsyncIteration
+
+    def _check_connected(self, error_class):
+        if not self._connected:
+            self._logger.error("Not connected")
+            raise error_class(MQTT_ERR_NO_CONN)
+
+    async def _wait_for_ack(self, mid, error_class, timeout_class):
+        # Registered before the first suspension point, so the ack can never
+        # be processed ahead of it
+        future = self._loop.create_future()
+        self._pending_acks[mid] = (future, error_class)
+        try:
+            return await asyncio.wait_for(future, self._operation_timeout_sec)
+        except asyncio.TimeoutError:
+            self._logger.error("Operation with mid %d timed out", mid)
+            raise timeout_class()
+        finally:
+            self._pending_acks.pop(mid, None)
+
+    def _create_message_callback(self, callback):
+        def message_callback(client, userdata, message):
+            result = callback(None, None, message)
+            if asyncio.iscoroutine(result):
+                self._loop.create_task(result)
+        return message_callback
+
+    def _get_message_queue(self):
+        if self._message_queue is None:
+            self._message_queue = asyncio.Queue(self._message_queue_size)
+        return self._message_queue
+
+    def _schedule_misc(self):
+        self._misc_handle = self._loop.call_later(_MISC_INTERVAL_SEC, self._on_misc)
+
+    def _on_misc(self):
+        self._misc_handle = None
+        if self._paho_client.loop_misc() == MQTT_ERR_SUCCESS:
+            self._flush()
+            self._schedule_misc()
+
+    def _flush(self):
+        # Writes queued while paho was inside a user callback
+        if self._paho_client.want_write():
+            self._paho_client.loop_write()
+
+    def _close_transport(self):
+        if self._protocol is not None:
+            self._protocol.close()
+
+    # Transport events
+    def _on_data_received(self):
+        self._paho_client.loop_read()
+        self._flush()
+
+    def _on_connection_lost(self, exc):
+        if exc is not None:
+            self._logger.warning("Connection lost: %s", exc)
+        if self._paho_client.socket() is not None:
+            # Let paho read the EOF and report the disconnect through on_disconnect
+            self._paho_client.loop_read()
+        self._protocol = None
+
+    # Paho callbacks
+    def _on_connect(self, client, userdata, flags, rc):
+        self._logger.debug("CONNACK received with rc: %d", rc)
+        self._connected = MQTT_ERR_SUCCESS == rc
+        if self._connack_future is not None and not self._connack_future.done():
+            self._connack_future.set_result(rc)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._logger.info("Disconnected with rc: %d", rc)
+        self._connected = False
+        if self._misc_handle is not None:
+            self._misc_handle.cancel()
+            self._misc_handle = None
+        if self._connack_future is not None and not self._connack_future.done():
+            self._connack_future.set_result(rc if rc else MQTT_ERR_CONN_LOST)
+        for future, error_class in list(self._pending_acks.values()):
+            if not future.done():
+                future.set_exception(error_class(MQTT_ERR_CONN_LOST))
+        self._pending_acks.clear()
+        self._put_message(_END_OF_MESSAGES)
+
+    def _on_message(self, client, userdata, message):
+        self._put_message(message)
+
+    def _put_message(self, message):
+        message_queue = self._get_message_queue()
+        try:
+            message_queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if message is not _END_OF_MESSAGES:
+                self._logger.warning("Inbound message queue full, dropping message on %s", message.topic)
+                return
+            # Async iteration would never end without the marker, make room for it
+            dropped = message_queue.get_nowait()
+            if dropped is not _END_OF_MESSAGES:
+                self._logger.warning("Inbound message queue full, dropping message on %s", dropped.topic)
+            message_queue.put_nowait(message)
+
+    def _on_ack(self, client, userdata, mid):
+        self._resolve_ack(mid, None)
+
+    def _on_suback(self, client, userdata, mid, granted_qos):
+        self._resolve_ack(mid, granted_qos)
+
+    def _resolve_ack(self, mid, result):
+        pending = self._pending_acks.pop(mid, None)
+        if pending is not None and not pending[0].done():
+            pending[0].set_result(result)
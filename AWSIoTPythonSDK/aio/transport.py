@@ -0,0 +1,119 @@
+# /*
+# * Copyright 2010-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# *
+# * Licensed under the Apache License, Version 2.0 (the "License").
+# * You may not use this file except in compliance with the License.
+# * A copy of the License is located at
+# *
+# *  http://aws.amazon.com/apache2.0
+# *
+# * or in the "license" file accompanying this file. This file is distributed
+# * on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# * express or implied. See the License for the specific language governing
+# * permissions and limitations under the License.
+# */
+
+import errno
+import socket
+import asyncio
+import logging
+from collections import deque
+
+
+class MqttStreamProtocol(asyncio.Protocol):
+    """
+    asyncio protocol that also looks like a non-blocking socket to the paho
+    client: data delivered by the transport is buffered until paho recv()s it
+    in loop_read(), and paho send()s are handed to the transport right away.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, loop, on_data_received, on_connection_lost):
+        self._loop = loop
+        self._on_data_received = on_data_received
+        self._on_connection_lost = on_connection_lost
+        self._transport = None
+        self._chunks = deque()
+        self._closed = False
+        self._write_paused = False
+        self._drain_waiters = deque()
+        self._lost = loop.create_future()
+
+    # asyncio.Protocol
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def data_received(self, data):
+        self._chunks.append(data)
+        self._on_data_received()
+
+    def eof_received(self):
+        return False  # Let the transport close itself
+
+    def connection_lost(self, exc):
+        self._closed = True
+        self._transport = None
+        self._wake_drain_waiters()
+        if not self._lost.done():
+            self._lost.set_result(exc)
+        self._on_connection_lost(exc)
+
+    def pause_writing(self):
+        self._write_paused = True
+
+    def resume_writing(self):
+        self._write_paused = False
+        self._wake_drain_waiters()
+
+    def _wake_drain_waiters(self):
+        while self._drain_waiters:
+            waiter = self._drain_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def drain(self):
+        # Wait until the transport write buffer is below its high-water mark
+        if self._write_paused and not self._closed:
+            waiter = self._loop.create_future()
+            self._drain_waiters.append(waiter)
+            await waiter
+
+    async def wait_closed(self):
+        await self._lost
+
+    def is_closed(self):
+        return self._closed
+
+    # Socket-like interface used by the paho client
+    def recv(self, bufsize):
+        if not self._chunks:
+            if self._closed:
+                return b""
+            raise socket.error(errno.EAGAIN, "No data buffered")
+        data = self._chunks.popleft()
+        if len(data) > bufsize:
+            self._chunks.appendleft(data[bufsize:])
+            data = data[:bufsize]
+        elif self._chunks:
+            # Hand over whatever else is buffered in the same read
+            parts = [data]
+            length = len(data)
+            while self._chunks and length + len(self._chunks[0]) <= bufsize:
+                chunk = self._chunks.popleft()
+                parts.append(chunk)
+                length += len(chunk)
+            data = b"".join(parts)
+        return data
+
+    def send(self, data):
+        if self._closed or self._transport is None:
+            raise socket.error(errno.EPIPE, "Transport is closed")
+        # The transport may keep the data buffered past this call, so it gets
+        # its own copy rather than a view into the caller's payload
+        self._transport.write(bytes(data))
+        return len(data)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
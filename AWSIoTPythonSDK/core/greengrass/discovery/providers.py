@@ -257,9 +257,18 @@ class DiscoveryInfoProvider(object):
                 .with_check_hostname(True)\
                 .with_ciphers(None)\
                 .with_alpn_protocols(['x-amzn-http-ca'])\
-                .build()
+                .build_shared()
             ssl_sock = ssl_context.wrap_socket(sock, server_hostname=self._host, do_handshake_on_connect=False)
             ssl_sock.do_handshake()
+        elif hasattr(ssl, "SSLContext"):
+            ssl_context = SSLContextBuilder()\
+                .with_protocol(ssl_protocol_version)\
+                .with_ca_certs(self._ca_path)\
+                .with_cert_key_pair(self._cert_path, self._key_path)\
+                .with_check_hostname(False)\
+                .with_cert_reqs(ssl.CERT_REQUIRED)\
+                .build_shared()
+            ssl_sock = ssl_context.wrap_socket(sock, server_hostname=self._host)
         else:
             ssl_sock = ssl.wrap_socket(sock,
                                        certfile=self._cert_path,
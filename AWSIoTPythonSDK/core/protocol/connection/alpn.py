@@ -14,6 +14,8 @@
 # */
 
 
+import os
+from threading import Lock
 try:
     import ssl
 except:
@@ -21,43 +23,107 @@ except:
 
 
 class SSLContextBuilder(object):
+    """
+    Collects the settings of an SSLContext. build() creates a new context from them, while
+    build_shared() returns a context from a process-wide cache, so that clients configured with the
+    same credentials share one context instead of parsing the same PEM files for every connection.
+    """
+
+    _shared_contexts = dict()  # Settings -> (file stats, SSLContext)
+    _shared_contexts_lock = Lock()
 
     def __init__(self):
         self.check_supportability()
-        self._ssl_context = ssl.create_default_context()
+        self._protocol = None  # ssl.create_default_context() unless set
+        self._ca_certs = None
+        self._cert_file = None
+        self._key_file = None
+        self._cert_reqs = None
+        self._check_hostname = None
+        self._ciphers = None
+        self._alpn_protocols = None
 
     def check_supportability(self):
         if ssl is None:
             raise RuntimeError("This platform has no SSL/TLS.")
         if not hasattr(ssl, "SSLContext"):
             raise NotImplementedError("This platform does not support SSLContext. Python 2.7.10+/3.5+ is required.")
-        if not hasattr(ssl.SSLContext, "set_alpn_protocols"):
-            raise NotImplementedError("This platform does not support ALPN as TLS extensions. Python 2.7.10+/3.5+ is required.")
+
+    def with_protocol(self, protocol):
+        self._protocol = protocol
+        return self
 
     def with_ca_certs(self, ca_certs):
-        self._ssl_context.load_verify_locations(ca_certs)
+        self._ca_certs = ca_certs
         return self
 
     def with_cert_key_pair(self, cert_file, key_file):
-        self._ssl_context.load_cert_chain(cert_file, key_file)
+        self._cert_file = cert_file
+        self._key_file = key_file
         return self
 
     def with_cert_reqs(self, cert_reqs):
-        self._ssl_context.verify_mode = cert_reqs
+        self._cert_reqs = cert_reqs
         return self
 
     def with_check_hostname(self, check_hostname):
-        self._ssl_context.check_hostname = check_hostname
+        self._check_hostname = check_hostname
         return self
 
     def with_ciphers(self, ciphers):
-        if ciphers is not None:
-            self._ssl_context.set_ciphers(ciphers)  # set_ciphers() does not allow None input. Use default (do nothing) if None
+        self._ciphers = ciphers  # set_ciphers() does not allow None input. Use default (do nothing) if None
         return self
 
     def with_alpn_protocols(self, alpn_protocols):
-        self._ssl_context.set_alpn_protocols(alpn_protocols)
+        if not hasattr(ssl.SSLContext, "set_alpn_protocols"):
+            raise NotImplementedError("This platform does not support ALPN as TLS extensions. Python 2.7.10+/3.5+ is required.")
+        self._alpn_protocols = alpn_protocols
         return self
 
     def build(self):
-        return self._ssl_context
+        if self._protocol is None:
+            ssl_context = ssl.create_default_context()
+        elif self._protocol == ssl.PROTOCOL_SSLv23 and hasattr(ssl, "PROTOCOL_TLS_CLIENT"):
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)  # The same, without the deprecation warning
+        else:
+            ssl_context = ssl.SSLContext(self._protocol)
+        # Hostname checking has to be off before verification can be turned off
+        if self._check_hostname is not None:
+            ssl_context.check_hostname = self._check_hostname
+        if self._cert_reqs is not None:
+            ssl_context.verify_mode = self._cert_reqs
+        if self._ca_certs is not None:
+            ssl_context.load_verify_locations(self._ca_certs)
+        if self._cert_file is not None:
+            ssl_context.load_cert_chain(self._cert_file, self._key_file)
+        if self._ciphers is not None:
+            ssl_context.set_ciphers(self._ciphers)
+        if self._alpn_protocols is not None:
+            ssl_context.set_alpn_protocols(self._alpn_protocols)
+        return ssl_context
+
+    def build_shared(self):
+        # The context must not be modified by the caller. Replacing any of the
+        # files on disk makes the next call build a new one.
+        settings = (self._protocol, self._ca_certs, self._cert_file, self._key_file, self._cert_reqs,
+                    self._check_hostname, self._ciphers,
+                    tuple(self._alpn_protocols) if self._alpn_protocols is not None else None)
+        file_stats = tuple(self._stat(path) for path in (self._ca_certs, self._cert_file, self._key_file))
+        with self._shared_contexts_lock:
+            entry = self._shared_contexts.get(settings)
+            if entry is not None and entry[0] == file_stats:
+                return entry[1]
+        ssl_context = self.build()  # Outside the lock, loading the files is the slow part
+        with self._shared_contexts_lock:
+            self._shared_contexts[settings] = (file_stats, ssl_context)
+        return ssl_context
+
+    @staticmethod
+    def _stat(path):
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None  # Left for build() to report
+        return stat.st_mtime, stat.st_size
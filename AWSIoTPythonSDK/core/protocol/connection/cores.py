@@ -19,7 +19,6 @@
 
 
 import re
-import sys
 import ssl
 import errno
 import struct
@@ -36,6 +35,7 @@ from AWSIoTPythonSDK.exception.AWSIoTExceptions import ClientError
 from AWSIoTPythonSDK.exception.AWSIoTExceptions import wssNoKeyInEnvironmentError
 from AWSIoTPythonSDK.exception.AWSIoTExceptions import wssHandShakeError
 from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_CONNECT_DISCONNECT_TIMEOUT_SEC
+from AWSIoTPythonSDK.core.util.timers import get_shared_timer_wheel
 try:
     from urllib.parse import quote  # Python 3+
 except ImportError:
@@ -67,6 +67,8 @@ class ProgressiveBackOffCore:
         self._currentBackoffTimeSecond = 1
         # Handler for timer
         self._resetBackoffTimer = None
+        # Connection start time when stability is checked lazily instead of by the timer
+        self._stableConnectionStartTime = None
 
     # For custom progressiveBackoff timing configuration
     def configTime(self, srcBaseReconnectTimeSecond, srcMaximumReconnectTimeSecond, srcMinimumConnectTimeSecond):
@@ -86,12 +88,21 @@ class ProgressiveBackOffCore:
     # Cancel the in-waiting timer for resetting backOff time
     # This should get called only when a disconnect/reconnect happens
     def backOff(self):
+        # Block the reconnect logic
+        time.sleep(self.nextBackOffTimeSecond())
+
+    # Non-blocking variant of backOff for callers that schedule the reconnect themselves
+    # Return the time to wait before this reconnect and update the backoff time for the next one
+    def nextBackOffTimeSecond(self):
         self._logger.debug("backOff: current backoff time is: " + str(self._currentBackoffTimeSecond) + " sec.")
         if self._resetBackoffTimer is not None:
             # Cancel the timer
             self._resetBackoffTimer.cancel()
-        # Block the reconnect logic
-        time.sleep(self._currentBackoffTimeSecond)
+        if self._stableConnectionStartTime is not None:
+            if time.time() - self._stableConnectionStartTime >= self._minimumConnectTimeSecond:
+                self._connectionStableThenResetBackoffTime()
+            self._stableConnectionStartTime = None
+        backOffTimeSecond = self._currentBackoffTimeSecond
         # Update the backoff time
         if self._currentBackoffTimeSecond == 0:
             # This is the first attempt to connect, set it to base
@@ -99,18 +110,24 @@ class ProgressiveBackOffCore:
         else:
             # r_cur = min(2^n*r_base, r_max)
             self._currentBackoffTimeSecond = min(self._maximumReconnectTimeSecond, self._currentBackoffTimeSecond * 2)
+        return backOffTimeSecond
 
     # Start the timer for resetting _currentBackoffTimeSecond
     # Will be cancelled upon calling backOff
     def startStableConnectionTimer(self):
-        self._resetBackoffTimer = threading.Timer(self._minimumConnectTimeSecond,
-                                                  self._connectionStableThenResetBackoffTime)
-        self._resetBackoffTimer.start()
+        self._resetBackoffTimer = get_shared_timer_wheel().schedule(self._minimumConnectTimeSecond,
+                                                                    self._connectionStableThenResetBackoffTime)
 
     def stopStableConnectionTimer(self):
         if self._resetBackoffTimer is not None:
             # Cancel the timer
             self._resetBackoffTimer.cancel()
+        self._stableConnectionStartTime = None
+
+    # Thread-free alternative to startStableConnectionTimer
+    # The connection time is checked on the next call to nextBackOffTimeSecond
+    def startStableConnectionClock(self):
+        self._stableConnectionStartTime = time.time()
 
     # Timer callback to reset _currentBackoffTimeSecond
     # If the connection is stable for longer than _minimumConnectTimeSecond,
@@ -125,6 +142,15 @@ class SigV4Core:
 
     _logger = logging.getLogger(__name__)
 
+    # Shared by all instances: a SigV4Core is created for every websocket (re)connect.
+    # Signing keys only depend on the secret key, date, region and service, and stay
+    # valid for the whole day. Keyed by a digest of the secret rather than the secret.
+    _signingKeyCache = dict()  # (secret key digest, date stamp, region, service) -> signing key
+    _signingKeyCacheLock = threading.Lock()
+    # Credentials parsed from a credential file, reused until the file changes
+    _credentialFileCache = dict()  # file path -> (modification time, size, credentials)
+    _emptyPayloadHash = hashlib.sha256(b"").hexdigest()
+
     def __init__(self):
         self._aws_access_key_id = ""
         self._aws_secret_access_key = ""
@@ -152,6 +178,18 @@ class SigV4Core:
 
     def _getSignatureKey(self, key, dateStamp, regionName, serviceName):
         # Returned as a utf-8 byte string in Py3.x
+        cacheKey = (hashlib.sha256(key.encode('utf-8')).digest(), dateStamp, regionName, serviceName)
+        kSigning = self._signingKeyCache.get(cacheKey)
+        if kSigning is None:
+            kSigning = self._deriveSignatureKey(key, dateStamp, regionName, serviceName)
+            with self._signingKeyCacheLock:
+                # Keys of any other date are not going to be used again
+                for staleKey in [k for k in self._signingKeyCache if k[1] != dateStamp]:
+                    del self._signingKeyCache[staleKey]
+                self._signingKeyCache[cacheKey] = kSigning
+        return kSigning
+
+    def _deriveSignatureKey(self, key, dateStamp, regionName, serviceName):
         kDate = self._sign(('AWS4' + key).encode('utf-8'), dateStamp)
         kRegion = self._sign(kDate, regionName)
         kService = self._sign(kRegion, serviceName)
@@ -207,10 +245,20 @@ class SigV4Core:
         ret = dict()
         # Should be compatible with aws cli default credential configuration
         # *NIX/Windows
+        credentialFilePath = os.path.expanduser(self._credentialConfigFilePath)  # Is it compatible with windows? \/
+        # Parse the file again only if it has changed since it was last parsed
+        try:
+            credentialFileStat = os.stat(credentialFilePath)
+            fileVersion = (credentialFileStat.st_mtime, credentialFileStat.st_size)
+        except OSError:
+            fileVersion = None
+        cached = self._credentialFileCache.get(credentialFilePath)
+        if fileVersion is not None and cached is not None and cached[0:2] == fileVersion:
+            self._logger.debug("IAM credentials from file, unchanged since last read.")
+            return dict(cached[2])
         try:
             # See if we get the file
             credentialConfig = ConfigParser()
-            credentialFilePath = os.path.expanduser(self._credentialConfigFilePath)  # Is it compatible with windows? \/
             credentialConfig.read(credentialFilePath)
             # Now we have the file, start looking for credentials...
             # 'default' section
@@ -219,6 +267,8 @@ class SigV4Core:
                 # 'DEFAULT' section
                 ret = self._checkKeyInINIDefault(credentialConfig, "DEFAULT")
             self._logger.debug("IAM credentials from file.")
+            if fileVersion is not None:
+                self._credentialFileCache[credentialFilePath] = fileVersion + (dict(ret),)
         except IOError:
             self._logger.debug("No IAM credential configuration file in " + credentialFilePath)
         except NoSectionError:
@@ -255,7 +305,7 @@ class SigV4Core:
                 "&X-Amz-Date=" + amazonDateComplex + \
                 "&X-Amz-Expires=86400" + \
                 "&X-Amz-SignedHeaders=host"  # Unicode in 3.x
-            hashedPayload = hashlib.sha256(str("").encode('utf-8')).hexdigest()  # Unicode in 3.x
+            hashedPayload = self._emptyPayloadHash  # Unicode in 3.x
             # Create the string to sign
             signedHeaders = "host"
             canonicalHeaders = "host:" + host + "\n"
@@ -286,52 +336,58 @@ class SigV4Core:
         return validEntries
 
 
-# This is an internal class that buffers the incoming bytes into an
-# internal buffer until it gets the full desired length of bytes.
-# At that time, this bufferedReader will be reset.
-# *Error handling:
-# For retry errors (ssl.SSL_ERROR_WANT_READ, ssl.SSL_ERROR_WANT_WRITE, EAGAIN),
-# leave them to the paho _packet_read for further handling (ignored and try
-# again when data is available.
-# For other errors, leave them to the paho _packet_read for error reporting.
-
-
-class _BufferedReader:
-    _sslSocket = None
-    _internalBuffer = None
-    _remainedLength = -1
-    _bufferingInProgress = False
+# Payloads at least this long are masked with NumPy, if available. Below it the
+# cost of setting up the arrays outweighs the faster XOR.
+_NUMPY_MASK_MIN_LENGTH = 1024
+# Size of the buffer wss frames are read ahead into. Whatever fits is read from the
+# socket in one go, and may hold many frames.
+_WSS_READ_BUFFER_SIZE = 65536
+_xorTables = None  # _xorTables[k] translates every byte x to x ^ k, built on first use
+# NumPy is imported by the first payload long enough to use it, so that clients that never
+# mask a large payload do not pay for loading it
+_numpy = None
+_isNumpyImportAttempted = False
 
-    def __init__(self, sslSocket):
-        self._sslSocket = sslSocket
-        self._internalBuffer = bytearray()
-        self._bufferingInProgress = False
 
-    def _reset(self):
-        self._internalBuffer = bytearray()
-        self._remainedLength = -1
-        self._bufferingInProgress = False
-
-    def read(self, numberOfBytesToBeBuffered):
-        if not self._bufferingInProgress:  # If last read is completed...
-            self._remainedLength = numberOfBytesToBeBuffered
-            self._bufferingInProgress = True  # Now we start buffering a new length of bytes
-
-        while self._remainedLength > 0:  # Read in a loop, always try to read in the remained length
-            # If the data is temporarily not available, socket.error will be raised and catched by paho
-            dataChunk = self._sslSocket.read(self._remainedLength)
-            # There is a chance where the server terminates the connection without closing the socket.
-            # If that happens, let's raise an exception and enter the reconnect flow.
-            if not dataChunk:
-                raise socket.error(errno.ECONNABORTED, 0)
-            self._internalBuffer.extend(dataChunk)  # Buffer the data
-            self._remainedLength -= len(dataChunk)  # Update the remained length
-
-        # The requested length of bytes is buffered, recover the context and return it
-        # Otherwise error should be raised
-        ret = self._internalBuffer
-        self._reset()
-        return ret  # This should always be bytearray
+def _getNumpy():
+    global _numpy, _isNumpyImportAttempted
+    if not _isNumpyImportAttempted:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            pass
+        _isNumpyImportAttempted = True
+    return _numpy
+
+
+def _getXorTables():
+    global _xorTables
+    if _xorTables is None:
+        _xorTables = [bytes(bytearray(x ^ k for x in range(256))) for k in range(256)]
+    return _xorTables
+
+
+def _maskPayload(payload, maskKey):
+    # Returns payload XORed with the repeated 4-byte maskKey as a new bytearray.
+    # Byte i is masked with maskKey[i % 4], so the bytes at i, i + 4, i + 8...
+    # all take the same translation and each of the 4 extended slices is masked
+    # with a single bytearray.translate() call instead of a Python loop.
+    payloadBytes = bytearray(payload)
+    payloadLength = len(payloadBytes)
+    numpy = _getNumpy() if payloadLength >= _NUMPY_MASK_MIN_LENGTH else None
+    if numpy is not None:
+        # Whole 32-bit words XORed with the mask read as a word, in the same byte order
+        numberOfWords = payloadLength // 4
+        words = numpy.frombuffer(payloadBytes, dtype=numpy.uint32, count=numberOfWords)
+        words ^= numpy.frombuffer(bytes(maskKey), dtype=numpy.uint32)[0]
+        for i in range(numberOfWords * 4, payloadLength):
+            payloadBytes[i] ^= maskKey[i % 4]
+        return payloadBytes
+    xorTables = _getXorTables()
+    for i in range(min(4, payloadLength)):
+        payloadBytes[i::4] = payloadBytes[i::4].translate(xorTables[maskKey[i]])
+    return payloadBytes
 
 
 # This is the internal class that sends requested data out chunk by chunk according
@@ -364,6 +420,9 @@ class _BufferedWriter:
         self._writingInProgress = False
         self._requestedDataLength = -1
 
+    def isWriting(self):
+        return self._writingInProgress
+
     # Input data for this function needs to be an encoded wss frame
     # Always request for packet[pos=0:] (raw MQTT data)
     def write(self, encodedData, payloadLength):
@@ -409,21 +468,14 @@ class SecuredWebSocketCore:
         # Endpoint Info
         self._hostAddress = hostAddress
         self._portNumber = portNumber
-        # Section Flags
-        self._hasOpByte = False
-        self._hasPayloadLengthFirst = False
-        self._hasPayloadLengthExtended = False
-        self._hasMaskKey = False
-        self._hasPayload = False
-        # Properties for current websocket frame
-        self._isFIN = False
-        self._RSVBits = None
-        self._opCode = None
-        self._needMaskKey = False
-        self._payloadLengthBytesLength = 1
-        self._payloadLength = 0
-        self._maskKey = None
-        self._payloadDataBuffer = bytearray()  # Once the whole wss connection is lost, there is no need to keep the buffered payload
+        # Read-ahead buffer. Bytes from _readStart to _readEnd have been read from the
+        # socket but not consumed yet. The buffer never grows, so the view stays valid.
+        self._readBuffer = bytearray(_WSS_READ_BUFFER_SIZE)
+        self._readView = memoryview(self._readBuffer)
+        self._readStart = 0
+        self._readEnd = 0
+        # Payload bytes of the current data frame that have not been handed to paho yet
+        self._framePayloadRemaining = 0
         try:
             self._handShake(hostAddress, portNumber)
         except wssNoKeyInEnvironmentError:  # Handle SigV4 signing and websocket handshaking errors
@@ -433,7 +485,6 @@ class SecuredWebSocketCore:
         except ClientError as e:
             raise ValueError(e.message)
         # Now we have a socket with secured websocket...
-        self._bufferedReader = _BufferedReader(self._sslSocket)
         self._bufferedWriter = _BufferedWriter(self._sslSocket)
 
     def _createSigV4Core(self):
@@ -444,23 +495,6 @@ class SecuredWebSocketCore:
         # os.urandom returns ascii str in 2.x, converted to bytearray
         # os.urandom returns bytes in 3.x, converted to bytearray
 
-    def _reset(self):  # Reset the context for wss frame reception
-        # Control info
-        self._hasOpByte = False
-        self._hasPayloadLengthFirst = False
-        self._hasPayloadLengthExtended = False
-        self._hasMaskKey = False
-        self._hasPayload = False
-        # Frame Info
-        self._isFIN = False
-        self._RSVBits = None
-        self._opCode = None
-        self._needMaskKey = False
-        self._payloadLengthBytesLength = 1
-        self._payloadLength = 0
-        self._maskKey = None
-        # Never reset the payloadData since we might have fragmented MQTT data from the pervious frame
-
     def _generateWSSKey(self):
         return base64.b64encode(os.urandom(128))  # Bytes
 
@@ -554,11 +588,10 @@ class SecuredWebSocketCore:
             maskKey = self._generateMaskKey()
             ret.extend(maskKey)
         # Mask the payload
-        payloadBytes = bytearray(rawPayload)
         if maskBit == 1:
-            for i in range(0, payloadLength):
-                payloadBytes[i] ^= maskKey[i % 4]
-        ret.extend(payloadBytes)
+            ret.extend(_maskPayload(rawPayload, maskKey))
+        else:
+            ret.extend(rawPayload)
         # Return the assembled wss frame
         return ret
 
@@ -574,106 +607,133 @@ class SecuredWebSocketCore:
         # Frames sent from client to server must be masked
         self._sslSocket.write(self._encodeFrame(b"", self._OP_PONG, masked=1))
 
-    # Override sslSocket read. Always read from the wss internal payload buffer, which
-    # contains the masked MQTT packet. This read will decode ONE wss frame every time
-    # and load in the payload for MQTT _packet_read. At any time, MQTT _packet_read
-    # should be able to read a complete MQTT packet from the payload (buffered per wss
-    # frame payload). If the MQTT packet is break into separate wss frames, different
-    # chunks will be buffered in separate frames and MQTT _packet_read will not be able
-    # to collect a complete MQTT packet to operate on until the necessary payload is
-    # fully buffered.
-    # If the requested number of bytes are not available, SSL_ERROR_WANT_READ will be
-    # raised to trigger another call of _packet_read when the data is available again.
+    # Override sslSocket read. Like a socket read, this returns up to the requested
+    # number of bytes of MQTT data: the payload of the current wss frame, as far as it
+    # has been read from the socket. MQTT _packet_read buffers the returned bytes and
+    # reassembles MQTT packets that span several reads or frames.
+    # Frames are decoded from a read-ahead buffer that is filled with as much as the
+    # socket has, so a burst of frames costs one socket read rather than separate reads
+    # for every op byte, length and payload. Payload is copied out once, straight from
+    # the buffer.
+    # If no payload data is available, SSL_ERROR_WANT_READ will be raised to trigger
+    # another call of _packet_read when the data is available again.
     def read(self, numberOfBytes):
-        # Check if we have enough data for paho
-        # _payloadDataBuffer will not be empty ony when the payload of a new wss frame
-        # has been unmasked.
-        if len(self._payloadDataBuffer) >= numberOfBytes:
-            ret = self._payloadDataBuffer[0:numberOfBytes]
-            self._payloadDataBuffer = self._payloadDataBuffer[numberOfBytes:]
-            # struct.unpack(fmt, string) # Py2.x
-            # struct.unpack(fmt, buffer) # Py3.x
-            # Here ret is always in bytes (buffer interface)
-            if sys.version_info[0] < 3:  # Py2.x
-                ret = str(ret)
-            return ret
-        # Emmm, We don't. Try to buffer from the socket (It's a new wss frame).
-        if not self._hasOpByte:  # Check if we need to buffer OpByte
-            opByte = self._bufferedReader.read(1)
-            self._isFIN = (opByte[0] & 0x80) == 0x80
-            self._RSVBits = (opByte[0] & 0x70)
-            self._opCode = (opByte[0] & 0x0f)
-            self._hasOpByte = True  # Finished buffering opByte
+        while True:
+            available = self._readEnd - self._readStart
+            if self._framePayloadRemaining > 0:
+                if available == 0:
+                    self._fillReadBuffer()
+                    continue
+                length = min(numberOfBytes, self._framePayloadRemaining, available)
+                ret = self._readView[self._readStart:self._readStart + length].tobytes()
+                self._readStart += length
+                self._framePayloadRemaining -= length
+                return ret
+            # At a frame boundary, decode the next frame header
+            header = self._decodeFrameHeader()
+            if header is None:
+                self._fillReadBuffer()
+                continue
+            opByte, masked, headerLength, payloadLength = header
             # Check if any of the RSV bits are set, if so, close the connection
             # since client never sends negotiated extensions
-            if self._RSVBits != 0x0:
+            if opByte & 0x70 != 0x0:
                 self._closeWssConnection()
                 self._connectStatus = self._WebsocketDisconnected
-                self._payloadDataBuffer = bytearray()
+                self._discardReadBuffer()
                 raise socket.error(ssl.SSL_ERROR_WANT_READ, "RSV bits set with NO negotiated extensions.")
-        if not self._hasPayloadLengthFirst:  # Check if we need to buffer First Payload Length byte
-            payloadLengthFirst = self._bufferedReader.read(1)
-            self._hasPayloadLengthFirst = True  # Finished buffering first byte of payload length
-            self._needMaskKey = (payloadLengthFirst[0] & 0x80) == 0x80
-            payloadLengthFirstByteArray = bytearray()
-            payloadLengthFirstByteArray.extend(payloadLengthFirst)
-            self._payloadLength = (payloadLengthFirstByteArray[0] & 0x7f)
-
-            if self._payloadLength == 126:
-                self._payloadLengthBytesLength = 2
-                self._hasPayloadLengthExtended = False  # Force to buffer the extended
-            elif self._payloadLength == 127:
-                self._payloadLengthBytesLength = 8
-                self._hasPayloadLengthExtended = False  # Force to buffer the extended
-            else:  # _payloadLength <= 125:
-                self._hasPayloadLengthExtended = True  # No need to buffer extended payload length
-        if not self._hasPayloadLengthExtended:  # Check if we need to buffer Extended Payload Length bytes
-            payloadLengthExtended = self._bufferedReader.read(self._payloadLengthBytesLength)
-            self._hasPayloadLengthExtended = True
-            if sys.version_info[0] < 3:
-                payloadLengthExtended = str(payloadLengthExtended)
-            if self._payloadLengthBytesLength == 2:
-                self._payloadLength = struct.unpack("!H", payloadLengthExtended)[0]
-            else:  # _payloadLengthBytesLength == 8
-                self._payloadLength = struct.unpack("!Q", payloadLengthExtended)[0]
-
-        if self._needMaskKey:  # Response from server is masked, close the connection
-            self._closeWssConnection()
-            self._connectStatus = self._WebsocketDisconnected
-            self._payloadDataBuffer = bytearray()
-            raise socket.error(ssl.SSL_ERROR_WANT_READ, "Server response masked, closing connection and try again.")
-
-        if not self._hasPayload:  # Check if we need to buffer the payload
-            payloadForThisFrame = self._bufferedReader.read(self._payloadLength)
-            self._hasPayload = True
-            # Client side should never received a masked packet from the server side
-            # Unmask it as needed
-            #if self._needMaskKey:
-            #    for i in range(0, self._payloadLength):
-            #        payloadForThisFrame[i] ^= self._maskKey[i % 4]
-            # Append it to the internal payload buffer
-            self._payloadDataBuffer.extend(payloadForThisFrame)
-        # Now we have the complete wss frame, reset the context
-        # Check to see if it is a wss closing frame
-        if self._opCode == self._OP_CONNECTION_CLOSE:
-            self._connectStatus = self._WebsocketDisconnected
-            self._payloadDataBuffer = bytearray()  # Ensure that once the wss closing frame comes, we have nothing to read and start all over again
-        # Check to see if it is a wss PING frame
-        if self._opCode == self._OP_PING:
-            self._sendPONG()  # Nothing more to do here, if the transmission of the last wssMQTT packet is not finished, it will continue
-        self._reset()
-        # Check again if we have enough data for paho
-        if len(self._payloadDataBuffer) >= numberOfBytes:
-            ret = self._payloadDataBuffer[0:numberOfBytes]
-            self._payloadDataBuffer = self._payloadDataBuffer[numberOfBytes:]
-            # struct.unpack(fmt, string) # Py2.x
-            # struct.unpack(fmt, buffer) # Py3.x
-            # Here ret is always in bytes (buffer interface)
-            if sys.version_info[0] < 3:  # Py2.x
-                ret = str(ret)
-            return ret
-        else:  # Fragmented MQTT packets in separate wss frames
-            raise socket.error(ssl.SSL_ERROR_WANT_READ, "Not a complete MQTT packet payload within this wss frame.")
+            if masked:  # Response from server is masked, close the connection
+                self._closeWssConnection()
+                self._connectStatus = self._WebsocketDisconnected
+                self._discardReadBuffer()
+                raise socket.error(ssl.SSL_ERROR_WANT_READ, "Server response masked, closing connection and try again.")
+            opCode = opByte & 0x0f
+            if opCode < 0x8:  # Data frame, its payload goes to paho as it arrives
+                self._readStart += headerLength
+                self._framePayloadRemaining = payloadLength
+                continue
+            # Control frame, wait for the whole of it
+            if available < headerLength + payloadLength:
+                self._fillReadBuffer()
+                continue
+            self._readStart += headerLength + payloadLength
+            # Check to see if it is a wss closing frame
+            if opCode == self._OP_CONNECTION_CLOSE:
+                self._connectStatus = self._WebsocketDisconnected
+                self._discardReadBuffer()  # Ensure that once the wss closing frame comes, we have nothing to read and start all over again
+                raise socket.error(ssl.SSL_ERROR_WANT_READ, "Wss closing frame received.")
+            # Check to see if it is a wss PING frame
+            if opCode == self._OP_PING:
+                self._sendPONG()  # Nothing more to do here, if the transmission of the last wssMQTT packet is not finished, it will continue
+
+    # Returns (opByte, masked, headerLength, payloadLength) of the frame at the read
+    # cursor, or None if its header has not been read completely yet
+    def _decodeFrameHeader(self):
+        start = self._readStart
+        available = self._readEnd - start
+        if available < 2:
+            return None
+        opByte = self._readBuffer[start]
+        payloadLengthFirst = self._readBuffer[start + 1]
+        masked = (payloadLengthFirst & 0x80) == 0x80
+        payloadLength = payloadLengthFirst & 0x7f
+        headerLength = 2
+        if payloadLength == 126:
+            headerLength = 4
+            if available < headerLength:
+                return None
+            payloadLength = struct.unpack_from("!H", self._readBuffer, start + 2)[0]
+        elif payloadLength == 127:
+            headerLength = 10
+            if available < headerLength:
+                return None
+            payloadLength = struct.unpack_from("!Q", self._readBuffer, start + 2)[0]
+        return opByte, masked, headerLength, payloadLength
+
+    # Reads whatever the socket has into the free space of the read-ahead buffer.
+    # Unconsumed bytes are moved to the front first if the end has been reached. This
+    # only happens when they are not enough to make progress: part of a frame header or
+    # of a control frame, so at most a few hundred bytes are ever moved.
+    def _fillReadBuffer(self):
+        if self._readStart == self._readEnd:
+            self._readStart = self._readEnd = 0
+        elif self._readEnd == len(self._readBuffer):
+            length = self._readEnd - self._readStart
+            self._readBuffer[0:length] = self._readView[self._readStart:self._readEnd].tobytes()
+            self._readStart = 0
+            self._readEnd = length
+        # If the data is temporarily not available, socket.error will be raised and catched by paho
+        length = self._sslSocket.read(len(self._readBuffer) - self._readEnd, self._readView[self._readEnd:])
+        # There is a chance where the server terminates the connection without closing the socket.
+        # If that happens, let's raise an exception and enter the reconnect flow.
+        if not length:
+            raise socket.error(errno.ECONNABORTED, 0)
+        self._readEnd += length
+
+    def _discardReadBuffer(self):
+        self._readStart = self._readEnd = 0
+        self._framePayloadRemaining = 0
+
+    # Number of bytes that can be read without waiting on the socket
+    def pending(self):
+        if self._sslSocket is None:
+            return 0
+        return self._readablePayloadLength() + self._sslSocket.pending()
+
+    # Buffered bytes read() can make progress with: payload of the current data frame,
+    # or the next frame as far as it needs to be buffered for read() to act on it. 0 if
+    # the rest of it is still on its way.
+    def _readablePayloadLength(self):
+        available = self._readEnd - self._readStart
+        if self._framePayloadRemaining > 0:
+            return min(self._framePayloadRemaining, available)
+        header = self._decodeFrameHeader()
+        if header is None:
+            return 0
+        opByte, masked, headerLength, payloadLength = header
+        if (opByte & 0x0f) < 0x8 or masked or available >= headerLength + payloadLength:
+            return available
+        return 0
 
     def write(self, bytesToBeSent):
         # When there is a disconnection, select will report a TypeError which triggers the reconnect.
@@ -682,7 +742,12 @@ class SecuredWebSocketCore:
         # This 'low-level' socket write op should always be able to write to plain socket.
         # Error reporting is performed by Python socket itself.
         # Wss closing frame handling is performed in the wss read.
-        return self._bufferedWriter.write(self._encodeFrame(bytesToBeSent, self._OP_BINARY, 1), len(bytesToBeSent))
+        # While a frame is partially sent, the same bytes are passed in again and the frame
+        # already encoded for them is resumed, so there is no need to encode them again.
+        encodedFrame = None
+        if not self._bufferedWriter.isWriting():
+            encodedFrame = self._encodeFrame(bytesToBeSent, self._OP_BINARY, 1)
+        return self._bufferedWriter.write(encodedFrame, len(bytesToBeSent))
 
     def close(self):
         if self._sslSocket is not None:
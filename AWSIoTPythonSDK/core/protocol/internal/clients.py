@@ -105,7 +105,19 @@ class InternalAsyncMqttClient(object):
 
     def set_socket_factory(self, socket_factory):
         self._paho_client.socket_factory_set(socket_factory)
+
+    def set_connection_host(self, connection_host):
+        self._paho_client.connection_host_set(connection_host)
         
+    def configure_write_coalescing(self, max_bytes, max_delay_sec):
+        self._paho_client.write_coalescing_set(max_bytes, max_delay_sec)
+
+    def configure_ws_frame_aggregation(self, max_bytes):
+        self._paho_client.ws_frame_aggregation_set(max_bytes)
+
+    def get_tls_session_metrics(self):
+        return self._paho_client.tls_session_metrics()
+
     def configure_reconnect_back_off(self, base_reconnect_quiet_sec, max_reconnect_quiet_sec, stable_connection_sec):
         self._paho_client.setBackoffTiming(base_reconnect_quiet_sec, max_reconnect_quiet_sec, stable_connection_sec)
 
@@ -189,6 +201,15 @@ class InternalAsyncMqttClient(object):
                 self._event_callback_map[mid] = ack_callback
             return rc, mid
 
+    # Subscribes to all (topic, qos) tuples in one SUBSCRIBE packet. ack_callback gets the granted QoS of every topic.
+    def subscribe_multiple(self, topic_qos_list, ack_callback=None):
+        with self._event_callback_map_lock:
+            rc, mid = self._paho_client.subscribe(topic_qos_list)
+            if MQTT_ERR_SUCCESS == rc and ack_callback:
+                self._logger.debug("Filling in custom suback event callback...")
+                self._event_callback_map[mid] = ack_callback
+            return rc, mid
+
     def unsubscribe(self, topic, ack_callback=None):
         with self._event_callback_map_lock:
             rc, mid = self._paho_client.unsubscribe(topic)
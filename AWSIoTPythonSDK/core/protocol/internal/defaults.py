@@ -15,6 +15,20 @@
 
 DEFAULT_CONNECT_DISCONNECT_TIMEOUT_SEC = 30
 DEFAULT_OPERATION_TIMEOUT_SEC = 5
+DEFAULT_MAX_TOPICS_PER_SUBSCRIBE = 8
 DEFAULT_DRAINING_INTERNAL_SEC = 0.5
+DEFAULT_DRAINING_MAX_RATE_PER_SEC = 100
+DEFAULT_DRAINING_MAX_WINDOW = 20
+DEFAULT_DRAINING_ACK_TIMEOUT_SEC = 5
+DEFAULT_EVENT_DISPATCH_BATCH_SIZE = 256
+DEFAULT_EVENT_DISPATCH_MAX_LATENCY_SEC = 0.01
+DEFAULT_MESSAGE_CALLBACK_QUEUE_SIZE = 1000
+DEFAULT_MESSAGE_CALLBACK_STOP_CHECK_INTERVAL_SEC = 0.5
+DEFAULT_OFFLINE_QUEUE_SEGMENT_SIZE_BYTES = 1048576
+DEFAULT_CONNECTION_HOST_DISPATCH_WORKERS = 4
+DEFAULT_CONNECTION_HOST_MISC_INTERVAL_SEC = 1.0
+DEFAULT_WRITE_COALESCING_MAX_BYTES = 16384
+DEFAULT_WRITE_COALESCING_MAX_DELAY_SEC = 0
+DEFAULT_WSS_FRAME_AGGREGATION_MAX_BYTES = 16384
 METRICS_PREFIX = "?SDK=Python&Version="
 ALPN_PROTCOLS = "x-amzn-mqtt-ca"
\ No newline at end of file
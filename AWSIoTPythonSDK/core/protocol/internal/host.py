@@ -0,0 +1,387 @@
+# /*
+# * Copyright 2010-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# *
+# * Licensed under the Apache License, Version 2.0 (the "License").
+# * You may not use this file except in compliance with the License.
+# * A copy of the License is located at
+# *
+# *  http://aws.amazon.com/apache2.0
+# *
+# * or in the "license" file accompanying this file. This file is distributed
+# * on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# * express or implied. See the License for the specific language governing
+# * permissions and limitations under the License.
+# */
+
+import sys
+import time
+import heapq
+import errno
+import socket
+import logging
+import threading
+from threading import Thread
+from threading import Event
+from threading import Lock
+from collections import deque
+from AWSIoTPythonSDK.core.protocol.paho.client import MQTT_ERR_SUCCESS
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_CONNECTION_HOST_DISPATCH_WORKERS
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_CONNECTION_HOST_MISC_INTERVAL_SEC
+try:
+    import selectors
+except ImportError:
+    selectors = None
+if sys.version_info[0] < 3:
+    from Queue import Queue
+else:
+    from queue import Queue
+
+
+class _HostedConnection(object):
+
+    def __init__(self, client):
+        self.client = client
+        self.sock = None  # Network socket currently registered with the selector
+        self.events = 0
+        self.reconnecting = False
+        self.write_scheduled = False  # Held back for write coalescing, on the write schedule
+        self.active = True
+
+
+class ConnectionHost(object):
+    """
+    Runs the network I/O of many paho clients on one selector thread, and their event
+    dispatching on a small shared pool of threads, instead of two threads per client.
+
+    The selector thread does for every registered client what paho's loop_forever() does:
+    reads, writes when packets are queued (signalled through the client's wakeup hook),
+    runs loop_misc() once a second and reconnects with progressive backoff after a connection
+    loss. Backoff is scheduled rather than slept, and the blocking reconnect itself runs on
+    the dispatch pool, so one client never holds up the others.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, num_dispatch_workers=DEFAULT_CONNECTION_HOST_DISPATCH_WORKERS):
+        self.check_supportability()
+        self._num_dispatch_workers = num_dispatch_workers
+        self._lifecycle_lock = Lock()
+        self._is_running = False
+        self._selector = None
+        self._wakeup_r = None
+        self._wakeup_w = None
+        self._network_thread = None
+        self._dispatch_queue = Queue()
+        self._dispatch_threads = []
+        self._commands = deque()
+        self._pending_writes = deque()  # Clients that queued packets since the last select
+        self._waiting = False
+        self._wakeup_signalled = False
+        self._connections = dict()  # paho client -> _HostedConnection, owned by the selector thread
+        self._reconnect_schedule = []  # heap of (due time, sequence, _HostedConnection)
+        self._write_schedule = []  # heap of (due time, sequence, _HostedConnection)
+        self._schedule_sequence = 0
+
+    def check_supportability(self):
+        if selectors is None:
+            raise NotImplementedError("This platform does not support the selectors module. Python 3.4+ is required.")
+
+    def start(self):
+        with self._lifecycle_lock:
+            if self._is_running:
+                return
+            self._is_running = True
+            self._selector = selectors.DefaultSelector()
+            self._wakeup_r, self._wakeup_w = socket.socketpair()
+            self._wakeup_r.setblocking(False)
+            self._wakeup_w.setblocking(False)
+            self._selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+            self._dispatch_threads = []
+            for _ in range(self._num_dispatch_workers):
+                dispatch_thread = Thread(target=self._work)
+                dispatch_thread.daemon = True
+                dispatch_thread.start()
+                self._dispatch_threads.append(dispatch_thread)
+            self._network_thread = Thread(target=self._run)
+            self._network_thread.daemon = True
+            self._network_thread.start()
+            self._logger.debug("Connection host started with %d dispatch workers", self._num_dispatch_workers)
+
+    def stop(self):
+        with self._lifecycle_lock:
+            if not self._is_running:
+                return
+            self._is_running = False
+            self._wake_up()
+            if threading.current_thread() is not self._network_thread:
+                self._network_thread.join()
+            for _ in self._dispatch_threads:
+                self._dispatch_queue.put(None)
+            for dispatch_thread in self._dispatch_threads:
+                if threading.current_thread() is not dispatch_thread:
+                    dispatch_thread.join()
+            self._dispatch_threads = []
+            self._logger.debug("Connection host stopped")
+
+    def is_running(self):
+        return self._is_running
+
+    # Runs task on the shared dispatch pool
+    def submit(self, task):
+        self.start()
+        self._dispatch_queue.put(task)
+
+    # Called by paho loop_start()
+    def register(self, client):
+        self.start()
+        self._post(self._register, client)
+        return MQTT_ERR_SUCCESS
+
+    # Called by paho loop_stop(). Returns once the selector thread no longer touches the client.
+    def unregister(self, client):
+        if threading.current_thread() is self._network_thread:
+            self._unregister(client)
+        elif self._is_running:
+            done = Event()
+            self._post(self._unregister, client, done)
+            done.wait()
+        return MQTT_ERR_SUCCESS
+
+    def get_metrics(self):
+        connections = list(self._connections.values())
+        return {
+            "connections": len(connections),
+            "reconnecting": sum(1 for connection in connections if connection.reconnecting),
+            "dispatch_workers": len(self._dispatch_threads),
+            "dispatch_queued": self._dispatch_queue.qsize()
+        }
+
+    def _post(self, command, *args):
+        self._commands.append((command, args))
+        self._wake_up()
+
+    # Called by paho from any thread whenever the client queues a packet
+    def _on_client_wakeup(self, client):
+        self._pending_writes.append(client)
+        if self._waiting and not self._wakeup_signalled:
+            self._wake_up()
+
+    def _wake_up(self):
+        self._wakeup_signalled = True
+        try:
+            self._wakeup_w.send(b"0")
+        except socket.error as err:
+            if err.errno != errno.EAGAIN:
+                raise
+
+    def _work(self):
+        while True:
+            task = self._dispatch_queue.get()
+            if task is None:
+                break
+            try:
+                task()
+            except Exception as e:
+                self._logger.error("Dispatch task failed: %s", e)
+
+    # Selector thread
+    def _run(self):
+        next_misc_time = time.time() + DEFAULT_CONNECTION_HOST_MISC_INTERVAL_SEC
+        while self._is_running:
+            timeout = next_misc_time - time.time()
+            for schedule in (self._reconnect_schedule, self._write_schedule):
+                if schedule:
+                    timeout = min(timeout, schedule[0][0] - time.time())
+            # Same handshake as paho's loop(): publishers only signal the wakeup socket
+            # while this thread is blocked in select, and at most once until it's drained
+            self._waiting = True
+            if self._pending_writes or self._commands:
+                timeout = 0
+            try:
+                events = self._selector.select(max(0, timeout))
+            finally:
+                self._waiting = False
+            for key, mask in events:
+                connection = key.data
+                if connection is None:
+                    self._wakeup_signalled = False
+                    self._drain(self._wakeup_r)
+                elif not connection.active:
+                    continue
+                elif key.fileobj is connection.sock:
+                    if mask & selectors.EVENT_READ:
+                        self._read(connection)
+                    if mask & selectors.EVENT_WRITE and connection.sock is not None:
+                        self._write(connection)
+            self._run_commands()
+            self._run_pending_writes()
+            now = time.time()
+            if now >= next_misc_time:
+                for connection in list(self._connections.values()):
+                    self._misc(connection)
+                next_misc_time = now + DEFAULT_CONNECTION_HOST_MISC_INTERVAL_SEC
+            self._run_due_reconnects(now)
+            self._run_due_writes(now)
+        self._clean_up()
+
+    def _clean_up(self):
+        for client in list(self._connections.keys()):
+            self._unregister(client)
+        self._run_commands()  # Release unregister waiters
+        self._selector.close()
+        self._wakeup_r.close()
+        self._wakeup_w.close()
+
+    def _run_commands(self):
+        while self._commands:
+            command, args = self._commands.popleft()
+            command(*args)
+
+    def _run_pending_writes(self):
+        while self._pending_writes:
+            connection = self._connections.get(self._pending_writes.popleft())
+            if connection is not None and connection.active:
+                self._write(connection)
+
+    def _drain(self, wakeup_sock):
+        try:
+            while wakeup_sock.recv(4096):
+                pass
+        except socket.error as err:
+            if err.errno != errno.EAGAIN:
+                raise
+
+    def _register(self, client):
+        connection = _HostedConnection(client)
+        self._connections[client] = connection
+        client.wakeup_hook_set(self._on_client_wakeup)
+        self._pending_writes.append(client)  # Packets queued before the hook was set
+        if client.connect_pending():
+            self._schedule_reconnect(connection, 0)
+        else:
+            self._register_socket(connection)
+
+    def _unregister(self, client, done=None):
+        connection = self._connections.pop(client, None)
+        if connection is not None:
+            connection.active = False
+            self._unregister_socket(connection)
+            client.wakeup_hook_set(None)
+        if done is not None:
+            done.set()
+
+    def _register_socket(self, connection):
+        sock = connection.client.socket()
+        if sock is None:
+            self._handle_connection_lost(connection)
+            return
+        connection.sock = sock
+        connection.events = self._wanted_events(connection)
+        self._selector.register(sock, connection.events, connection)
+
+    def _unregister_socket(self, connection):
+        if connection.sock is not None:
+            self._unregister_fileobj(connection.sock)
+            connection.sock = None
+            connection.events = 0
+
+    def _unregister_fileobj(self, fileobj):
+        # Also works for a socket paho has closed already, the selector looks it up by object
+        try:
+            self._selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def _wanted_events(self, connection):
+        if connection.client.want_write() and not connection.write_scheduled:
+            return selectors.EVENT_READ | selectors.EVENT_WRITE
+        return selectors.EVENT_READ
+
+    def _update_events(self, connection):
+        if connection.client.socket() is not connection.sock:
+            # paho closed the socket or replaced it in a reconnect of its own
+            self._unregister_socket(connection)
+            self._register_socket(connection)
+            return
+        events = self._wanted_events(connection)
+        if events != connection.events:
+            self._selector.modify(connection.sock, events, connection)
+            connection.events = events
+
+    def _read(self, connection):
+        rc = connection.client.loop_read()
+        self._check(connection, rc)
+
+    def _write(self, connection):
+        if connection.sock is None or not connection.client.want_write():
+            return
+        deferral_sec = connection.client.write_deferral()
+        if deferral_sec > 0:
+            self._schedule_write(connection, deferral_sec)
+            return
+        rc = connection.client.loop_write()
+        self._check(connection, rc)
+
+    def _misc(self, connection):
+        if connection.sock is None:
+            return
+        rc = connection.client.loop_misc()
+        self._check(connection, rc)
+
+    def _check(self, connection, rc):
+        if MQTT_ERR_SUCCESS != rc or connection.client.socket() is None:
+            self._handle_connection_lost(connection)
+        else:
+            self._update_events(connection)
+
+    def _handle_connection_lost(self, connection):
+        self._unregister_socket(connection)
+        if connection.active and not connection.reconnecting and connection.client.reconnect_wanted():
+            self._schedule_reconnect(connection, connection.client.reconnect_backoff_sec())
+
+    def _schedule_reconnect(self, connection, delay_sec):
+        self._logger.debug("Reconnecting in %f sec", delay_sec)
+        connection.reconnecting = True
+        self._schedule_sequence += 1
+        heapq.heappush(self._reconnect_schedule, (time.time() + delay_sec, self._schedule_sequence, connection))
+
+    def _schedule_write(self, connection, delay_sec):
+        if not connection.write_scheduled:
+            connection.write_scheduled = True
+            self._schedule_sequence += 1
+            heapq.heappush(self._write_schedule, (time.time() + delay_sec, self._schedule_sequence, connection))
+            self._update_events(connection)
+
+    def _run_due_writes(self, now):
+        while self._write_schedule and self._write_schedule[0][0] <= now:
+            _, _, connection = heapq.heappop(self._write_schedule)
+            connection.write_scheduled = False
+            if connection.active:
+                self._write(connection)
+
+    def _run_due_reconnects(self, now):
+        while self._reconnect_schedule and self._reconnect_schedule[0][0] <= now:
+            _, _, connection = heapq.heappop(self._reconnect_schedule)
+            if connection.active:
+                self._dispatch_queue.put(self._create_reconnect_task(connection))
+
+    # Dispatch pool
+    def _create_reconnect_task(self, connection):
+        def reconnect():
+            try:
+                connection.client.reconnect()
+                success = True
+            except Exception as e:
+                self._logger.warn("Reconnect failed: %s", e)
+                success = False
+            self._post(self._on_reconnected, connection, success)
+        return reconnect
+
+    def _on_reconnected(self, connection, success):
+        connection.reconnecting = False
+        if not connection.active:
+            return
+        if success:
+            self._register_socket(connection)
+        else:
+            self._handle_connection_lost(connection)
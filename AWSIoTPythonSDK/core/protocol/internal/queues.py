@@ -13,8 +13,16 @@
 # * permissions and limitations under the License.
 # */
 
+import os
+import mmap
+import struct
 import logging
+from threading import Lock
+from collections import deque
 from AWSIoTPythonSDK.core.util.enums import DropBehaviorTypes
+from AWSIoTPythonSDK.core.protocol.internal.requests import QueueableRequest
+from AWSIoTPythonSDK.core.protocol.internal.requests import RequestTypes
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_OFFLINE_QUEUE_SEGMENT_SIZE_BYTES
 
 
 class AppendResults(object):
@@ -23,7 +31,9 @@ class AppendResults(object):
     APPEND_SUCCESS = 0
 
 
-class OfflineRequestQueue(list):
+# Backed by a deque so that dropping the oldest request and draining from the
+# front are O(1) no matter how long the client has been offline.
+class OfflineRequestQueue(deque):
     _logger = logging.getLogger(__name__)
 
     def __init__(self, max_size, drop_behavior=DropBehaviorTypes.DROP_NEWEST):
@@ -34,7 +44,7 @@ class OfflineRequestQueue(list):
             self._logger.error("init: Drop behavior not supported.")
             raise ValueError("Drop behavior not supported.")
 
-        list.__init__([])
+        deque.__init__(self)
         self._drop_behavior = drop_behavior
         # When self._maximumSize > 0, queue is limited
         # When self._maximumSize == 0, queue is disabled
@@ -70,18 +80,281 @@ class OfflineRequestQueue(list):
             if self._need_drop_messages():
                 # We should drop the newest
                 if DropBehaviorTypes.DROP_NEWEST == self._drop_behavior:
-                    self._logger.warn("append: Full queue. Drop the newest: " + str(data))
+                    self._logger.warn("append: Full queue. Drop the newest: %s", data)
                     ret = AppendResults.APPEND_FAILURE_QUEUE_FULL
                 # We should drop the oldest
                 else:
-                    current_oldest = super(OfflineRequestQueue, self).pop(0)
-                    self._logger.warn("append: Full queue. Drop the oldest: " + str(current_oldest))
+                    current_oldest = self.popleft()
+                    self._logger.warn("append: Full queue. Drop the oldest: %s", current_oldest)
                     super(OfflineRequestQueue, self).append(data)
                     ret = AppendResults.APPEND_FAILURE_QUEUE_FULL
             else:
-                self._logger.debug("append: Add new element: " + str(data))
+                self._logger.debug("append: Add new element: %s", data)
                 super(OfflineRequestQueue, self).append(data)
         else:
-            self._logger.debug("append: Queue is disabled. Drop the message: " + str(data))
+            self._logger.debug("append: Queue is disabled. Drop the message: %s", data)
             ret = AppendResults.APPEND_FAILURE_QUEUE_DISABLED
         return ret
+
+
+class _QueueSegment(object):
+    # One segment file of the persistent queue. Only the segments being read
+    # from and written to are kept mapped.
+
+    def __init__(self, path, sequence, size):
+        self.path = path
+        self.sequence = sequence
+        self.size = size
+        self.read_offset = 0
+        self.write_offset = 0
+        self.count = 0  # Records not consumed yet
+        self._file = None
+        self.map = None
+
+    def is_open(self):
+        return self.map is not None
+
+    def open(self):
+        if self.map is None:
+            self._file = open(self.path, "r+b")
+            self.map = mmap.mmap(self._file.fileno(), self.size)
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self._file.close()
+            self.map = None
+            self._file = None
+
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class PersistentOfflineRequestQueue(object):
+    """
+    Offline queue of publish requests stored in size-capped segment files that
+    are memory-mapped while they are read or written, so queued requests survive
+    a restart of the process and do not have to fit in memory.
+
+    Each record is a flag byte and a 4-byte body length followed by the body:
+    qos, retain, payload kind, topic length, topic and payload. The flag is
+    set to valid only after the body is in place, and flipped to consumed when
+    the record is drained, so a scan on start-up recovers exactly the requests
+    that were queued but not drained. Fully drained segment files are deleted.
+    """
+
+    _FLAG_EMPTY = 0
+    _FLAG_VALID = 1
+    _FLAG_CONSUMED = 2
+    _RECORD_HEADER = struct.Struct("!BI")
+    _BODY_HEADER = struct.Struct("!BBBH")
+    _PAYLOAD_BYTES = 0
+    _PAYLOAD_TEXT = 1
+    _PAYLOAD_NONE = 2
+    _SEGMENT_SUFFIX = ".seg"
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, storage_dir, max_size, drop_behavior=DropBehaviorTypes.DROP_NEWEST,
+                 segment_size=DEFAULT_OFFLINE_QUEUE_SEGMENT_SIZE_BYTES):
+        if not isinstance(max_size, int) or not isinstance(drop_behavior, int):
+            self._logger.error("init: MaximumSize/DropBehavior must be integer.")
+            raise TypeError("MaximumSize/DropBehavior must be integer.")
+        if drop_behavior != DropBehaviorTypes.DROP_OLDEST and drop_behavior != DropBehaviorTypes.DROP_NEWEST:
+            self._logger.error("init: Drop behavior not supported.")
+            raise ValueError("Drop behavior not supported.")
+        self._storage_dir = storage_dir
+        self._max_size = max_size
+        self._drop_behavior = drop_behavior
+        self._segment_size = segment_size
+        self._segments = deque()
+        self._count = 0
+        self._lock = Lock()
+        if not os.path.isdir(storage_dir):
+            os.makedirs(storage_dir)
+        self._recover()
+
+    def __len__(self):
+        return self._count
+
+    def _is_enabled(self):
+        return self._max_size != 0
+
+    def _is_full(self):
+        return 0 < self._max_size <= self._count
+
+    def set_behavior_drop_newest(self):
+        self._drop_behavior = DropBehaviorTypes.DROP_NEWEST
+
+    def set_behavior_drop_oldest(self):
+        self._drop_behavior = DropBehaviorTypes.DROP_OLDEST
+
+    # Same results as OfflineRequestQueue.append. When the queue is full and drops the oldest
+    # requests, the whole oldest segment is dropped, unless it is also the one being written to.
+    def append(self, request):
+        if not self._is_enabled():
+            self._logger.debug("append: Queue is disabled. Drop the message: %s", request)
+            return AppendResults.APPEND_FAILURE_QUEUE_DISABLED
+        record = self._encode(request)
+        with self._lock:
+            ret = AppendResults.APPEND_SUCCESS
+            if self._is_full():
+                if DropBehaviorTypes.DROP_NEWEST == self._drop_behavior:
+                    self._logger.warn("append: Full queue. Drop the newest: %s", request)
+                    return AppendResults.APPEND_FAILURE_QUEUE_FULL
+                if len(self._segments) > 1:
+                    oldest = self._segments.popleft()
+                    self._count -= oldest.count
+                    oldest.remove()
+                    self._logger.warn("append: Full queue. Drop the oldest segment with %d requests: %s", oldest.count, oldest.path)
+                else:
+                    segment = self._segments[0]
+                    segment.open()  # Closed if recovered from disk and not read from since
+                    oldest = self._read_record(segment)
+                    self._logger.warn("append: Full queue. Drop the oldest: %s", oldest)
+                ret = AppendResults.APPEND_FAILURE_QUEUE_FULL
+            self._write_record(record)
+            self._logger.debug("append: Add new element: %s", request)
+            return ret
+
+    def popleft(self):
+        with self._lock:
+            while self._segments:
+                segment = self._segments[0]
+                segment.open()
+                request = self._read_record(segment)
+                if request is not None:
+                    return request
+                if len(self._segments) == 1:
+                    break  # Drained up to the write position
+                self._segments.popleft()
+                segment.remove()
+            raise IndexError("pop from an empty queue")
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments:
+                segment.close()
+
+    def _recover(self):
+        sequences = []
+        for name in os.listdir(self._storage_dir):
+            if name.endswith(self._SEGMENT_SUFFIX):
+                try:
+                    sequences.append(int(name[:-len(self._SEGMENT_SUFFIX)]))
+                except ValueError:
+                    pass
+        for sequence in sorted(sequences):
+            path = self._segment_path(sequence)
+            segment = _QueueSegment(path, sequence, os.path.getsize(path))
+            if segment.size == 0:
+                os.remove(path)
+                continue
+            segment.open()
+            self._scan(segment)
+            segment.close()
+            if segment.count == 0:
+                segment.remove()
+            else:
+                self._segments.append(segment)
+                self._count += segment.count
+        if self._count:
+            self._logger.info("Recovered %d offline requests from %s", self._count, self._storage_dir)
+
+    def _scan(self, segment):
+        offset = 0
+        first_valid = None
+        header_size = self._RECORD_HEADER.size
+        while offset + header_size <= segment.size:
+            flag, length = self._RECORD_HEADER.unpack_from(segment.map, offset)
+            if flag == self._FLAG_EMPTY or offset + header_size + length > segment.size:
+                break
+            if flag == self._FLAG_VALID:
+                segment.count += 1
+                if first_valid is None:
+                    first_valid = offset
+            offset += header_size + length
+        segment.write_offset = offset
+        segment.read_offset = offset if first_valid is None else first_valid
+
+    def _segment_path(self, sequence):
+        return os.path.join(self._storage_dir, "%020d%s" % (sequence, self._SEGMENT_SUFFIX))
+
+    def _new_segment(self, min_size):
+        sequence = self._segments[-1].sequence + 1 if self._segments else 0
+        size = max(self._segment_size, min_size)
+        path = self._segment_path(sequence)
+        with open(path, "wb") as segment_file:
+            segment_file.truncate(size)
+        segment = _QueueSegment(path, sequence, size)
+        segment.open()
+        self._segments.append(segment)
+        return segment
+
+    def _write_record(self, record):
+        header_size = self._RECORD_HEADER.size
+        record_size = header_size + len(record)
+        segment = self._segments[-1] if self._segments else None
+        if segment is None or segment.write_offset + record_size > segment.size:
+            if segment is not None and len(self._segments) > 1:
+                segment.close()  # Neither read from nor written to anymore
+            segment = self._new_segment(record_size)
+        segment.open()
+        offset = segment.write_offset
+        segment.map[offset + header_size:offset + record_size] = record
+        segment.map[offset:offset + header_size] = self._RECORD_HEADER.pack(self._FLAG_EMPTY, len(record))
+        segment.map[offset:offset + 1] = self._flag_byte(self._FLAG_VALID)
+        segment.write_offset = offset + record_size
+        segment.count += 1
+        self._count += 1
+
+    def _read_record(self, segment):
+        header_size = self._RECORD_HEADER.size
+        while segment.read_offset < segment.write_offset:
+            offset = segment.read_offset
+            flag, length = self._RECORD_HEADER.unpack_from(segment.map, offset)
+            segment.read_offset = offset + header_size + length
+            if flag == self._FLAG_VALID:
+                request = self._decode(segment.map[offset + header_size:segment.read_offset])
+                segment.map[offset:offset + 1] = self._flag_byte(self._FLAG_CONSUMED)
+                segment.count -= 1
+                self._count -= 1
+                return request
+        return None
+
+    def _flag_byte(self, flag):
+        return struct.pack("!B", flag)
+
+    def _encode(self, request):
+        topic, payload, qos, retain = request.data
+        if payload is None:
+            kind = self._PAYLOAD_NONE
+            payload = b""
+        elif isinstance(payload, memoryview):
+            kind = self._PAYLOAD_BYTES
+            payload = payload.tobytes()
+        elif isinstance(payload, (bytes, bytearray)):
+            kind = self._PAYLOAD_BYTES
+            payload = bytes(payload)
+        else:
+            kind = self._PAYLOAD_TEXT
+            if isinstance(payload, (int, float)):
+                payload = str(payload)  # Sent as text, as Client.publish does
+            payload = payload.encode("utf-8")
+        utopic = topic.encode("utf-8")
+        return self._BODY_HEADER.pack(qos, 1 if retain else 0, kind, len(utopic)) + utopic + payload
+
+    def _decode(self, record):
+        qos, retain, kind, topic_length = self._BODY_HEADER.unpack_from(record, 0)
+        start = self._BODY_HEADER.size
+        topic = record[start:start + topic_length].decode("utf-8")
+        payload = record[start + topic_length:]
+        if kind == self._PAYLOAD_NONE:
+            payload = None
+        elif kind == self._PAYLOAD_TEXT:
+            payload = payload.decode("utf-8")
+        return QueueableRequest(RequestTypes.PUBLISH, (topic, payload, qos, bool(retain)))
@@ -13,17 +13,40 @@
 # * permissions and limitations under the License.
 # */
 
+import sys
 import time
 import logging
 from threading import Thread
 from threading import Event
+from threading import Lock
+from threading import Condition
 from AWSIoTPythonSDK.core.protocol.internal.events import EventTypes
 from AWSIoTPythonSDK.core.protocol.internal.events import FixedEventMids
 from AWSIoTPythonSDK.core.protocol.internal.clients import ClientStatus
 from AWSIoTPythonSDK.core.protocol.internal.queues import OfflineRequestQueue
+from AWSIoTPythonSDK.core.protocol.internal.queues import PersistentOfflineRequestQueue
 from AWSIoTPythonSDK.core.protocol.internal.requests import RequestTypes
-from AWSIoTPythonSDK.core.protocol.paho.client import topic_matches_sub
+from AWSIoTPythonSDK.core.protocol.paho.matcher import MQTTMatcher
 from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_DRAINING_INTERNAL_SEC
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_EVENT_DISPATCH_BATCH_SIZE
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_EVENT_DISPATCH_MAX_LATENCY_SEC
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_MESSAGE_CALLBACK_QUEUE_SIZE
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_MESSAGE_CALLBACK_STOP_CHECK_INTERVAL_SEC
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_OFFLINE_QUEUE_SEGMENT_SIZE_BYTES
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_DRAINING_MAX_RATE_PER_SEC
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_DRAINING_MAX_WINDOW
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_DRAINING_ACK_TIMEOUT_SEC
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_OPERATION_TIMEOUT_SEC
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_MAX_TOPICS_PER_SUBSCRIBE
+from AWSIoTPythonSDK.core.protocol.paho.client import MQTT_ERR_SUCCESS
+if sys.version_info[0] < 3:
+    from Queue import Queue
+    from Queue import Full
+    from Queue import Empty
+else:
+    from queue import Queue
+    from queue import Full
+    from queue import Empty
 
 
 class EventProducer(object):
@@ -33,6 +56,11 @@ class EventProducer(object):
     def __init__(self, cv, event_queue):
         self._cv = cv
         self._event_queue = event_queue
+        self._wake_up_consumer = self._notify_consumer
+
+    # Replaces the condition notification, for consumers that are scheduled rather than waiting on it
+    def update_consumer_wakeup(self, wakeup):
+        self._wake_up_consumer = wakeup if wakeup else self._notify_consumer
 
     def on_connect(self, client, user_data, flags, rc):
         self._add_to_queue(FixedEventMids.CONNACK_MID, EventTypes.CONNACK, rc)
@@ -58,15 +86,21 @@ class EventProducer(object):
         self._add_to_queue(FixedEventMids.MESSAGE_MID, EventTypes.MESSAGE, message)
         self._logger.debug("Produced [message] event")
 
+    # The event queue is a collections.deque: append() and popleft() are atomic, so events are handed
+    # off without taking the condition. The consumer only sleeps on an empty queue, so it needs waking
+    # only when this append makes the queue non-empty, which is once per batch rather than once per event.
     def _add_to_queue(self, mid, event_type, data):
+        self._event_queue.append((mid, event_type, data))
+        if len(self._event_queue) == 1:
+            self._wake_up_consumer()
+
+    def _notify_consumer(self):
         with self._cv:
-            self._event_queue.put((mid, event_type, data))
             self._cv.notify()
 
 
 class EventConsumer(object):
 
-    MAX_DISPATCH_INTERNAL_SEC = 0.01
     _logger = logging.getLogger(__name__)
 
     def __init__(self, cv, event_queue, internal_async_client,
@@ -79,6 +113,18 @@ class EventConsumer(object):
         self._client_status = client_status
         self._is_running = False
         self._draining_interval_sec = DEFAULT_DRAINING_INTERNAL_SEC
+        self._dispatch_batch_size = DEFAULT_EVENT_DISPATCH_BATCH_SIZE
+        self._dispatch_max_latency_sec = DEFAULT_EVENT_DISPATCH_MAX_LATENCY_SEC
+        self._message_callback_worker_pool = None
+        self._draining_pacer = None
+        self._resubscribe_timeout_sec = DEFAULT_OPERATION_TIMEOUT_SEC
+        self._draining_metrics_lock = Lock()
+        self._drained = 0
+        self._draining_start_time = None
+        self._draining_end_time = None
+        self._dispatch_executor = None
+        self._dispatch_schedule_lock = Lock()
+        self._dispatch_scheduled = False
         self._dispatch_methods = {
             EventTypes.CONNACK : self._dispatch_connack,
             EventTypes.DISCONNECT : self._dispatch_disconnect,
@@ -99,16 +145,70 @@ class EventConsumer(object):
 
     def update_draining_interval_sec(self, draining_interval_sec):
         self._draining_interval_sec = draining_interval_sec
+        self._draining_pacer = None  # Back to draining at a fixed interval
+
+    def update_resubscribe_timeout_sec(self, resubscribe_timeout_sec):
+        self._resubscribe_timeout_sec = resubscribe_timeout_sec
+
+    def update_draining_pacer(self, draining_pacer):
+        self._draining_pacer = draining_pacer
+
+    def get_draining_metrics(self):
+        with self._draining_metrics_lock:
+            metrics = {
+                "mode": "adaptive" if self._draining_pacer else "fixed",
+                "drained": self._drained,
+                "remaining": self._offline_requests_manager.size(),
+                "elapsed_sec": 0.0,
+                "rate_per_sec": 0.0
+            }
+            if self._draining_start_time is not None:
+                end_time = self._draining_end_time if self._draining_end_time is not None else time.time()
+                metrics["elapsed_sec"] = end_time - self._draining_start_time
+                if metrics["elapsed_sec"] > 0:
+                    metrics["rate_per_sec"] = self._drained / metrics["elapsed_sec"]
+        if self._draining_pacer:
+            metrics.update(self._draining_pacer.get_metrics())
+        return metrics
 
     def get_draining_interval_sec(self):
         return self._draining_interval_sec
 
+    def update_dispatch_batching(self, batch_size, max_latency_sec):
+        self._dispatch_batch_size = batch_size
+        self._dispatch_max_latency_sec = max_latency_sec
+
+    def get_dispatch_batching(self):
+        return self._dispatch_batch_size, self._dispatch_max_latency_sec
+
+    def update_message_callback_worker_pool(self, message_callback_worker_pool):
+        previous_worker_pool = self._message_callback_worker_pool
+        if message_callback_worker_pool and self._is_running:
+            message_callback_worker_pool.start()  # Configured after connect, start() has already run
+        self._message_callback_worker_pool = message_callback_worker_pool
+        if previous_worker_pool and previous_worker_pool is not message_callback_worker_pool:
+            previous_worker_pool.stop()  # Its workers finish the callbacks already queued
+
+    def get_message_callback_worker_pool(self):
+        return self._message_callback_worker_pool
+
+    # Dispatch on a shared executor (anything with submit(task)) instead of a thread of our own
+    def update_dispatch_executor(self, dispatch_executor):
+        self._dispatch_executor = dispatch_executor
+
     def is_running(self):
         return self._is_running
 
     def start(self):
         self._stopper.clear()
         self._is_running = True
+        if self._message_callback_worker_pool:
+            self._message_callback_worker_pool.start()
+        if self._dispatch_executor:
+            if self._event_queue:
+                self.schedule_dispatch()
+            self._logger.debug("Event consuming scheduled on the shared dispatch executor")
+            return
         dispatch_events = Thread(target=self._dispatch)
         dispatch_events.daemon = True
         dispatch_events.start()
@@ -118,13 +218,19 @@ class EventConsumer(object):
         if self._is_running:
             self._is_running = False
             self._clean_up()
+            if self._dispatch_executor:
+                with self._dispatch_schedule_lock:
+                    if not self._dispatch_scheduled:  # Otherwise the running batch sets it when done
+                        self._stopper.set()
         self._logger.debug("Event consuming thread stopped")
 
     def _clean_up(self):
         self._logger.debug("Cleaning up before stopping event consuming")
-        with self._event_queue.mutex:
-            self._event_queue.queue.clear()
-            self._logger.debug("Event queue cleared")
+        self._event_queue.clear()
+        self._logger.debug("Event queue cleared")
+        if self._message_callback_worker_pool:
+            self._message_callback_worker_pool.stop()
+            self._logger.debug("Message callback workers stopped")
         self._internal_async_client.stop_background_network_io()
         self._logger.debug("Network thread stopped")
         self._internal_async_client.clean_up_event_callbacks()
@@ -137,20 +243,61 @@ class EventConsumer(object):
     def is_fully_stopped(self):
         return self._stopper.is_set()
 
+    # Events are drained in batches of up to _dispatch_batch_size without holding the condition, so the
+    # network thread never blocks on a running callback. The consumer sleeps only when the queue is
+    # empty and never longer than _dispatch_max_latency_sec, which bounds the delay of a missed wakeup.
     def _dispatch(self):
         while self._is_running:
-            with self._cv:
-                if self._event_queue.empty():
-                    self._cv.wait(self.MAX_DISPATCH_INTERNAL_SEC)
-                else:
-                    while not self._event_queue.empty():
-                        self._dispatch_one()
+            if not self._event_queue:
+                with self._cv:
+                    if not self._event_queue:
+                        self._cv.wait(self._dispatch_max_latency_sec)
+                continue
+            self._dispatch_batch()
         self._stopper.set()
         self._logger.debug("Exiting dispatching loop...")
 
-    def _dispatch_one(self):
-        mid, event_type, data = self._event_queue.get()
+    # Event producer wakeup when dispatching on an executor. At most one batch of this consumer is
+    # scheduled at a time, so events are still dispatched in order. A batch that leaves events behind
+    # schedules the next one instead of looping, so busy connections take turns on the executor.
+    def schedule_dispatch(self):
+        with self._dispatch_schedule_lock:
+            if self._dispatch_scheduled or not self._is_running:
+                return
+            self._dispatch_scheduled = True
+        self._dispatch_executor.submit(self._dispatch_scheduled_batch)
+
+    def _dispatch_scheduled_batch(self):
+        self._dispatch_batch()
+        with self._dispatch_schedule_lock:
+            if self._is_running and self._event_queue:
+                reschedule = True
+            else:
+                reschedule = False
+                self._dispatch_scheduled = False
+                if not self._is_running:
+                    self._stopper.set()
+        if reschedule:
+            self._dispatch_executor.submit(self._dispatch_scheduled_batch)
+
+    def _dispatch_batch(self):
+        for _ in range(self._dispatch_batch_size):
+            if not self._is_running:
+                break
+            try:
+                event = self._event_queue.popleft()
+            except IndexError:
+                break
+            self._dispatch_one(event)
+
+    def _dispatch_one(self, event):
+        mid, event_type, data = event
         if mid:
+            worker_pool = self._message_callback_worker_pool
+            if EventTypes.MESSAGE == event_type and worker_pool:
+                # Application code runs on the pool, keep dispatching acks meanwhile
+                worker_pool.submit(data.topic, self._create_message_delivery(mid, data))
+                return
             self._dispatch_methods[event_type](mid, data)
             self._internal_async_client.invoke_event_callback(mid, data=data)
             # We need to make sure disconnect event gets dispatched and then we stop the consumer
@@ -187,24 +334,66 @@ class EventConsumer(object):
         if subscriptions and not self._has_user_disconnect_request():
             self._logger.debug("Start resubscribing")
             self._client_status.set_status(ClientStatus.RESUBSCRIBE)
-            for topic, (qos, message_callback, ack_callback) in subscriptions:
+            # AWS IoT accepts a limited number of topics per SUBSCRIBE, so send them in batches
+            # and wait for all SUBACKs together before moving on
+            subacks = []
+            for index in range(0, len(subscriptions), DEFAULT_MAX_TOPICS_PER_SUBSCRIBE):
                 if self._has_user_disconnect_request():
                     self._logger.debug("User disconnect detected")
                     break
-                self._internal_async_client.subscribe(topic, qos, ack_callback)
+                batch = subscriptions[index:index + DEFAULT_MAX_TOPICS_PER_SUBSCRIBE]
+                suback = Event()
+                topic_qos_list = [(topic, qos) for topic, (qos, _, _) in batch]
+                rc, mid = self._internal_async_client.subscribe_multiple(topic_qos_list,
+                                                                         self._create_resubscribe_ack_callback(batch, suback))
+                if MQTT_ERR_SUCCESS == rc:
+                    subacks.append(suback)
+            self._logger.debug("Sent %d resubscribe requests, waiting for SUBACKs", len(subacks))
+            deadline = time.time() + self._resubscribe_timeout_sec
+            for suback in subacks:
+                if not suback.wait(max(0, deadline - time.time())):
+                    self._logger.warn("Resubscribe timed out")
+                    break
+
+    # Splits the SUBACK of a batch into the ack callbacks of its subscriptions, each getting its own granted QoS
+    def _create_resubscribe_ack_callback(self, batch, suback):
+        def ack_callback(mid, data=None):
+            for index, (topic, (qos, message_callback, subscription_ack_callback)) in enumerate(batch):
+                if subscription_ack_callback:
+                    granted_qos = (data[index],) if data is not None and index < len(data) else data
+                    subscription_ack_callback(mid=mid, data=granted_qos)
+            suback.set()
+        return ack_callback
 
     def _handle_draining(self):
         if self._offline_requests_manager.has_more() and not self._has_user_disconnect_request():
             self._logger.debug("Start draining")
             self._client_status.set_status(ClientStatus.DRAINING)
+            with self._draining_metrics_lock:
+                self._drained = 0
+                self._draining_start_time = time.time()
+                self._draining_end_time = None
+            draining_pacer = self._draining_pacer
+            if draining_pacer:
+                draining_pacer.reset()
             while self._offline_requests_manager.has_more():
                 if self._has_user_disconnect_request():
                     self._logger.debug("User disconnect detected")
                     break
+                if draining_pacer and not draining_pacer.acquire(self._has_user_disconnect_request):
+                    self._logger.debug("User disconnect detected")
+                    break
                 offline_request = self._offline_requests_manager.get_next()
                 if offline_request:
-                    self._offline_request_handlers[offline_request.type](offline_request)
-                    time.sleep(self._draining_interval_sec)
+                    mid = self._offline_request_handlers[offline_request.type](offline_request)
+                    with self._draining_metrics_lock:
+                        self._drained += 1
+                    if draining_pacer:
+                        draining_pacer.on_sent(offline_request, mid)
+                    else:
+                        time.sleep(self._draining_interval_sec)
+            with self._draining_metrics_lock:
+                self._draining_end_time = time.time()
 
     def _has_user_disconnect_request(self):
         return ClientStatus.USER_DISCONNECT == self._client_status.get_status()
@@ -221,6 +410,8 @@ class EventConsumer(object):
     # Do nothing in the event dispatching itself
     def _dispatch_puback(self, mid, rc):
         self._logger.debug("Dispatching [puback] event")
+        if self._draining_pacer:
+            self._draining_pacer.on_ack(mid)
 
     def _dispatch_suback(self, mid, rc):
         self._logger.debug("Dispatching [suback] event")
@@ -230,16 +421,21 @@ class EventConsumer(object):
 
     def _dispatch_message(self, mid, message):
         self._logger.debug("Dispatching [message] event")
-        subscriptions = self._subscription_manager.list_records()
-        if subscriptions:
-            for topic, (qos, message_callback, _) in subscriptions:
-                if topic_matches_sub(topic, message.topic) and message_callback:
-                    message_callback(None, None, message)  # message_callback(client, userdata, message)
+        for qos, message_callback, _ in self._subscription_manager.list_matching_records(message.topic):
+            if message_callback:
+                message_callback(None, None, message)  # message_callback(client, userdata, message)
+
+    def _create_message_delivery(self, mid, message):
+        def deliver_message():
+            self._dispatch_message(mid, message)
+            self._internal_async_client.invoke_event_callback(mid, data=message)
+        return deliver_message
 
     def _handle_offline_publish(self, request):
         topic, payload, qos, retain = request.data
-        self._internal_async_client.publish(topic, payload, qos, retain)
+        rc, mid = self._internal_async_client.publish(topic, payload, qos, retain)
         self._logger.debug("Processed offline publish request")
+        return mid
 
     def _handle_offline_subscribe(self, request):
         topic, qos, message_callback, ack_callback = request.data
@@ -254,43 +450,329 @@ class EventConsumer(object):
         self._logger.debug("Processed offline unsubscribe request")
 
 
+class AdaptiveDrainingPacer(object):
+
+    _logger = logging.getLogger(__name__)
+
+    # Paces offline queue draining by the acks instead of a fixed sleep. At most `window` drained
+    # QoS1 publishes are waiting for their PUBACK at any time. The window grows by one per round trip
+    # while PUBACK latency stays close to the lowest latency seen, shrinks as latency builds up
+    # (the broker or the link is queueing) and is halved when a PUBACK does not come back within
+    # ack_timeout_sec. Independently, a token bucket keeps the send rate under max_rate_per_sec.
+
+    INITIAL_WINDOW = 4
+    LATENCY_EWMA_WEIGHT = 0.2
+    LATENCY_TOLERANCE_FACTOR = 2.0
+    MAX_WAIT_SEC = 0.1
+
+    def __init__(self, max_rate_per_sec=DEFAULT_DRAINING_MAX_RATE_PER_SEC, max_window=DEFAULT_DRAINING_MAX_WINDOW,
+                 ack_timeout_sec=DEFAULT_DRAINING_ACK_TIMEOUT_SEC):
+        if max_rate_per_sec <= 0 or max_window <= 0 or ack_timeout_sec <= 0:
+            self._logger.error("init: Non-positive adaptive draining configuration detected.")
+            raise ValueError("Max rate, max in-flight and ack timeout must be positive.")
+        self._max_rate_per_sec = float(max_rate_per_sec)
+        self._max_window = max_window
+        self._ack_timeout_sec = ack_timeout_sec
+        self._cv = Condition()
+        self._in_flight = dict()  # mid -> send time of drained QoS1 publishes
+        self._acked = 0
+        self._timeouts = 0
+        self._latency_ewma = None
+        self._min_latency = None
+        self.reset()
+
+    def reset(self):
+        with self._cv:
+            self._in_flight.clear()
+            self._window = float(min(self.INITIAL_WINDOW, self._max_window))
+            # Allow a burst of one window at the start
+            self._tokens = self._window
+            self._last_refill = time.time()
+
+    # Blocks until the next request may be sent. Returns False if should_stop() became true meanwhile.
+    def acquire(self, should_stop):
+        with self._cv:
+            while True:
+                if should_stop():
+                    return False
+                now = time.time()
+                self._expire(now)
+                if len(self._in_flight) < int(self._window):
+                    break
+                oldest = min(self._in_flight.values())
+                self._cv.wait(max(0, min(self.MAX_WAIT_SEC, oldest + self._ack_timeout_sec - now)))
+            while True:
+                now = time.time()
+                self._tokens = min(max(self._window, 1.0), self._tokens + (now - self._last_refill) * self._max_rate_per_sec)
+                self._last_refill = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return True
+                if should_stop():
+                    return False
+                self._cv.wait(min(self.MAX_WAIT_SEC, (1.0 - self._tokens) / self._max_rate_per_sec))
+
+    def on_sent(self, request, mid):
+        qos = request.data[2] if RequestTypes.PUBLISH == request.type else 0
+        if qos > 0 and mid is not None:
+            with self._cv:
+                self._in_flight[mid] = time.time()
+
+    def on_ack(self, mid):
+        with self._cv:
+            sent_time = self._in_flight.pop(mid, None)
+            if sent_time is None:
+                return
+            latency = time.time() - sent_time
+            self._acked += 1
+            if self._min_latency is None or latency < self._min_latency:
+                self._min_latency = latency
+            if self._latency_ewma is None:
+                self._latency_ewma = latency
+            else:
+                self._latency_ewma += self.LATENCY_EWMA_WEIGHT * (latency - self._latency_ewma)
+            if latency <= self._min_latency * self.LATENCY_TOLERANCE_FACTOR:
+                self._window = min(float(self._max_window), self._window + 1.0 / self._window)
+            else:
+                self._window = max(1.0, self._window - 0.5)
+            self._cv.notify()
+
+    def get_metrics(self):
+        with self._cv:
+            return {
+                "window": int(self._window),
+                "in_flight": len(self._in_flight),
+                "acked": self._acked,
+                "ack_timeouts": self._timeouts,
+                "ack_latency_sec": self._latency_ewma,
+                "max_rate_per_sec": self._max_rate_per_sec
+            }
+
+    def _expire(self, now):
+        expired = [mid for mid, sent_time in self._in_flight.items() if now - sent_time > self._ack_timeout_sec]
+        if expired:
+            for mid in expired:
+                del self._in_flight[mid]
+            self._timeouts += len(expired)
+            self._window = max(1.0, self._window / 2)
+            self._logger.debug("%d drained publishes not acked in time, draining window: %d", len(expired), int(self._window))
+
+
+class MessageCallbackWorkerPool(object):
+
+    _logger = logging.getLogger(__name__)
+
+    def __init__(self, num_workers, max_queue_size=DEFAULT_MESSAGE_CALLBACK_QUEUE_SIZE):
+        self._num_workers = num_workers
+        self._max_queue_size = max_queue_size
+        self._queues = []
+        self._stopper = Event()
+        self._stopper.set()
+        self._state_lock = Lock()  # Nothing is queued once stop() has run, workers could be gone
+        self._exited_queues = set()  # Queues of the current start whose worker has exited
+        self._metrics_lock = Lock()
+        self._queued = 0
+        self._max_queued = 0
+        self._dispatched = 0
+        self._back_pressure_waits = 0
+
+    def is_running(self):
+        return not self._stopper.is_set()
+
+    def start(self):
+        # Every start gets fresh queues and its own stopper, so workers still finishing the callbacks of
+        # the previous connection never pick up work of the new one
+        stopper = Event()
+        exited_queues = set()
+        queues = [Queue(self._max_queue_size) for _ in range(self._num_workers)]
+        for index, task_queue in enumerate(queues):
+            worker = Thread(target=self._work, args=(task_queue, stopper, exited_queues), name="message-callback-worker-%d" % index)
+            worker.daemon = True
+            worker.start()
+        with self._state_lock:
+            self._queues = queues
+            self._stopper = stopper
+            self._exited_queues = exited_queues
+        self._logger.debug("Started %d message callback workers", self._num_workers)
+
+    # Workers finish the callbacks already queued, then exit
+    def stop(self):
+        with self._state_lock:
+            self._stopper.set()
+            for task_queue in self._queues:
+                try:
+                    task_queue.put_nowait(None)  # Wake up idle workers, busy ones check the stopper when their queue is empty
+                except Full:
+                    pass
+        self._logger.debug("Stopped message callback workers")
+
+    # Tasks of the same topic always land on the same worker, which runs them in order. When that
+    # worker's queue is full, the caller blocks until there is room: the back pressure is counted
+    # in the metrics. A pool that is not running has no workers to take the task, it runs on the
+    # caller's thread instead.
+    def submit(self, topic, task):
+        with self._state_lock:
+            stopper = self._stopper
+            if not stopper.is_set():
+                task_queue = self._queues[hash(topic) % len(self._queues)]
+                exited_queues = self._exited_queues
+                with self._metrics_lock:
+                    self._queued += 1  # Before the worker can take it and count it down
+                    if self._queued > self._max_queued:
+                        self._max_queued = self._queued
+                try:
+                    task_queue.put_nowait(task)
+                    return
+                except Full:
+                    pass
+        if stopper.is_set():
+            self._logger.debug("Message callback workers not running, running callback inline on topic: %s", topic)
+            self._run_inline(task)
+            return
+        with self._metrics_lock:
+            self._back_pressure_waits += 1
+        self._logger.debug("Message callback queue full, waiting for worker on topic: %s", topic)
+        while True:
+            try:
+                task_queue.put(task, timeout=DEFAULT_MESSAGE_CALLBACK_STOP_CHECK_INTERVAL_SEC)
+                break
+            except Full:
+                if stopper.is_set():
+                    with self._metrics_lock:
+                        self._queued -= 1
+                    self._logger.debug("Message callback workers stopped while waiting, running callback inline on topic: %s", topic)
+                    self._run_inline(task)
+                    return
+        # The put ran without the lock, the worker may have exited meanwhile and left the task behind
+        with self._state_lock:
+            is_worker_exited = task_queue in exited_queues
+        if is_worker_exited:
+            self._run_left_behind(task_queue)
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            return {
+                "workers": self._num_workers,
+                "max_queue_size": self._max_queue_size,
+                "queued": self._queued,
+                "max_queued": self._max_queued,
+                "dispatched": self._dispatched,
+                "back_pressure_waits": self._back_pressure_waits
+            }
+
+    def _work(self, task_queue, stopper, exited_queues):
+        while True:
+            task = task_queue.get()
+            if task is not None:
+                self._run_queued(task)
+            if stopper.is_set():
+                # Under the lock submit() takes after a blocking put, so a task put before this check
+                # keeps the worker running and one put after it is run by submit()
+                with self._state_lock:
+                    if task_queue.empty():
+                        exited_queues.add(task_queue)
+                        break
+
+    def _run_queued(self, task):
+        try:
+            task()
+        except Exception:
+            self._logger.exception("Message callback raised an exception")
+        with self._metrics_lock:
+            self._queued -= 1
+            self._dispatched += 1
+
+    def _run_inline(self, task):
+        try:
+            task()
+        except Exception:
+            self._logger.exception("Message callback raised an exception")
+        with self._metrics_lock:
+            self._dispatched += 1
+
+    def _run_left_behind(self, task_queue):
+        while True:
+            try:
+                task = task_queue.get_nowait()
+            except Empty:
+                return
+            if task is not None:
+                self._run_queued(task)
+
+
 class SubscriptionManager(object):
 
     _logger = logging.getLogger(__name__)
 
     def __init__(self):
         self._subscription_map = dict()
+        # Topic filter trie used for routing, so matching cost scales with topic depth, not subscription count
+        self._subscription_matcher = MQTTMatcher()
+        self._subscription_lock = Lock()
 
     def add_record(self, topic, qos, message_callback, ack_callback):
         self._logger.debug("Adding a new subscription record: %s qos: %d", topic, qos)
-        self._subscription_map[topic] = qos, message_callback, ack_callback  # message_callback and/or ack_callback could be None
+        with self._subscription_lock:
+            record = qos, message_callback, ack_callback  # message_callback and/or ack_callback could be None
+            self._subscription_map[topic] = record
+            self._subscription_matcher[topic] = record
 
     def remove_record(self, topic):
         self._logger.debug("Removing subscription record: %s", topic)
-        if self._subscription_map.get(topic):  # Ignore topics that are never subscribed to
-            del self._subscription_map[topic]
-        else:
-            self._logger.warn("Removing attempt for non-exist subscription record: %s", topic)
+        with self._subscription_lock:
+            if self._subscription_map.get(topic):  # Ignore topics that are never subscribed to
+                del self._subscription_map[topic]
+                del self._subscription_matcher[topic]
+            else:
+                self._logger.warn("Removing attempt for non-exist subscription record: %s", topic)
+
+    def get_record(self, topic):
+        with self._subscription_lock:
+            return self._subscription_map.get(topic)
 
     def list_records(self):
-        return list(self._subscription_map.items())
+        with self._subscription_lock:
+            return list(self._subscription_map.items())
+
+    # Returns the (qos, message_callback, ack_callback) records of all subscriptions matching the topic
+    def list_matching_records(self, topic):
+        with self._subscription_lock:
+            return list(self._subscription_matcher.iter_match(topic))
 
 
 class OfflineRequestsManager(object):
 
     _logger = logging.getLogger(__name__)
 
-    def __init__(self, max_size, drop_behavior):
+    # With a storage_dir, publish requests are queued on disk. Subscribe/unsubscribe requests carry
+    # callbacks and stay in memory; they are drained first so subscriptions are back before the
+    # publishes go out.
+    def __init__(self, max_size, drop_behavior, storage_dir=None, segment_size=DEFAULT_OFFLINE_QUEUE_SEGMENT_SIZE_BYTES):
         self._queue = OfflineRequestQueue(max_size, drop_behavior)
+        self._persistent_queue = None
+        if storage_dir:
+            self._persistent_queue = PersistentOfflineRequestQueue(storage_dir, max_size, drop_behavior, segment_size)
 
     def has_more(self):
-        return len(self._queue) > 0
+        return self.size() > 0
+
+    def size(self):
+        if self._persistent_queue is not None:
+            return len(self._queue) + len(self._persistent_queue)
+        return len(self._queue)
 
     def add_one(self, request):
+        if self._persistent_queue is not None and RequestTypes.PUBLISH == request.type:
+            return self._persistent_queue.append(request)
         return self._queue.append(request)
 
     def get_next(self):
-        if self.has_more():
-            return self._queue.pop(0)
-        else:
-            return None
+        if len(self._queue) > 0:
+            return self._queue.popleft()
+        if self._persistent_queue is not None and len(self._persistent_queue) > 0:
+            return self._persistent_queue.popleft()
+        return None
+
+    def close(self):
+        if self._persistent_queue is not None:
+            self._persistent_queue.close()
@@ -21,10 +21,16 @@ from AWSIoTPythonSDK.core.protocol.internal.workers import EventProducer
 from AWSIoTPythonSDK.core.protocol.internal.workers import EventConsumer
 from AWSIoTPythonSDK.core.protocol.internal.workers import SubscriptionManager
 from AWSIoTPythonSDK.core.protocol.internal.workers import OfflineRequestsManager
+from AWSIoTPythonSDK.core.protocol.internal.workers import MessageCallbackWorkerPool
+from AWSIoTPythonSDK.core.protocol.internal.workers import AdaptiveDrainingPacer
 from AWSIoTPythonSDK.core.protocol.internal.requests import RequestTypes
 from AWSIoTPythonSDK.core.protocol.internal.requests import QueueableRequest
 from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_CONNECT_DISCONNECT_TIMEOUT_SEC
 from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_OPERATION_TIMEOUT_SEC
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_OFFLINE_QUEUE_SEGMENT_SIZE_BYTES
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_WRITE_COALESCING_MAX_BYTES
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_WRITE_COALESCING_MAX_DELAY_SEC
+from AWSIoTPythonSDK.core.protocol.internal.defaults import DEFAULT_WSS_FRAME_AGGREGATION_MAX_BYTES
 from AWSIoTPythonSDK.core.protocol.internal.defaults import METRICS_PREFIX
 from AWSIoTPythonSDK.core.protocol.internal.defaults import ALPN_PROTCOLS
 from AWSIoTPythonSDK.core.protocol.internal.events import FixedEventMids
@@ -50,12 +56,9 @@ from AWSIoTPythonSDK.core.util.enums import DropBehaviorTypes
 from AWSIoTPythonSDK.core.protocol.paho.client import MQTTv31
 from threading import Condition
 from threading import Event
+from threading import Lock
+from collections import deque
 import logging
-import sys
-if sys.version_info[0] < 3:
-    from Queue import Queue
-else:
-    from queue import Queue
 
 
 class MqttCore(object):
@@ -67,11 +70,14 @@ class MqttCore(object):
         self._username = ""
         self._password = None
         self._enable_metrics_collection = True
-        self._event_queue = Queue()
+        self._event_queue = deque()
         self._event_cv = Condition()
         self._event_producer = EventProducer(self._event_cv, self._event_queue)
         self._client_status = ClientStatusContainer()
         self._internal_async_client = InternalAsyncMqttClient(client_id, clean_session, protocol, use_wss)
+        self._internal_async_client.configure_write_coalescing(DEFAULT_WRITE_COALESCING_MAX_BYTES,
+                                                               DEFAULT_WRITE_COALESCING_MAX_DELAY_SEC)
+        self._internal_async_client.configure_ws_frame_aggregation(DEFAULT_WSS_FRAME_AGGREGATION_MAX_BYTES)
         self._subscription_manager = SubscriptionManager()
         self._offline_requests_manager = OfflineRequestsManager(-1, DropBehaviorTypes.DROP_NEWEST)  # Infinite queue
         self._event_consumer = EventConsumer(self._event_cv,
@@ -146,6 +152,18 @@ class MqttCore(object):
     def configure_operation_timeout_sec(self, operation_timeout_sec):
         self._logger.info("Configuring MQTT operation time out: %f sec" % operation_timeout_sec)
         self._operation_timeout_sec = operation_timeout_sec
+        self._event_consumer.update_resubscribe_timeout_sec(operation_timeout_sec)
+
+    def configure_write_coalescing(self, max_bytes, max_delay_sec):
+        self._logger.info("Configuring write coalescing...")
+        self._logger.info("Max bytes per write: %d" % max_bytes)
+        self._logger.info("Max delay: %f sec" % max_delay_sec)
+        self._internal_async_client.configure_write_coalescing(max_bytes, max_delay_sec)
+
+    def configure_ws_frame_aggregation(self, max_bytes):
+        self._logger.info("Configuring websocket frame aggregation...")
+        self._logger.info("Max bytes per frame: %d" % max_bytes)
+        self._internal_async_client.configure_ws_frame_aggregation(max_bytes)
 
     def configure_reconnect_back_off(self, base_reconnect_quiet_sec, max_reconnect_quiet_sec, stable_connection_sec):
         self._logger.info("Configuring reconnect back off timing...")
@@ -181,15 +199,58 @@ class MqttCore(object):
     def disable_metrics_collection(self):
         self._enable_metrics_collection = False
 
-    def configure_offline_requests_queue(self, max_size, drop_behavior):
+    def configure_offline_requests_queue(self, max_size, drop_behavior, storage_dir=None,
+                                         segment_size=DEFAULT_OFFLINE_QUEUE_SEGMENT_SIZE_BYTES):
         self._logger.info("Configuring offline requests queueing: max queue size: %d", max_size)
-        self._offline_requests_manager = OfflineRequestsManager(max_size, drop_behavior)
+        if storage_dir:
+            self._logger.info("Persisting offline publish requests in: %s", storage_dir)
+        self._offline_requests_manager.close()
+        self._offline_requests_manager = OfflineRequestsManager(max_size, drop_behavior, storage_dir, segment_size)
         self._event_consumer.update_offline_requests_manager(self._offline_requests_manager)
 
     def configure_draining_interval_sec(self, draining_interval_sec):
         self._logger.info("Configuring offline requests queue draining interval: %f sec", draining_interval_sec)
         self._event_consumer.update_draining_interval_sec(draining_interval_sec)
 
+    def configure_adaptive_draining(self, max_rate_per_sec, max_window, ack_timeout_sec):
+        self._logger.info("Configuring adaptive offline requests queue draining: max rate: %f requests/sec, max window: %d, ack time out: %f sec",
+                          max_rate_per_sec, max_window, ack_timeout_sec)
+        self._event_consumer.update_draining_pacer(AdaptiveDrainingPacer(max_rate_per_sec, max_window, ack_timeout_sec))
+
+    def get_draining_metrics(self):
+        return self._event_consumer.get_draining_metrics()
+
+    def configure_event_dispatch_batching(self, batch_size, max_latency_sec):
+        self._logger.info("Configuring event dispatch batching: batch size: %d, max latency: %f sec", batch_size, max_latency_sec)
+        self._event_consumer.update_dispatch_batching(batch_size, max_latency_sec)
+
+    def configure_message_callback_workers(self, num_workers, max_queue_size):
+        if num_workers > 0:
+            self._logger.info("Configuring message callback workers: %d workers, max queue size: %d", num_workers, max_queue_size)
+            self._event_consumer.update_message_callback_worker_pool(MessageCallbackWorkerPool(num_workers, max_queue_size))
+        else:
+            self._logger.info("Disabling message callback workers")
+            self._event_consumer.update_message_callback_worker_pool(None)
+
+    def configure_connection_host(self, connection_host):
+        if connection_host:
+            self._logger.info("Configuring shared connection host...")
+            self._event_producer.update_consumer_wakeup(self._event_consumer.schedule_dispatch)
+        else:
+            self._logger.info("Disabling shared connection host")
+            self._event_producer.update_consumer_wakeup(None)
+        self._internal_async_client.set_connection_host(connection_host)
+        self._event_consumer.update_dispatch_executor(connection_host)
+
+    def get_message_callback_metrics(self):
+        worker_pool = self._event_consumer.get_message_callback_worker_pool()
+        if worker_pool:
+            return worker_pool.get_metrics()
+        return None
+
+    def get_tls_session_metrics(self):
+        return self._internal_async_client.get_tls_session_metrics()
+
     def connect(self, keep_alive_sec):
         self._logger.info("Performing sync connect...")
         event = Event()
@@ -307,6 +368,39 @@ class MqttCore(object):
             ret = True
         return ret
 
+    def subscribe_all(self, topics, qos, message_callback=None):
+        # Sync subscribe to several topics, waiting for all the SUBACKs at once instead of one after another
+        self._logger.info("Performing sync subscribe to %d topics..." % len(topics))
+        ret = False
+        if ClientStatus.STABLE != self._client_status.get_status():
+            for topic in topics:
+                self._handle_offline_request(RequestTypes.SUBSCRIBE, (topic, qos, message_callback, None))
+        else:
+            event = Event()
+            ack_callback = self._create_blocking_multiple_ack_callback(event, len(topics))
+            mids = []
+            for topic in topics:
+                previous_record = self._subscription_manager.get_record(topic)
+                try:
+                    mids.append(self._subscribe_async(topic, qos, ack_callback, message_callback)[1])
+                except Exception:
+                    # The topics sent so far may still be granted, keep their records as a timeout does.
+                    # The failed one was never sent, put back whatever subscription it had before.
+                    for mid in mids:
+                        self._internal_async_client.remove_event_callback(mid)
+                    if previous_record is None:
+                        self._subscription_manager.remove_record(topic)
+                    else:
+                        self._subscription_manager.add_record(topic, *previous_record)
+                    raise
+            if not event.wait(self._operation_timeout_sec):
+                for mid in mids:
+                    self._internal_async_client.remove_event_callback(mid)
+                self._logger.error("Subscribe timed out")
+                raise subscribeTimeoutException()
+            ret = True
+        return ret
+
     def subscribe_async(self, topic, qos, ack_callback=None, message_callback=None):
         self._logger.info("Performing async subscribe...")
         if ClientStatus.STABLE != self._client_status.get_status():
@@ -339,6 +433,33 @@ class MqttCore(object):
             ret = True
         return ret
 
+    def unsubscribe_all(self, topics):
+        # Sync unsubscribe from several topics, waiting for all the UNSUBACKs at once
+        self._logger.info("Performing sync unsubscribe from %d topics..." % len(topics))
+        ret = False
+        if ClientStatus.STABLE != self._client_status.get_status():
+            for topic in topics:
+                self._handle_offline_request(RequestTypes.UNSUBSCRIBE, (topic, None))
+        else:
+            event = Event()
+            ack_callback = self._create_blocking_multiple_ack_callback(event, len(topics))
+            mids = []
+            try:
+                for topic in topics:
+                    mids.append(self._unsubscribe_async(topic, ack_callback)[1])
+            except Exception:
+                # The whole call fails, drop the ack callbacks of the topics sent so far
+                for mid in mids:
+                    self._internal_async_client.remove_event_callback(mid)
+                raise
+            if not event.wait(self._operation_timeout_sec):
+                for mid in mids:
+                    self._internal_async_client.remove_event_callback(mid)
+                self._logger.error("Unsubscribe timed out")
+                raise unsubscribeTimeoutException()
+            ret = True
+        return ret
+
     def unsubscribe_async(self, topic, ack_callback=None):
         self._logger.info("Performing async unsubscribe...")
         if ClientStatus.STABLE != self._client_status.get_status():
@@ -361,6 +482,16 @@ class MqttCore(object):
             event.set()
         return ack_callback
 
+    def _create_blocking_multiple_ack_callback(self, event, count):
+        pending_acks = [count]
+        lock = Lock()
+        def ack_callback(mid, data=None):
+            with lock:
+                pending_acks[0] -= 1
+                if pending_acks[0] == 0:
+                    event.set()
+        return ack_callback
+
     def _handle_offline_request(self, type, data):
         self._logger.info("Offline request detected!")
         offline_request = QueueableRequest(type, data)
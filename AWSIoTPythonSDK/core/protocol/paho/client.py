@@ -21,6 +21,10 @@ import platform
 import random
 import select
 import socket
+try:
+    import selectors
+except ImportError:
+    selectors = None
 HAVE_SSL = True
 try:
     import ssl
@@ -30,10 +34,14 @@ except:
     HAVE_SSL = False
     cert_reqs = None
     tls_version = None
+# TLS sessions can be carried over to a new connection (Python 3.6+)
+HAVE_SSL_SESSION = HAVE_SSL and hasattr(ssl, "SSLSession")
 import struct
 import sys
 import threading
 import time
+from collections import deque
+from collections import OrderedDict
 HAVE_DNS = True
 try:
     import dns.resolver
@@ -48,6 +56,7 @@ else:
 from AWSIoTPythonSDK.core.protocol.connection.cores import ProgressiveBackOffCore
 from AWSIoTPythonSDK.core.protocol.connection.cores import SecuredWebSocketCore
 from AWSIoTPythonSDK.core.protocol.connection.alpn import SSLContextBuilder
+from AWSIoTPythonSDK.core.protocol.paho.matcher import MQTTMatcher
 
 VERSION_MAJOR=1
 VERSION_MINOR=0
@@ -142,6 +151,28 @@ if sys.version_info[0] < 3:
 else:
     sockpair_data = b"0"
 
+# Maximum number of bytes requested from the network in a single read. All
+# complete packets found in what was read are handled before reading again.
+READ_BUFFER_SIZE = 65536
+
+# PUBLISH payloads of at least this many bytes are not copied into the packet
+# buffer: the fixed header and topic are written first, followed by the payload
+# itself (in a single sendmsg() call on plain sockets). Smaller payloads are
+# cheaper to copy than to send as a separate segment.
+PUBLISH_SCATTER_THRESHOLD = 4096
+
+# Maximum number of encoded topic prefixes cached per client
+PUBLISH_TOPIC_CACHE_SIZE = 256
+
+def _buffer_view(data, pos):
+    # data[pos:] without a copy where the Python version allows it
+    if pos == 0:
+        return data
+    if sys.version_info[0] < 3:
+        return data[pos:]
+    return memoryview(data)[pos:]
+
+
 def error_string(mqtt_errno):
     """Return the error string associated with an mqtt error number."""
     if mqtt_errno == MQTT_ERR_SUCCESS:
@@ -449,14 +480,11 @@ class Client(object):
         self._password = ""
         self._in_packet = {
             "command": 0,
-            "have_remaining": 0,
-            "remaining_count": [],
-            "remaining_mult": 1,
             "remaining_length": 0,
-            "packet": b"",
-            "to_process": 0,
-            "pos": 0}
-        self._out_packet = []
+            "packet": b""}
+        self._in_buffer = bytearray()
+        self._publish_topic_cache = {}
+        self._out_packet = deque()
         self._current_out_packet = None
         self._last_msg_in = time.time()
         self._last_msg_out = time.time()
@@ -464,8 +492,11 @@ class Client(object):
         self._last_mid = 0
         self._state = mqtt_cs_new
         self._max_inflight_messages = 20
-        self._out_messages = []
-        self._in_messages = []
+        # In-flight and queued messages, keyed by mid in publish/receive order
+        self._out_messages = OrderedDict()
+        self._in_messages = OrderedDict()
+        # Outgoing messages waiting for an in-flight slot, in publish order
+        self._out_queued = deque()
         self._inflight_messages = 0
         self._will = False
         self._will_topic = ""
@@ -476,7 +507,7 @@ class Client(object):
         self.on_connect = None
         self.on_publish = None
         self.on_message = None
-        self.on_message_filtered = []
+        self.on_message_filtered = MQTTMatcher()
         self.on_subscribe = None
         self.on_unsubscribe = None
         self.on_log = None
@@ -509,6 +540,28 @@ class Client(object):
         self._AWSSecretAccessKeyCustomConfig = ""
         self._AWSSessionTokenCustomConfig = ""
         self._alpn_protocols = None
+        self._external_transport = False
+        self._connection_host = None
+        # Context of the last TLS connect, its session can be resumed by the next one
+        self._ssl_context = None
+        self._tls_session = None
+        self._tls_handshakes = 0
+        self._tls_resumed_handshakes = 0
+        self._tls_full_handshake_sec = 0.0  # Total time of the handshakes that were not resumed
+        self._tls_resumed_handshake_sec = 0.0
+        self._tls_last_handshake_sec = 0.0
+        self._wakeup_hook = None
+        self._loop_selector = None
+        self._loop_selector_sock = None
+        self._loop_waiting = False
+        self._wakeup_signalled = False
+        self._loop_write_deferred = False
+        self._write_coalesce_bytes = 0
+        self._ws_frame_aggregate_bytes = 0
+        self._write_coalesce_delay = 0.0
+        self._out_packet_bytes = 0  # Bytes queued since _out_packet was last drained
+        self._out_packet_urgent = False  # Queued packets include one that isn't held back
+        self._out_batch_start = 0
 
     def __del__(self):
         pass
@@ -542,6 +595,7 @@ class Client(object):
         :return: None
         """
         self._alpn_protocols = alpn_protocols
+        self._tls_context_reset()
 
     def reinitialise(self, client_id="", clean_session=True, userdata=None):
         if self._ssl:
@@ -551,12 +605,7 @@ class Client(object):
         elif self._sock:
             self._sock.close()
             self._sock = None
-        if self._sockpairR:
-            self._sockpairR.close()
-            self._sockpairR = None
-        if self._sockpairW:
-            self._sockpairW.close()
-            self._sockpairW = None
+        self._close_sockpair()
 
         self.__init__(client_id, clean_session, userdata)
 
@@ -631,6 +680,7 @@ class Client(object):
         self._tls_cert_reqs = cert_reqs
         self._tls_version = tls_version
         self._tls_ciphers = ciphers
+        self._tls_context_reset()
 
     def tls_insecure_set(self, value):
         """Configure verification of the server hostname in the server certificate.
@@ -742,43 +792,8 @@ class Client(object):
         if self._port <= 0:
             raise ValueError('Invalid port number.')
 
-        self._in_packet = {
-            "command": 0,
-            "have_remaining": 0,
-            "remaining_count": [],
-            "remaining_mult": 1,
-            "remaining_length": 0,
-            "packet": b"",
-            "to_process": 0,
-            "pos": 0}
-
-        self._out_packet_mutex.acquire()
-        self._out_packet = []
-        self._out_packet_mutex.release()
-
-        self._current_out_packet_mutex.acquire()
-        self._current_out_packet = None
-        self._current_out_packet_mutex.release()
-
-        self._msgtime_mutex.acquire()
-        self._last_msg_in = time.time()
-        self._last_msg_out = time.time()
-        self._msgtime_mutex.release()
-
-        self._ping_t = 0
-        self._state_mutex.acquire()
-        self._state = mqtt_cs_new
-        self._state_mutex.release()
-        if self._ssl:
-            self._ssl.close()
-            self._ssl = None
-            self._sock = None
-        elif self._sock:
-            self._sock.close()
-            self._sock = None
-
-        # Put messages in progress in a valid state.
-        self._messages_reconnect_reset()
+        self._reset_connection_state()
+        self._external_transport = False
 
         try:
             if self._socket_factory:
@@ -794,13 +809,13 @@ class Client(object):
         verify_hostname = self._tls_insecure is False  # Decide whether we need to verify hostname
 
         if self._tls_ca_certs is not None:
-            if self._useSecuredWebsocket:
-                # Never assign to ._ssl before wss handshake is finished
-                # Non-None value for ._ssl will allow ops before wss-MQTT connection is established
+            if HAVE_SSL_SESSION:
+                ssl_context = self._tls_context()
+                rawSSL = self._tls_handshake(ssl_context, sock)
+                if ssl_context.check_hostname:
+                    verify_hostname = False  # Already checked during the handshake
+            elif self._useSecuredWebsocket:
                 rawSSL = ssl.wrap_socket(sock, ca_certs=self._tls_ca_certs, cert_reqs=ssl.CERT_REQUIRED)  # Add server certificate verification
-                rawSSL.setblocking(0)  # Non-blocking socket
-                self._ssl = SecuredWebSocketCore(rawSSL, self._host, self._port, self._AWSAccessKeyIDCustomConfig, self._AWSSecretAccessKeyCustomConfig, self._AWSSessionTokenCustomConfig)  # Override the _ssl socket
-                # self._ssl.enableDebug()
             elif self._alpn_protocols is not None:
                 # SSLContext is required to enable ALPN support
                 # Assuming Python 2.7.10+/3.5+ till the end of this elif branch
@@ -811,12 +826,12 @@ class Client(object):
                     .with_check_hostname(True)\
                     .with_ciphers(self._tls_ciphers)\
                     .with_alpn_protocols(self._alpn_protocols)\
-                    .build()
-                self._ssl = ssl_context.wrap_socket(sock, server_hostname=self._host, do_handshake_on_connect=False)
+                    .build_shared()
+                rawSSL = ssl_context.wrap_socket(sock, server_hostname=self._host, do_handshake_on_connect=False)
                 verify_hostname = False  # Since check_hostname in SSLContext is already set to True, no need to verify it again
-                self._ssl.do_handshake()
+                rawSSL.do_handshake()
             else:
-                self._ssl = ssl.wrap_socket(
+                rawSSL = ssl.wrap_socket(
                     sock,
                     certfile=self._tls_certfile,
                     keyfile=self._tls_keyfile,
@@ -825,6 +840,15 @@ class Client(object):
                     ssl_version=self._tls_version,
                     ciphers=self._tls_ciphers)
 
+            if self._useSecuredWebsocket:
+                # Never assign to ._ssl before wss handshake is finished
+                # Non-None value for ._ssl will allow ops before wss-MQTT connection is established
+                rawSSL.setblocking(0)  # Non-blocking socket
+                self._ssl = SecuredWebSocketCore(rawSSL, self._host, self._port, self._AWSAccessKeyIDCustomConfig, self._AWSSecretAccessKeyCustomConfig, self._AWSSessionTokenCustomConfig)  # Override the _ssl socket
+                # self._ssl.enableDebug()
+            else:
+                self._ssl = rawSSL
+
             if verify_hostname:
                 if sys.version_info[0] < 3 or (sys.version_info[0] == 3 and sys.version_info[1] < 5):  # No IP host match before 3.5.x
                     self._tls_match_hostname()
@@ -842,6 +866,147 @@ class Client(object):
 
         return self._send_connect(self._keepalive, self._clean_session)
 
+    def _tls_context(self):
+        # Same settings as the ssl.wrap_socket() calls used where TLS sessions are not
+        # supported, plus the ALPN protocols if any. Contexts are shared by all clients
+        # with the same settings and rebuilt once the credential files change.
+        builder = SSLContextBuilder()
+        if self._useSecuredWebsocket:
+            builder.with_protocol(ssl.PROTOCOL_SSLv23)\
+                .with_check_hostname(False)\
+                .with_cert_reqs(ssl.CERT_REQUIRED)
+        elif self._alpn_protocols is not None:
+            builder.with_cert_key_pair(self._tls_certfile, self._tls_keyfile)\
+                .with_check_hostname(True)\
+                .with_cert_reqs(self._tls_cert_reqs)\
+                .with_ciphers(self._tls_ciphers)\
+                .with_alpn_protocols(self._alpn_protocols)
+        else:
+            builder.with_protocol(self._tls_version)\
+                .with_cert_key_pair(self._tls_certfile, self._tls_keyfile)\
+                .with_check_hostname(False)\
+                .with_cert_reqs(self._tls_cert_reqs)\
+                .with_ciphers(self._tls_ciphers)
+        ssl_context = builder.with_ca_certs(self._tls_ca_certs).build_shared()
+        if ssl_context is not self._ssl_context:
+            self._tls_context_reset()
+            self._ssl_context = ssl_context
+        return ssl_context
+
+    def _tls_context_reset(self):
+        # A session can only be resumed with the context it was established with
+        self._ssl_context = None
+        self._tls_session = None
+
+    def _tls_handshake(self, ssl_context, sock):
+        # Offers the session of the previous connection. If the server still has it,
+        # the handshake skips the certificate exchange and verification.
+        handshake_start = time.time()
+        ssl_sock = ssl_context.wrap_socket(sock, server_hostname=self._host, do_handshake_on_connect=False,
+                                           session=self._tls_session)
+        ssl_sock.do_handshake()
+        handshake_sec = time.time() - handshake_start
+        self._tls_handshakes += 1
+        self._tls_last_handshake_sec = handshake_sec
+        if ssl_sock.session_reused:
+            self._tls_resumed_handshakes += 1
+            self._tls_resumed_handshake_sec += handshake_sec
+        else:
+            self._tls_full_handshake_sec += handshake_sec
+        return ssl_sock
+
+    def _tls_session_save(self):
+        # Called once connected: with TLS 1.3 the session ticket only arrives after the
+        # handshake, but before the server's first MQTT packet
+        if not HAVE_SSL_SESSION or self._ssl_context is None or self._ssl is None:
+            return
+        ssl_sock = self._ssl.getSSLSocket() if self._useSecuredWebsocket else self._ssl
+        session = getattr(ssl_sock, "session", None)
+        if session is not None:
+            self._tls_session = session
+
+    def tls_session_metrics(self):
+        """Return a dict with the number of TLS handshakes so far, how many of
+        them resumed the session of an earlier connection, the duration of the
+        last one and the average duration of full and of resumed handshakes,
+        in seconds."""
+        full_handshakes = self._tls_handshakes - self._tls_resumed_handshakes
+        return {
+            "handshakes": self._tls_handshakes,
+            "resumed_handshakes": self._tls_resumed_handshakes,
+            "last_handshake_sec": self._tls_last_handshake_sec,
+            "average_full_handshake_sec": self._tls_full_handshake_sec / full_handshakes if full_handshakes else 0.0,
+            "average_resumed_handshake_sec":
+                self._tls_resumed_handshake_sec / self._tls_resumed_handshakes if self._tls_resumed_handshakes else 0.0
+        }
+
+    def connect_transport(self, sock, keepalive=60):
+        """Start an MQTT session over an already established connection.
+
+        sock is a socket-like object providing recv(), send() and close(). It
+        is driven by the caller's own event loop through loop_read(),
+        loop_write() and loop_misc(), so no wakeup socket pair is kept and no
+        reconnect/backoff logic is applied to it."""
+        if keepalive < 0:
+            raise ValueError('Keepalive must be >=0.')
+
+        self._keepalive = keepalive
+        self._reset_connection_state()
+        self._external_transport = True
+        self._close_sockpair()
+        self._sock = sock
+
+        return self._send_connect(self._keepalive, self._clean_session)
+
+    def _reset_connection_state(self):
+        self._in_packet = {
+            "command": 0,
+            "remaining_length": 0,
+            "packet": b""}
+        self._in_buffer = bytearray()
+
+        self._out_packet_mutex.acquire()
+        self._out_packet = deque()
+        self._out_packet_bytes = 0
+        self._out_packet_urgent = False
+        self._out_packet_mutex.release()
+
+        self._current_out_packet_mutex.acquire()
+        self._current_out_packet = None
+        self._current_out_packet_mutex.release()
+
+        self._msgtime_mutex.acquire()
+        self._last_msg_in = time.time()
+        self._last_msg_out = time.time()
+        self._msgtime_mutex.release()
+
+        self._ping_t = 0
+        self._state_mutex.acquire()
+        self._state = mqtt_cs_new
+        self._state_mutex.release()
+        if self._ssl:
+            self._ssl.close()
+            self._ssl = None
+            self._sock = None
+        elif self._sock:
+            self._sock.close()
+            self._sock = None
+
+        # Put messages in progress in a valid state.
+        self._messages_reconnect_reset()
+
+    def _close_sockpair(self):
+        if self._loop_selector is not None:
+            self._loop_selector.close()
+            self._loop_selector = None
+            self._loop_selector_sock = None
+        if self._sockpairR:
+            self._sockpairR.close()
+            self._sockpairR = None
+        if self._sockpairW:
+            self._sockpairW.close()
+            self._sockpairW = None
+
     def loop(self, timeout=1.0, max_packets=1):
         """Process network events.
 
@@ -865,56 +1030,113 @@ class Client(object):
         if timeout < 0.0:
             raise ValueError('Invalid timeout.')
 
+        sock = self.socket()
+        if sock is None:
+            return MQTT_ERR_CONN_LOST
+
+        # Publishers only signal sockpairW while this thread is blocked waiting
+        # for network events, so the flag has to be up before checking for
+        # queued packets: a packet queued after the check then always finds it.
+        self._loop_waiting = True
         self._current_out_packet_mutex.acquire()
         self._out_packet_mutex.acquire()
         if self._current_out_packet is None and len(self._out_packet) > 0:
-            self._current_out_packet = self._out_packet.pop(0)
-
-        if self._current_out_packet:
-            wlist = [self.socket()]
-        else:
-            wlist = []
+            self._current_out_packet = self._out_packet.popleft()
+        want_write = self._current_out_packet is not None
         self._out_packet_mutex.release()
         self._current_out_packet_mutex.release()
+        self._loop_write_deferred = False
+        if want_write:
+            deferral = self.write_deferral()
+            if deferral > 0:
+                # Give more packets the chance to join the same write
+                want_write = False
+                self._loop_write_deferred = True
+                timeout = min(timeout, deferral)
 
-        # sockpairR is used to break out of select() before the timeout, on a
-        # call to publish() etc.
-        rlist = [self.socket(), self._sockpairR]
         try:
-            socklist = select.select(rlist, wlist, [], timeout)
-        except TypeError as e:
+            readable, writable, woken = self._loop_select(sock, want_write, timeout)
+        except TypeError:
             # Socket isn't correct type, in likelihood connection is lost
             return MQTT_ERR_CONN_LOST
         except ValueError:
-            # Can occur if we just reconnected but rlist/wlist contain a -1 for
-            # some reason.
+            # Can occur if we just reconnected but the socket has been closed
+            # in the meantime.
             return MQTT_ERR_CONN_LOST
         except:
             return MQTT_ERR_UNKNOWN
+        finally:
+            self._loop_waiting = False
+            self._loop_write_deferred = False
 
-        if self.socket() in socklist[0]:
+        if readable:
             rc = self.loop_read(max_packets)
             if rc or (self._ssl is None and self._sock is None):
                 return rc
 
-        if self._sockpairR in socklist[0]:
-            # Stimulate output write even though we didn't ask for it, because
-            # at that point the publish or other command wasn't present.
-            socklist[1].insert(0, self.socket())
-            # Clear sockpairR - only ever a single byte written.
-            try:
-                self._sockpairR.recv(1)
-            except socket.error as err:
-                if err.errno != EAGAIN:
-                    raise
+        if woken:
+            # Clear sockpairR before looking at the queue again: a packet queued
+            # from now on signals afresh. Stimulate output write even though we
+            # didn't ask for it, because at select time the publish or other
+            # command wasn't present.
+            self._wakeup_signalled = False
+            self._drain_sockpair()
+            writable = True
+
+        if self._current_out_packet is not None and self.write_deferral() > 0:
+            writable = False  # Deferred until the coalescing delay is up or the budget is full
 
-        if self.socket() in socklist[1]:
+        if writable:
             rc = self.loop_write(max_packets)
             if rc or (self._ssl is None and self._sock is None):
                 return rc
 
         return self.loop_misc()
 
+    def _loop_select(self, sock, want_write, timeout):
+        # Wait for network events on sock and for a wakeup on sockpairR.
+        # Returns (readable, writable, woken). The selector (epoll/kqueue where
+        # available) keeps its registrations across calls, so a loop iteration
+        # costs a single system call rather than re-submitting both sockets.
+        if selectors is None:
+            rlist = [sock, self._sockpairR]
+            socklist = select.select(rlist, [sock] if want_write else [], [], timeout)
+            return sock in socklist[0], sock in socklist[1], self._sockpairR in socklist[0]
+
+        if self._loop_selector is None:
+            self._loop_selector = selectors.DefaultSelector()
+            self._loop_selector.register(self._sockpairR, selectors.EVENT_READ)
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if want_write else selectors.EVENT_READ
+        if sock is not self._loop_selector_sock:
+            if self._loop_selector_sock is not None:
+                # Looked up by object, so this also works once the old socket is closed
+                try:
+                    self._loop_selector.unregister(self._loop_selector_sock)
+                except (KeyError, ValueError):
+                    pass
+                self._loop_selector_sock = None
+            self._loop_selector.register(sock, events)
+            self._loop_selector_sock = sock
+        elif self._loop_selector.get_key(sock).events != events:
+            self._loop_selector.modify(sock, events)
+
+        readable = writable = woken = False
+        for key, mask in self._loop_selector.select(timeout):
+            if key.fileobj is sock:
+                readable = bool(mask & selectors.EVENT_READ)
+                writable = bool(mask & selectors.EVENT_WRITE)
+            else:
+                woken = True
+        return readable, writable, woken
+
+    def _drain_sockpair(self):
+        try:
+            while self._sockpairR.recv(4096):
+                pass
+        except socket.error as err:
+            if err.errno != EAGAIN:
+                raise
+
     def publish(self, topic, payload=None, qos=0, retain=False):
         """Publish a message on a topic.
 
@@ -944,8 +1166,17 @@ class Client(object):
             raise ValueError('Invalid topic.')
         if qos<0 or qos>2:
             raise ValueError('Invalid QoS level.')
-        if isinstance(payload, str) or isinstance(payload, bytearray):
+        if isinstance(payload, str) or isinstance(payload, bytearray) or isinstance(payload, bytes):
             local_payload = payload
+        elif isinstance(payload, memoryview):
+            # Sent without copying, the underlying buffer must not be modified
+            # until the message is complete
+            if sys.version_info[0] < 3:
+                local_payload = payload.tobytes()
+            elif payload.format != 'B' or payload.ndim != 1:
+                local_payload = payload.cast('B')
+            else:
+                local_payload = payload
         elif sys.version_info[0] < 3 and isinstance(payload, unicode):
             local_payload = payload
         elif isinstance(payload, int) or isinstance(payload, float):
@@ -953,7 +1184,7 @@ class Client(object):
         elif payload is None:
             local_payload = None
         else:
-            raise TypeError('payload must be a string, bytearray, int, float or None.')
+            raise TypeError('payload must be a string, bytes, bytearray, memoryview, int, float or None.')
 
         if local_payload is not None and len(local_payload) > 268435455:
             raise ValueError('Payload too large.')
@@ -982,7 +1213,7 @@ class Client(object):
             message.dup = False
 
             self._out_message_mutex.acquire()                
-            self._out_messages.append(message)
+            self._out_messages[local_mid] = message
             if self._max_inflight_messages == 0 or self._inflight_messages < self._max_inflight_messages:
                 self._inflight_messages = self._inflight_messages+1
                 if qos == 1:
@@ -1002,6 +1233,7 @@ class Client(object):
                 return (rc, local_mid)
             else:
                 message.state = mqtt_ms_queued;
+                self._out_queued.append(message)
                 self._out_message_mutex.release()
                 return (MQTT_ERR_SUCCESS, local_mid)
 
@@ -1025,6 +1257,78 @@ class Client(object):
         """
         self._socket_factory = socket_factory
         
+    def connection_host_set(self, connection_host):
+        """Process network traffic on a shared connection host instead of a
+        thread per client. The host provides register(client) and
+        unregister(client), which loop_start() and loop_stop() delegate to.
+        It must be set before loop_start()."""
+        self._connection_host = connection_host
+
+    def reconnect_wanted(self):
+        """Whether the network loop should reconnect after a connection loss,
+        as loop_forever() does."""
+        return self._state != mqtt_cs_disconnecting and not self._thread_terminate
+
+    def connect_pending(self):
+        """Whether connect_async() was called but the connection has not been
+        attempted yet."""
+        return self._state == mqtt_cs_connect_async
+
+    def reconnect_backoff_sec(self):
+        """Non-blocking counterpart of the backoff loop_forever() sleeps for
+        before reconnecting. Returns the time to wait and advances the
+        backoff for the next reconnect."""
+        return self._backoffCore.nextBackOffTimeSecond()
+
+    def write_coalescing_set(self, max_bytes, max_delay=0.0):
+        """Send queued packets together, up to max_bytes per socket write (one
+        TLS record), instead of one write per packet. 0 turns coalescing off.
+
+        max_delay is how long, in seconds, PUBLISH packets may wait for more
+        packets to join the same write while less than max_bytes are queued.
+        Any other packet is written right away, together with what is queued
+        before it. 0 writes whatever is queued right away.
+
+        A ValueError will be raised if max_bytes or max_delay is negative."""
+        if max_bytes < 0 or max_delay < 0:
+            raise ValueError('Invalid write coalescing settings.')
+        self._write_coalesce_bytes = max_bytes
+        self._write_coalesce_delay = max_delay
+
+    def ws_frame_aggregation_set(self, max_bytes):
+        """Over secured websocket, pack queued packets, up to max_bytes, into
+        one websocket frame, instead of a frame (header and masking) per
+        packet. 0 sends every packet in a frame of its own.
+
+        Each websocket write is one frame, so this takes the place of the
+        max_bytes of write_coalescing_set() for websocket connections. Its
+        max_delay still applies.
+
+        A ValueError will be raised if max_bytes is negative."""
+        if max_bytes < 0:
+            raise ValueError('Invalid websocket frame aggregation size.')
+        self._ws_frame_aggregate_bytes = max_bytes
+
+    def _write_coalesce_budget(self):
+        if self._useSecuredWebsocket:
+            return self._ws_frame_aggregate_bytes
+        return self._write_coalesce_bytes
+
+    def write_deferral(self):
+        """Time in seconds the queued packets should still wait for more to be
+        coalesced with them, 0 if they should be written now."""
+        if (self._write_coalesce_delay <= 0 or self._out_packet_urgent
+                or self._out_packet_bytes >= self._write_coalesce_budget()):
+            return 0
+        return max(0, self._out_batch_start + self._write_coalesce_delay - time.time())
+
+    def wakeup_hook_set(self, hook):
+        """Call hook(client) whenever a packet is queued, instead of signalling
+        the loop() thread. Lets a loop that watches socket() itself learn that
+        want_write() may have become true. Set to None to restore the default.
+        """
+        self._wakeup_hook = hook
+
     def disconnect(self):
         """Disconnect a connected client from the broker."""
         self._state_mutex.acquire()
@@ -1296,7 +1600,7 @@ class Client(object):
         elif payload is None:
             self._will_payload = None
         else:
-            raise TypeError('payload must be a string, bytearray, int, float or None.')
+            raise TypeError('payload must be a string, bytes, bytearray, memoryview, int, float or None.')
 
         self._will = True
         self._will_topic = topic.encode('utf-8')
@@ -1398,10 +1702,16 @@ class Client(object):
         """This is part of the threaded client interface. Call this once to
         start a new thread to process network traffic. This provides an
         alternative to repeatedly calling loop() yourself.
+
+        If a connection host is set, network traffic is processed by the
+        host's shared thread instead of a thread of its own.
         """
         if self._thread is not None:
             return MQTT_ERR_INVAL
 
+        if self._connection_host is not None:
+            return self._connection_host.register(self)
+
         self._thread_terminate = False
         self._thread = threading.Thread(target=self._thread_main)
         self._thread.daemon = True
@@ -1414,6 +1724,9 @@ class Client(object):
 
         The force parameter is currently ignored.
         """
+        if self._connection_host is not None:
+            return self._connection_host.unregister(self)
+
         if self._thread is None:
             return MQTT_ERR_INVAL
 
@@ -1436,13 +1749,7 @@ class Client(object):
             raise ValueError("sub and callback must both be defined.")
 
         self._callback_mutex.acquire()
-        for i in range(0, len(self.on_message_filtered)):
-            if self.on_message_filtered[i][0] == sub:
-                self.on_message_filtered[i] = (sub, callback)
-                self._callback_mutex.release()
-                return
-
-        self.on_message_filtered.append((sub, callback))
+        self.on_message_filtered[sub] = callback
         self._callback_mutex.release()
 
     def message_callback_remove(self, sub):
@@ -1452,11 +1759,10 @@ class Client(object):
             raise ValueError("sub must defined.")
 
         self._callback_mutex.acquire()
-        for i in range(0, len(self.on_message_filtered)):
-            if self.on_message_filtered[i][0] == sub:
-                self.on_message_filtered.pop(i)
-                self._callback_mutex.release()
-                return
+        try:
+            del self.on_message_filtered[sub]
+        except KeyError:  # no such subscription
+            pass
         self._callback_mutex.release()
 
     # ============================================================
@@ -1486,120 +1792,115 @@ class Client(object):
         return rc
 
     def _packet_read(self):
-        # This gets called if pselect() indicates that there is network data
-        # available - ie. at least one byte.  What we do depends on what data we
-        # already have.
-        # If we've not got a command, attempt to read one and save it. This should
-        # always work because it's only a single byte.
-        # Then try to read the remaining length. This may fail because it is may
-        # be more than one byte - will need to save data pending next read if it
-        # does fail.
-        # Then try to read the remaining payload, where 'payload' here means the
-        # combined variable header and actual payload. This is the most likely to
-        # fail due to longer length, so save current data and current position.
-        # After all data is read, send to _mqtt_handle_packet() to deal with.
-        # Finally, free the memory and reset everything to starting conditions.
-        if self._in_packet['command'] == 0:
+        # This gets called if select() indicates that there is network data
+        # available - ie. at least one byte. Read everything that is available
+        # in one go (up to READ_BUFFER_SIZE, plus whatever the TLS layer has
+        # already decrypted, since that will not wake select() again) and
+        # append it to _in_buffer.
+        # Then walk the buffer and pass every complete packet to
+        # _packet_handle(). A trailing incomplete packet stays in the buffer
+        # until a later read completes it, so a burst of small packets costs a
+        # single read instead of one read per header byte.
+        in_buffer = self._in_buffer
+        received = False
+        while True:
             try:
-                if self._ssl:
-                    command = self._ssl.read(1)
-                else:
-                    command = self._sock.recv(1)
+                data = self._packet_recv()
             except socket.error as err:
-                if self._ssl and (err.errno == ssl.SSL_ERROR_WANT_READ or err.errno == ssl.SSL_ERROR_WANT_WRITE):
-                    return MQTT_ERR_AGAIN
-                if err.errno == EAGAIN:
-                    return MQTT_ERR_AGAIN
+                if (self._ssl and (err.errno == ssl.SSL_ERROR_WANT_READ or err.errno == ssl.SSL_ERROR_WANT_WRITE)) \
+                        or err.errno == EAGAIN:
+                    # A wss control frame yields no MQTT data but may be
+                    # followed by more buffered frames
+                    if self._ssl_pending() > 0:
+                        continue
+                    break
                 print(err)
                 return 1
-            else:
-                if len(command) == 0:
-                    return 1
-                command = struct.unpack("!B", command)
-                self._in_packet['command'] = command[0]
-
-        if self._in_packet['have_remaining'] == 0:
-            # Read remaining
+            if len(data) == 0:
+                return 1
+            in_buffer.extend(data)
+            received = True
+            if self._ssl_pending() <= 0:
+                break
+        if not received:
+            return MQTT_ERR_AGAIN
+
+        rc = MQTT_ERR_SUCCESS
+        handled = False
+        pos = 0
+        buffer_length = len(in_buffer)
+        while buffer_length - pos >= 2:
+            # Decode remaining length
             # Algorithm for decoding taken from pseudo code at
             # http://publib.boulder.ibm.com/infocenter/wmbhelp/v6r0m0/topic/com.ibm.etools.mft.doc/ac10870_.htm
-            while True:
-                try:
-                    if self._ssl:
-                        byte = self._ssl.read(1)
-                    else:
-                        byte = self._sock.recv(1)
-                except socket.error as err:
-                    if self._ssl and (err.errno == ssl.SSL_ERROR_WANT_READ or err.errno == ssl.SSL_ERROR_WANT_WRITE):
-                        return MQTT_ERR_AGAIN
-                    if err.errno == EAGAIN:
-                        return MQTT_ERR_AGAIN
-                    print(err)
-                    return 1
-                else:
-                    byte = struct.unpack("!B", byte)
-                    byte = byte[0]
-                    self._in_packet['remaining_count'].append(byte)
-                    # Max 4 bytes length for remaining length as defined by protocol.
-                     # Anything more likely means a broken/malicious client.
-                    if len(self._in_packet['remaining_count']) > 4:
-                        return MQTT_ERR_PROTOCOL
-
-                    self._in_packet['remaining_length'] = self._in_packet['remaining_length'] + (byte & 127)*self._in_packet['remaining_mult']
-                    self._in_packet['remaining_mult'] = self._in_packet['remaining_mult'] * 128
-
+            remaining_length = 0
+            remaining_mult = 1
+            header_end = pos + 1
+            while header_end < buffer_length:
+                byte = in_buffer[header_end]
+                header_end = header_end + 1
+                remaining_length = remaining_length + (byte & 127)*remaining_mult
+                remaining_mult = remaining_mult * 128
                 if (byte & 128) == 0:
                     break
-
-            self._in_packet['have_remaining'] = 1
-            self._in_packet['to_process'] = self._in_packet['remaining_length']
-
-        while self._in_packet['to_process'] > 0:
-            try:
-                if self._ssl:
-                    data = self._ssl.read(self._in_packet['to_process'])
-                else:
-                    data = self._sock.recv(self._in_packet['to_process'])
-            except socket.error as err:
-                if self._ssl and (err.errno == ssl.SSL_ERROR_WANT_READ or err.errno == ssl.SSL_ERROR_WANT_WRITE):
-                    return MQTT_ERR_AGAIN
-                if err.errno == EAGAIN:
-                    return MQTT_ERR_AGAIN
-                print(err)
-                return 1
+                # Max 4 bytes length for remaining length as defined by protocol.
+                # Anything more likely means a broken/malicious client.
+                if header_end - pos > 4:
+                    return MQTT_ERR_PROTOCOL
             else:
-                self._in_packet['to_process'] = self._in_packet['to_process'] - len(data)
-                self._in_packet['packet'] = self._in_packet['packet'] + data
-
-        # All data for this packet is read.
-        self._in_packet['pos'] = 0
-        rc = self._packet_handle()
-
-        # Free data and reset values
-        self._in_packet = dict(
-            command=0,
-            have_remaining=0,
-            remaining_count=[],
-            remaining_mult=1,
-            remaining_length=0,
-            packet=b"",
-            to_process=0,
-            pos=0)
+                break  # Remaining length is not complete yet
+
+            packet_end = header_end + remaining_length
+            if packet_end > buffer_length:
+                break  # Payload is not complete yet
+
+            self._in_packet = {
+                "command": in_buffer[pos],
+                "remaining_length": remaining_length,
+                "packet": bytes(in_buffer[header_end:packet_end])}
+            pos = packet_end
+            handled = True
+            rc = self._packet_handle()
+            if rc != MQTT_ERR_SUCCESS or self._in_buffer is not in_buffer:
+                # Either an error, or the handler reconnected (MQTT v3.1
+                # downgrade) and the buffered data belongs to the old connection
+                break
 
-        self._msgtime_mutex.acquire()
-        self._last_msg_in = time.time()
-        self._msgtime_mutex.release()
+        if pos > 0 and self._in_buffer is in_buffer:
+            del in_buffer[:pos]
+
+        if handled:
+            self._msgtime_mutex.acquire()
+            self._last_msg_in = time.time()
+            self._msgtime_mutex.release()
         return rc
 
+    def _packet_recv(self):
+        if self._ssl:
+            return self._ssl.read(READ_BUFFER_SIZE)
+        else:
+            return self._sock.recv(READ_BUFFER_SIZE)
+
+    def _ssl_pending(self):
+        # Bytes already read off the socket by the TLS layer (and by the wss
+        # framing on top of it) that select() will not report as readable
+        if self._ssl is None or not hasattr(self._ssl, "pending"):
+            return 0
+        return self._ssl.pending()
+
     def _packet_write(self):
         self._current_out_packet_mutex.acquire()
         while self._current_out_packet:
             packet = self._current_out_packet
 
             try:
-                if self._ssl:
-                    write_length = self._ssl.write(packet['packet'][packet['pos']:])
+                data = self._packet_coalesce(packet)
+                if data is None:
+                    write_length = self._packet_send(packet)
+                elif self._ssl:
+                    write_length = self._ssl.write(data)
                 else:
-                    write_length = self._sock.send(packet['packet'][packet['pos']:])
+                    write_length = self._sock.send(data)
             except AttributeError:
                 self._current_out_packet_mutex.release()
                 return MQTT_ERR_SUCCESS
@@ -1612,9 +1913,12 @@ class Client(object):
                 print(err)
                 return 1
 
-            if write_length > 0:
-                packet['to_process'] = packet['to_process'] - write_length
-                packet['pos'] = packet['pos'] + write_length
+            # A coalesced write may have completed several packets
+            while write_length > 0 and packet is not None:
+                sent_length = min(write_length, packet['to_process'])
+                write_length = write_length - sent_length
+                packet['to_process'] = packet['to_process'] - sent_length
+                packet['pos'] = packet['pos'] + sent_length
 
                 if packet['to_process'] == 0:
                     if (packet['command'] & 0xF0) == PUBLISH and packet['qos'] == 0:
@@ -1650,12 +1954,13 @@ class Client(object):
 
                     self._out_packet_mutex.acquire()
                     if len(self._out_packet) > 0:
-                        self._current_out_packet = self._out_packet.pop(0)
+                        self._current_out_packet = self._out_packet.popleft()
                     else:
                         self._current_out_packet = None
+                        self._out_packet_bytes = 0
+                        self._out_packet_urgent = False
                     self._out_packet_mutex.release()
-            else:
-                pass  # FIXME
+                    packet = self._current_out_packet
 
         self._current_out_packet_mutex.release()
 
@@ -1664,6 +1969,61 @@ class Client(object):
         self._msgtime_mutex.release()
         return MQTT_ERR_SUCCESS
 
+    def _packet_coalesce(self, packet):
+        # Gather what is left of packet and the packets queued behind it, up to
+        # the coalescing budget, into one buffer so they go out in a single
+        # send (a single TLS record, or a single websocket frame). None if
+        # there is nothing to gather.
+        # After a partial or refused write the next buffer starts with the same
+        # bytes, as a TLS write retry requires.
+        budget = self._write_coalesce_budget()
+        if packet['to_process'] >= budget or (packet['command'] & 0xF0) == DISCONNECT:
+            return None
+        size = packet['to_process']
+        packets = [packet]
+        self._out_packet_mutex.acquire()
+        for next_packet in self._out_packet:
+            if size + next_packet['to_process'] > budget:
+                break
+            packets.append(next_packet)
+            size = size + next_packet['to_process']
+            if (next_packet['command'] & 0xF0) == DISCONNECT:
+                break
+        self._out_packet_mutex.release()
+        if len(packets) == 1:
+            return None
+
+        data = bytearray()
+        for next_packet in packets:
+            header = next_packet['packet']
+            payload = next_packet['payload']
+            pos = next_packet['pos']
+            if pos < len(header):
+                data += _buffer_view(header, pos)
+                if payload is not None:
+                    data += payload
+            else:
+                data += _buffer_view(payload, pos - len(header))
+        return data
+
+    def _packet_send(self, packet):
+        # Write as much of the packet as the socket accepts, starting at
+        # packet['pos'], without copying what is left of it
+        data = packet['packet']
+        pos = packet['pos']
+        payload = packet['payload']
+        if payload is not None:
+            header_length = len(data)
+            if pos >= header_length:
+                data = payload
+                pos = pos - header_length
+            elif self._ssl is None and hasattr(self._sock, 'sendmsg'):
+                return self._sock.sendmsg([_buffer_view(data, pos), payload])
+        if self._ssl:
+            return self._ssl.write(_buffer_view(data, pos))
+        else:
+            return self._sock.send(_buffer_view(data, pos))
+
     def _easy_log(self, level, buf):
         if self.on_log:
             self.on_log(self, self._userdata, level, buf)
@@ -1701,9 +2061,13 @@ class Client(object):
                 self._callback_mutex.release()
 
     def _mid_generate(self):
-        self._last_mid = self._last_mid + 1
-        if self._last_mid == 65536:
-            self._last_mid = 1
+        # Skip mids still held by outgoing messages, they key _out_messages
+        for _ in range(65535):
+            self._last_mid = self._last_mid + 1
+            if self._last_mid == 65536:
+                self._last_mid = 1
+            if self._last_mid not in self._out_messages:
+                break
         return self._last_mid
 
     def _topic_wildcard_len_check(self, topic):
@@ -1744,7 +2108,7 @@ class Client(object):
                 byte = byte | 0x80
 
             remaining_bytes.append(byte)
-            packet.extend(struct.pack("!B", byte))
+            packet.append(byte)
             if remaining_length == 0:
                 # FIXME - this doesn't deal with incorrectly large payloads
                 return packet
@@ -1779,51 +2143,55 @@ class Client(object):
         if self._sock is None and self._ssl is None:
             return MQTT_ERR_NO_CONN
 
-        utopic = topic.encode('utf-8')
         command = PUBLISH | ((dup&0x1)<<3) | (qos<<1) | retain
-        packet = bytearray()
-        packet.extend(struct.pack("!B", command))
+        topic_prefix = self._publish_topic_prefix(topic)
         if payload is None:
-            remaining_length = 2+len(utopic)
+            payloadlen = 0
             self._easy_log(MQTT_LOG_DEBUG, "Sending PUBLISH (d"+str(dup)+", q"+str(qos)+", r"+str(int(retain))+", m"+str(mid)+", '"+topic+"' (NULL payload)")
         else:
-            if isinstance(payload, str):
-                upayload = payload.encode('utf-8')
-                payloadlen = len(upayload)
-            elif isinstance(payload, bytearray):
-                payloadlen = len(payload)
-            elif isinstance(payload, unicode):
-                upayload = payload.encode('utf-8')
-                payloadlen = len(upayload)
-
-            remaining_length = 2+len(utopic) + payloadlen
+            if sys.version_info[0] < 3:
+                if isinstance(payload, unicode):
+                    payload = payload.encode('utf-8')
+            elif isinstance(payload, str):
+                payload = payload.encode('utf-8')
+            if not isinstance(payload, (bytes, bytearray, memoryview)):
+                raise TypeError('payload must be a string, unicode, bytes, bytearray or memoryview.')
+            payloadlen = len(payload)
             self._easy_log(MQTT_LOG_DEBUG, "Sending PUBLISH (d"+str(dup)+", q"+str(qos)+", r"+str(int(retain))+", m"+str(mid)+", '"+topic+"', ... ("+str(payloadlen)+" bytes)")
 
+        remaining_length = len(topic_prefix) + payloadlen
         if qos > 0:
             # For message id
             remaining_length = remaining_length + 2
 
+        packet = bytearray()
+        packet.append(command)
         self._pack_remaining_length(packet, remaining_length)
-        self._pack_str16(packet, topic)
+        packet.extend(topic_prefix)
 
         if qos > 0:
             # For message id
             packet.extend(struct.pack("!H", mid))
 
-        if payload is not None:
-            if isinstance(payload, str):
-                pack_format = str(payloadlen) + "s"
-                packet.extend(struct.pack(pack_format, upayload))
-            elif isinstance(payload, bytearray):
-                packet.extend(payload)
-            elif isinstance(payload, unicode):
-                pack_format = str(payloadlen) + "s"
-                packet.extend(struct.pack(pack_format, upayload))
-            else:
-                raise TypeError('payload must be a string, unicode or a bytearray.')
-
+        if payloadlen >= PUBLISH_SCATTER_THRESHOLD and not self._useSecuredWebsocket:
+            # The payload is written straight from the caller's buffer
+            return self._packet_queue(PUBLISH, packet, mid, qos, payload)
+        if payloadlen > 0:
+            packet.extend(payload)
         return self._packet_queue(PUBLISH, packet, mid, qos)
 
+    def _publish_topic_prefix(self, topic):
+        # Length-prefixed UTF-8 topic, as it appears in every PUBLISH on that topic
+        topic_prefix = self._publish_topic_cache.get(topic)
+        if topic_prefix is None:
+            topic_prefix = bytearray()
+            self._pack_str16(topic_prefix, topic)
+            topic_prefix = bytes(topic_prefix)
+            if len(self._publish_topic_cache) >= PUBLISH_TOPIC_CACHE_SIZE:
+                self._publish_topic_cache.clear()
+            self._publish_topic_cache[topic] = topic_prefix
+        return topic_prefix
+
     def _send_pubrec(self, mid):
         self._easy_log(MQTT_LOG_DEBUG, "Sending PUBREC (Mid: "+str(mid)+")")
         return self._send_command_with_mid(PUBREC, mid, False)
@@ -1936,7 +2304,7 @@ class Client(object):
     def _message_retry_check_actual(self, messages, mutex):
         mutex.acquire()
         now = time.time()
-        for m in messages:
+        for m in list(messages.values()):
             if m.timestamp + self._message_retry < now:
                 if m.state == mqtt_ms_wait_for_puback or m.state == mqtt_ms_wait_for_pubrec:
                     m.timestamp = now
@@ -1959,7 +2327,8 @@ class Client(object):
     def _messages_reconnect_reset_out(self):
         self._out_message_mutex.acquire()
         self._inflight_messages = 0
-        for m in self._out_messages:
+        self._out_queued.clear()
+        for m in self._out_messages.values():
             m.timestamp = 0
             if self._max_inflight_messages == 0 or self._inflight_messages < self._max_inflight_messages:
                 if m.qos == 0:
@@ -1980,14 +2349,15 @@ class Client(object):
                         m.state = mqtt_ms_publish
             else:
                 m.state = mqtt_ms_queued
+                self._out_queued.append(m)
         self._out_message_mutex.release()
 
     def _messages_reconnect_reset_in(self):
         self._in_message_mutex.acquire()
-        for m in self._in_messages:
+        for m in list(self._in_messages.values()):
             m.timestamp = 0
             if m.qos != 2:
-                self._in_messages.pop(self._in_messages.index(m))
+                del self._in_messages[m.mid]
             else:
                 # Preserve current state
                 pass
@@ -1997,32 +2367,50 @@ class Client(object):
         self._messages_reconnect_reset_out()
         self._messages_reconnect_reset_in()
 
-    def _packet_queue(self, command, packet, mid, qos):
+    def _wake_loop(self):
+        # Break out of select() in loop() so the queued packet gets written.
+        # Only needed while the loop thread is actually blocked there, and one
+        # byte in sockpairW covers any number of packets until it's drained.
+        hook = self._wakeup_hook
+        if hook is not None:
+            hook(self)
+        elif self._loop_write_deferred and self.write_deferral() > 0:
+            pass  # The loop is already due to wake up for the write
+        elif self._loop_waiting and not self._wakeup_signalled and self._sockpairW is not None:
+            self._wakeup_signalled = True
+            try:
+                self._sockpairW.send(sockpair_data)
+            except socket.error as err:
+                if err.errno != EAGAIN:
+                    raise
+
+    def _packet_queue(self, command, packet, mid, qos, payload=None):
+        # payload, if given, is sent as is right after packet
         mpkt = dict(
             command = command,
             mid = mid,
             qos = qos,
             pos = 0,
-            to_process = len(packet),
-            packet = packet)
+            to_process = len(packet) if payload is None else len(packet) + len(payload),
+            packet = packet,
+            payload = payload)
 
         self._out_packet_mutex.acquire()
+        if self._out_packet_bytes == 0:
+            self._out_batch_start = time.time()
+        self._out_packet_bytes += mpkt['to_process']
+        if (command & 0xF0) != PUBLISH:
+            self._out_packet_urgent = True
         self._out_packet.append(mpkt)
         if self._current_out_packet_mutex.acquire(False):
             if self._current_out_packet is None and len(self._out_packet) > 0:
-                self._current_out_packet = self._out_packet.pop(0)
+                self._current_out_packet = self._out_packet.popleft()
             self._current_out_packet_mutex.release()
         self._out_packet_mutex.release()
 
-        # Write a single byte to sockpairW (connected to sockpairR) to break
-        # out of select() if in threaded mode.
-        try:
-            self._sockpairW.send(sockpair_data)
-        except socket.error as err:
-            if err.errno != EAGAIN:
-                raise
+        self._wake_loop()
 
-        if not self._in_callback and self._thread is None:
+        if not self._in_callback and self._thread is None and self._connection_host is None and self.write_deferral() == 0:
             return self.loop_write()
         else:
             return MQTT_ERR_SUCCESS
@@ -2081,7 +2469,7 @@ class Client(object):
             return MQTT_ERR_PROTOCOL
 
         (flags, result) = struct.unpack("!BB", self._in_packet['packet'])
-        if result == CONNACK_REFUSED_PROTOCOL_VERSION and self._protocol == MQTTv311:
+        if result == CONNACK_REFUSED_PROTOCOL_VERSION and self._protocol == MQTTv311 and not self._external_transport:
             self._easy_log(MQTT_LOG_DEBUG, "Received CONNACK ("+str(flags)+", "+str(result)+"), attempting downgrade to MQTT v3.1.")
             # Downgrade to MQTT v3.1
             self._protocol = MQTTv31
@@ -2089,6 +2477,7 @@ class Client(object):
 
         if result == 0:
             self._state = mqtt_cs_connected
+            self._tls_session_save()
 
         self._easy_log(MQTT_LOG_DEBUG, "Received CONNACK ("+str(flags)+", "+str(result)+")")
         self._callback_mutex.acquire()
@@ -2110,12 +2499,15 @@ class Client(object):
         self._callback_mutex.release()
 
         # Start counting for stable connection
-        self._backoffCore.startStableConnectionTimer()
+        if self._connection_host is not None:
+            self._backoffCore.startStableConnectionClock()
+        elif not self._external_transport:
+            self._backoffCore.startStableConnectionTimer()
 
         if result == 0:
             rc = 0
             self._out_message_mutex.acquire()
-            for m in self._out_messages:
+            for m in list(self._out_messages.values()):
                 m.timestamp = time.time()
                 if m.state == mqtt_ms_queued:
                     self.loop_write()  # Process outgoing messages that have just been queued up
@@ -2227,7 +2619,7 @@ class Client(object):
             rc = self._send_pubrec(message.mid)
             message.state = mqtt_ms_wait_for_pubrel
             self._in_message_mutex.acquire()
-            self._in_messages.append(message)
+            self._in_messages[message.mid] = message
             self._in_message_mutex.release()
             return rc
         else:
@@ -2246,43 +2638,41 @@ class Client(object):
         self._easy_log(MQTT_LOG_DEBUG, "Received PUBREL (Mid: "+str(mid)+")")
 
         self._in_message_mutex.acquire()
-        for i in range(len(self._in_messages)):
-            if self._in_messages[i].mid == mid:
-
-                # Only pass the message on if we have removed it from the queue - this
-                # prevents multiple callbacks for the same message.
-                self._handle_on_message(self._in_messages[i])
-                self._in_messages.pop(i)
-                self._inflight_messages = self._inflight_messages - 1
-                if self._max_inflight_messages > 0:
-                    self._out_message_mutex.acquire()
-                    rc = self._update_inflight()
-                    self._out_message_mutex.release()
-                    if rc != MQTT_ERR_SUCCESS:
-                        self._in_message_mutex.release()
-                        return rc
+        message = self._in_messages.get(mid)
+        if message is not None:
+            # Only pass the message on if we have removed it from the queue - this
+            # prevents multiple callbacks for the same message.
+            self._handle_on_message(message)
+            del self._in_messages[mid]
+            self._inflight_messages = self._inflight_messages - 1
+            if self._max_inflight_messages > 0:
+                self._out_message_mutex.acquire()
+                rc = self._update_inflight()
+                self._out_message_mutex.release()
+                if rc != MQTT_ERR_SUCCESS:
+                    self._in_message_mutex.release()
+                    return rc
 
-                self._in_message_mutex.release()
-                return self._send_pubcomp(mid)
+            self._in_message_mutex.release()
+            return self._send_pubcomp(mid)
 
         self._in_message_mutex.release()
         return MQTT_ERR_SUCCESS
 
     def _update_inflight(self):
         # Dont lock message_mutex here
-        for m in self._out_messages:
-            if self._inflight_messages < self._max_inflight_messages:
-                if m.qos > 0 and m.state == mqtt_ms_queued:
-                    self._inflight_messages = self._inflight_messages + 1
-                    if m.qos == 1:
-                        m.state = mqtt_ms_wait_for_puback
-                    elif m.qos == 2:
-                        m.state = mqtt_ms_wait_for_pubrec
-                    rc = self._send_publish(m.mid, m.topic, m.payload, m.qos, m.retain, m.dup)
-                    if rc != 0:
-                        return rc
-            else:
-                return MQTT_ERR_SUCCESS
+        while self._inflight_messages < self._max_inflight_messages and self._out_queued:
+            m = self._out_queued.popleft()
+            # Skip entries that were promoted or completed in the meantime
+            if m.qos > 0 and m.state == mqtt_ms_queued and self._out_messages.get(m.mid) is m:
+                self._inflight_messages = self._inflight_messages + 1
+                if m.qos == 1:
+                    m.state = mqtt_ms_wait_for_puback
+                elif m.qos == 2:
+                    m.state = mqtt_ms_wait_for_pubrec
+                rc = self._send_publish(m.mid, m.topic, m.payload, m.qos, m.retain, m.dup)
+                if rc != 0:
+                    return rc
         return MQTT_ERR_SUCCESS
 
     def _handle_pubrec(self):
@@ -2295,12 +2685,12 @@ class Client(object):
         self._easy_log(MQTT_LOG_DEBUG, "Received PUBREC (Mid: "+str(mid)+")")
 
         self._out_message_mutex.acquire()
-        for m in self._out_messages:
-            if m.mid == mid:
-                m.state = mqtt_ms_wait_for_pubcomp
-                m.timestamp = time.time()
-                self._out_message_mutex.release()
-                return self._send_pubrel(mid, False)
+        m = self._out_messages.get(mid)
+        if m is not None:
+            m.state = mqtt_ms_wait_for_pubcomp
+            m.timestamp = time.time()
+            self._out_message_mutex.release()
+            return self._send_pubrel(mid, False)
 
         self._out_message_mutex.release()
         return MQTT_ERR_SUCCESS
@@ -2331,32 +2721,23 @@ class Client(object):
         self._easy_log(MQTT_LOG_DEBUG, "Received "+cmd+" (Mid: "+str(mid)+")")
 
         self._out_message_mutex.acquire()
-        for i in range(len(self._out_messages)):
-            try:
-                if self._out_messages[i].mid == mid:
-                    # Only inform the client the message has been sent once.
-                    self._callback_mutex.acquire()
-                    if self.on_publish:
-                        self._out_message_mutex.release()
-                        self._in_callback = True
-                        self.on_publish(self, self._userdata, mid)
-                        self._in_callback = False
-                        self._out_message_mutex.acquire()
-
-                    self._callback_mutex.release()
-                    self._out_messages.pop(i)
-                    self._inflight_messages = self._inflight_messages - 1
-                    if self._max_inflight_messages > 0:
-                        rc = self._update_inflight()
-                        if rc != MQTT_ERR_SUCCESS:
-                            self._out_message_mutex.release()
-                            return rc
+        # Only inform the client the message has been sent once.
+        if self._out_messages.pop(mid, None) is not None:
+            self._callback_mutex.acquire()
+            if self.on_publish:
+                self._out_message_mutex.release()
+                self._in_callback = True
+                self.on_publish(self, self._userdata, mid)
+                self._in_callback = False
+                self._out_message_mutex.acquire()
+
+            self._callback_mutex.release()
+            self._inflight_messages = self._inflight_messages - 1
+            if self._max_inflight_messages > 0:
+                rc = self._update_inflight()
+                if rc != MQTT_ERR_SUCCESS:
                     self._out_message_mutex.release()
-                    return MQTT_ERR_SUCCESS
-            except IndexError:
-                # Have removed item so i>count.
-                # Not really an error.
-                pass
+                    return rc
 
         self._out_message_mutex.release()
         return MQTT_ERR_SUCCESS
@@ -2364,12 +2745,11 @@ class Client(object):
     def _handle_on_message(self, message):
         self._callback_mutex.acquire()
         matched = False
-        for t in self.on_message_filtered:
-            if topic_matches_sub(t[0], message.topic):
-                self._in_callback = True
-                t[1](self, self._userdata, message)
-                self._in_callback = False
-                matched = True
+        for callback in self.on_message_filtered.iter_match(message.topic):
+            self._in_callback = True
+            callback(self, self._userdata, message)
+            self._in_callback = False
+            matched = True
 
         if matched == False and self.on_message:
             self._in_callback = True
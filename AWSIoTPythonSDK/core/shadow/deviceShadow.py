@@ -13,10 +13,12 @@
 # * permissions and limitations under the License.
 # */
 
+import copy
 import json
 import logging
 import uuid
-from threading import Timer, Lock, Thread
+from threading import Lock, RLock, Thread
+from AWSIoTPythonSDK.core.util.timers import get_shared_timer_wheel
 
 
 class _shadowRequestToken:
@@ -36,6 +38,9 @@ class _basicJSONParser:
     def regenerateString(self):
         return json.dumps(self._dictionaryObject)
 
+    def getDocument(self):
+        return self._dictionaryObject
+
     def getAttributeValue(self, srcAttributeKey):
         return self._dictionaryObject.get(srcAttributeKey)
 
@@ -50,9 +55,117 @@ class _basicJSONParser:
         return True
 
 
+class _shadowLocalCache:
+    # Local copy of the desired/reported state of a shadow, kept up to date from the documents of
+    # the responses and deltas coming in. Documents older than the local version are ignored.
+
+    def __init__(self):
+        self._state = None  # None until a document has been seen
+        self._version = -1
+        self._isVersionFromDelta = False
+
+    def applyDocument(self, srcAction, srcType, srcState, srcVersion):
+        if srcVersion is None or srcVersion < self._version:
+            return
+        if srcVersion == self._version:
+            # The update accepted response and the delta of one update share its version and may
+            # come in either order, only the former has the reported state. Deleting a shadow does
+            # not change its version.
+            if not (srcAction == "update" and self._isVersionFromDelta) and srcAction != "delete":
+                return
+        if srcAction == "delete":
+            if srcType == "accepted":
+                self._state = dict()
+                self._version = srcVersion
+                self._isVersionFromDelta = False
+            return
+        if not isinstance(srcState, dict):
+            return
+        if srcAction == "get":
+            # The whole document, but delta is derived from desired and reported
+            self._state = dict((section, value) for section, value in srcState.items() if section != "delta")
+        elif srcAction == "update":
+            if self._state is None:
+                self._state = dict()
+            self._mergeState(self._state, srcState)
+        else:
+            # Deltas carry the desired values that differ from the reported ones
+            if self._state is None:
+                self._state = dict()
+            desiredState = self._state.get("desired")
+            if not isinstance(desiredState, dict):
+                desiredState = self._state["desired"] = dict()
+            self._mergeState(desiredState, srcState)
+        self._version = srcVersion
+        self._isVersionFromDelta = srcAction == "delta"
+
+    def _mergeState(self, dstState, srcPatch):
+        # JSON merge, a null value deletes the key
+        for key, value in srcPatch.items():
+            if value is None:
+                dstState.pop(key, None)
+            elif isinstance(value, dict):
+                if not isinstance(dstState.get(key), dict):
+                    dstState[key] = dict()
+                self._mergeState(dstState[key], value)
+            else:
+                dstState[key] = value
+
+    def getState(self):
+        if self._state is None:
+            return None
+        return {"state": copy.deepcopy(self._state), "version": self._version}
+
+
+class _shadowUpdateBatch:
+    # Reported patches merged while the coalescing window is open, sent as one update with the
+    # token of the batch. The response goes to the callbacks of all the merged updates.
+
+    def __init__(self, srcToken):
+        self.token = srcToken
+        self.reportedState = dict()
+        self.callbacks = list()
+        self.timeout = 0
+        self.timer = None  # Window timer on the timer wheel
+
+    def isMergeable(self, srcReportedState):
+        return self._isMergeable(self.reportedState, srcReportedState)
+
+    def _isMergeable(self, dstState, srcPatch):
+        # A null deletes the key and a later object sets it anew, one patch cannot say both
+        for key, value in srcPatch.items():
+            if isinstance(value, dict) and key in dstState:
+                currentValue = dstState[key]
+                if currentValue is None:
+                    return False
+                if isinstance(currentValue, dict) and not self._isMergeable(currentValue, value):
+                    return False
+        return True
+
+    def merge(self, srcReportedState, srcCallback, srcTimeout):
+        self._mergeState(self.reportedState, srcReportedState)
+        if srcCallback is not None:
+            self.callbacks.append(srcCallback)
+        self.timeout = max(self.timeout, srcTimeout)
+
+    def _mergeState(self, dstState, srcPatch):
+        # Later values win, nulls are kept so that the update still deletes the key
+        for key, value in srcPatch.items():
+            if isinstance(value, dict) and isinstance(dstState.get(key), dict):
+                self._mergeState(dstState[key], value)
+            else:
+                dstState[key] = value
+
+    def getPayloadLength(self):
+        return len(json.dumps(self.reportedState))
+
+
 class deviceShadow:
     _logger = logging.getLogger(__name__)
 
+    # Stays below the 8 KB limit of AWS IoT on shadow update documents
+    _DEFAULT_UPDATE_COALESCING_MAX_BYTES = 7168
+
     def __init__(self, srcShadowName, srcIsPersistentSubscribe, srcShadowManager):
         """
 
@@ -98,7 +211,15 @@ class deviceShadow:
         self._shadowSubscribeStatusTable["get"] = 0
         self._shadowSubscribeStatusTable["delete"] = 0
         self._shadowSubscribeStatusTable["update"] = 0
-        self._tokenPool = dict()
+        self._tokenPool = dict()  # Token -> timeout timer, None until the request is published
+        self._tokenCallbacks = dict()  # Token -> callback replacing the one of its action, for coalesced updates
+        self._timerWheel = get_shared_timer_wheel()
+        self._localCache = None  # Set up by configureLocalCache
+        self._updateCoalescingWindowSecond = 0  # Set up by configureUpdateCoalescing
+        self._updateCoalescingMaxBytes = self._DEFAULT_UPDATE_COALESCING_MAX_BYTES
+        self._updateBatch = None  # Pending coalesced update
+        # Held from taking an update to publishing it, so updates reach AWS IoT in the order they are taken
+        self._updateSendLock = RLock()
         self._dataStructureLock = Lock()
 
     def _doNonPersistentUnsubscribe(self, currentAction):
@@ -118,6 +239,9 @@ class deviceShadow:
                 # Check for token
                 self._basicJSONParserHandler.setString(payloadUTF8String)
                 if self._basicJSONParserHandler.validateJSON():  # Filter out invalid JSON
+                    # Responses to requests of other clients are just as current
+                    if self._localCache is not None and currentType == "accepted":
+                        self._localCache.applyDocument(currentAction, currentType, self._basicJSONParserHandler.getAttributeValue(u"state"), self._basicJSONParserHandler.getAttributeValue(u"version"))
                     currentToken = self._basicJSONParserHandler.getAttributeValue(u"clientToken")
                     if currentToken is not None:
                         self._logger.debug("shadow message clientToken: " + currentToken)
@@ -133,8 +257,9 @@ class deviceShadow:
                             else:
                                 self._lastVersionInSync = -1  # The version will always be synced for the next incoming delta/GU-accepted response
                         # Cancel the timer and clear the token
-                        self._tokenPool[currentToken].cancel()
-                        del self._tokenPool[currentToken]
+                        currentTimer = self._tokenPool.pop(currentToken)
+                        if currentTimer is not None:
+                            currentTimer.cancel()
                         # Need to unsubscribe?
                         self._shadowSubscribeStatusTable[currentAction] -= 1
                         if not self._isPersistentSubscribe and self._shadowSubscribeStatusTable.get(currentAction) <= 0:
@@ -142,8 +267,9 @@ class deviceShadow:
                             processNonPersistentUnsubscribe = Thread(target=self._doNonPersistentUnsubscribe, args=[currentAction])
                             processNonPersistentUnsubscribe.start()
                         # Custom callback
-                        if self._shadowSubscribeCallbackTable.get(currentAction) is not None:
-                            processCustomCallback = Thread(target=self._shadowSubscribeCallbackTable[currentAction], args=[payloadUTF8String, currentType, currentToken])
+                        currentCallback = self._tokenCallbacks.pop(currentToken, self._shadowSubscribeCallbackTable.get(currentAction))
+                        if currentCallback is not None:
+                            processCustomCallback = Thread(target=currentCallback, args=[payloadUTF8String, currentType, currentToken])
                             processCustomCallback.start()
             # delta: Watch for version
             else:
@@ -152,6 +278,8 @@ class deviceShadow:
                 self._basicJSONParserHandler.setString(payloadUTF8String)
                 if self._basicJSONParserHandler.validateJSON():  # Filter out JSON without version
                     incomingVersion = self._basicJSONParserHandler.getAttributeValue(u"version")
+                    if self._localCache is not None:
+                        self._localCache.applyDocument(currentAction, currentType, self._basicJSONParserHandler.getAttributeValue(u"state"), incomingVersion)
                     if incomingVersion is not None and incomingVersion > self._lastVersionInSync:
                         self._lastVersionInSync = incomingVersion
                         # Custom callback
@@ -176,6 +304,18 @@ class deviceShadow:
         fragments = srcTopic.split('/')
         return fragments[2]
 
+    def _startTimer(self, srcActionName, srcToken, srcTimeout):
+        # Timeouts run on the timer wheel shared by all shadows instead of a thread per request
+        with self._dataStructureLock:
+            if srcToken in self._tokenPool:  # Not answered yet
+                self._tokenPool[srcToken] = self._timerWheel.schedule(srcTimeout, self._timerHandler, srcActionName, srcToken)
+
+    def _discardRequest(self, srcActionName, srcToken):
+        with self._dataStructureLock:
+            self._tokenCallbacks.pop(srcToken, None)
+            if self._tokenPool.pop(srcToken, False) is not False:
+                self._shadowSubscribeStatusTable[srcActionName] -= 1
+
     def _timerHandler(self, srcActionName, srcToken):
         with self._dataStructureLock:
             # Don't crash if we try to remove an unknown token
@@ -188,11 +328,113 @@ class deviceShadow:
             self._shadowSubscribeStatusTable[srcActionName] -= 1
             if not self._isPersistentSubscribe and self._shadowSubscribeStatusTable.get(srcActionName) <= 0:
                 self._shadowSubscribeStatusTable[srcActionName] = 0
-                self._shadowManagerHandler.basicShadowUnsubscribe(self._shadowName, srcActionName)
+                # Blocks until acked, keep it off the timer thread
+                processNonPersistentUnsubscribe = Thread(target=self._doNonPersistentUnsubscribe, args=[srcActionName])
+                processNonPersistentUnsubscribe.start()
             # Notify time-out issue
-            if self._shadowSubscribeCallbackTable.get(srcActionName) is not None:
+            currentCallback = self._tokenCallbacks.pop(srcToken, self._shadowSubscribeCallbackTable.get(srcActionName))
+            if currentCallback is not None:
                 self._logger.info("Shadow request with token: " + str(srcToken) + " has timed out.")
-                self._shadowSubscribeCallbackTable[srcActionName]("REQUEST TIME OUT", "timeout", srcToken)
+                processCustomCallback = Thread(target=currentCallback, args=["REQUEST TIME OUT", "timeout", srcToken])
+                processCustomCallback.start()
+
+    def _getCoalescableReportedState(self, srcJSONParser):
+        # Only plain reported patches are merged, documents with desired, version or clientToken go as they are
+        currentDocument = srcJSONParser.getDocument()
+        if not isinstance(currentDocument, dict) or list(currentDocument.keys()) != ["state"]:
+            return None
+        currentState = currentDocument["state"]
+        if not isinstance(currentState, dict) or list(currentState.keys()) != ["reported"]:
+            return None
+        currentReportedState = currentState["reported"]
+        if not isinstance(currentReportedState, dict):
+            return None
+        return currentReportedState
+
+    def _coalesceUpdate(self, srcReportedState, srcCallback, srcTimeout):
+        # Returns the token of the batch the patch went into, None if coalescing is off
+        while True:
+            with self._dataStructureLock:
+                if self._updateCoalescingWindowSecond <= 0:
+                    return None
+                currentBatch = self._updateBatch
+                if currentBatch is None or currentBatch.isMergeable(srcReportedState):
+                    if currentBatch is None:
+                        currentBatch = self._updateBatch = _shadowUpdateBatch(self._tokenHandler.getNextToken())
+                        currentBatch.timer = self._timerWheel.schedule(self._updateCoalescingWindowSecond, self._updateBatchWindowHandler, currentBatch)
+                    currentBatch.merge(srcReportedState, srcCallback, srcTimeout)
+                    isBatchFull = currentBatch.getPayloadLength() >= self._updateCoalescingMaxBytes
+                    break
+            # Send what is pending first, this patch starts a new batch
+            self._flushUpdateBatch(currentBatch)
+        if isBatchFull:
+            self._flushUpdateBatch(currentBatch)
+        return currentBatch.token
+
+    def _updateBatchWindowHandler(self, srcBatch):
+        # Sending blocks until subscribed, keep it off the timer thread
+        processUpdateBatch = Thread(target=self._flushUpdateBatchAtWindowEnd, args=[srcBatch])
+        processUpdateBatch.start()
+
+    def _flushUpdateBatchAtWindowEnd(self, srcBatch):
+        try:
+            self._flushUpdateBatch(srcBatch)
+        except Exception:
+            pass  # Already logged and passed to the callbacks
+
+    def _flushUpdateBatch(self, srcBatch=None):
+        # Send the pending batch, or only srcBatch if it is still pending
+        with self._updateSendLock:
+            with self._dataStructureLock:
+                currentBatch = self._updateBatch
+                if currentBatch is None or (srcBatch is not None and currentBatch is not srcBatch):
+                    return
+                self._updateBatch = None
+                currentBatch.timer.cancel()
+                currentCallback = self._createUpdateBatchCallback(currentBatch.callbacks)
+                self._tokenCallbacks[currentBatch.token] = currentCallback
+            currentJSONParser = _basicJSONParser()
+            currentJSONParser.setString(json.dumps({"state": {"reported": currentBatch.reportedState}}))
+            currentJSONParser.validateJSON()
+            try:
+                self._sendUpdate(currentJSONParser, currentBatch.token, currentBatch.timeout)
+            except Exception as e:
+                # No response or timeout will come for the merged updates
+                self._logger.error("Failed to send coalesced update with token: " + str(currentBatch.token) + ": " + str(e))
+                processCustomCallback = Thread(target=currentCallback, args=["REQUEST TIME OUT", "timeout", currentBatch.token])
+                processCustomCallback.start()
+                raise
+
+    def _createUpdateBatchCallback(self, srcCallbacks):
+        def _updateBatchCallback(payload, responseStatus, token):
+            for currentCallback in srcCallbacks:
+                try:
+                    currentCallback(payload, responseStatus, token)
+                except Exception as e:
+                    self._logger.error("Shadow update callback %s raised: %s" % (currentCallback, e))
+        return _updateBatchCallback
+
+    def _sendUpdate(self, srcJSONParser, srcToken, srcTimeout):
+        with self._dataStructureLock:
+            # clientToken
+            self._tokenPool[srcToken] = None
+            srcJSONParser.setAttributeValue("clientToken", srcToken)
+            JSONPayloadWithToken = srcJSONParser.regenerateString()
+            # Update number of pending feedback
+            self._shadowSubscribeStatusTable["update"] += 1
+        try:
+            # Two subscriptions
+            if not self._isPersistentSubscribe or not self._isUpdateSubscribed:
+                self._shadowManagerHandler.basicShadowSubscribe(self._shadowName, "update", self.generalCallback)
+                self._isUpdateSubscribed = True
+                self._logger.info("Subscribed to update accepted/rejected topics for deviceShadow: " + self._shadowName)
+            # One publish
+            self._shadowManagerHandler.basicShadowPublish(self._shadowName, "update", JSONPayloadWithToken)
+        except Exception:
+            self._discardRequest("update", srcToken)  # Never sent, so no response or timeout will clear it
+            raise
+        # Start the timer
+        self._startTimer("update", srcToken, srcTimeout)
 
     def shadowGet(self, srcCallback, srcTimeout):
         """
@@ -233,20 +475,24 @@ class deviceShadow:
             self._shadowSubscribeStatusTable["get"] += 1
             # clientToken
             currentToken = self._tokenHandler.getNextToken()
-            self._tokenPool[currentToken] = Timer(srcTimeout, self._timerHandler, ["get", currentToken])
+            self._tokenPool[currentToken] = None
             self._basicJSONParserHandler.setString("{}")
             self._basicJSONParserHandler.validateJSON()
             self._basicJSONParserHandler.setAttributeValue("clientToken", currentToken)
             currentPayload = self._basicJSONParserHandler.regenerateString()
-        # Two subscriptions
-        if not self._isPersistentSubscribe or not self._isGetSubscribed:
-            self._shadowManagerHandler.basicShadowSubscribe(self._shadowName, "get", self.generalCallback)
-            self._isGetSubscribed = True
-            self._logger.info("Subscribed to get accepted/rejected topics for deviceShadow: " + self._shadowName)
-        # One publish
-        self._shadowManagerHandler.basicShadowPublish(self._shadowName, "get", currentPayload)
+        try:
+            # Two subscriptions
+            if not self._isPersistentSubscribe or not self._isGetSubscribed:
+                self._shadowManagerHandler.basicShadowSubscribe(self._shadowName, "get", self.generalCallback)
+                self._isGetSubscribed = True
+                self._logger.info("Subscribed to get accepted/rejected topics for deviceShadow: " + self._shadowName)
+            # One publish
+            self._shadowManagerHandler.basicShadowPublish(self._shadowName, "get", currentPayload)
+        except Exception:
+            self._discardRequest("get", currentToken)  # Never sent, so no response or timeout will clear it
+            raise
         # Start the timer
-        self._tokenPool[currentToken].start()
+        self._startTimer("get", currentToken, srcTimeout)
         return currentToken
 
     def shadowDelete(self, srcCallback, srcTimeout):
@@ -288,20 +534,24 @@ class deviceShadow:
             self._shadowSubscribeStatusTable["delete"] += 1
             # clientToken
             currentToken = self._tokenHandler.getNextToken()
-            self._tokenPool[currentToken] = Timer(srcTimeout, self._timerHandler, ["delete", currentToken])
+            self._tokenPool[currentToken] = None
             self._basicJSONParserHandler.setString("{}")
             self._basicJSONParserHandler.validateJSON()
             self._basicJSONParserHandler.setAttributeValue("clientToken", currentToken)
             currentPayload = self._basicJSONParserHandler.regenerateString()
-        # Two subscriptions
-        if not self._isPersistentSubscribe or not self._isDeleteSubscribed:
-            self._shadowManagerHandler.basicShadowSubscribe(self._shadowName, "delete", self.generalCallback)
-            self._isDeleteSubscribed = True
-            self._logger.info("Subscribed to delete accepted/rejected topics for deviceShadow: " + self._shadowName)
-        # One publish
-        self._shadowManagerHandler.basicShadowPublish(self._shadowName, "delete", currentPayload)
+        try:
+            # Two subscriptions
+            if not self._isPersistentSubscribe or not self._isDeleteSubscribed:
+                self._shadowManagerHandler.basicShadowSubscribe(self._shadowName, "delete", self.generalCallback)
+                self._isDeleteSubscribed = True
+                self._logger.info("Subscribed to delete accepted/rejected topics for deviceShadow: " + self._shadowName)
+            # One publish
+            self._shadowManagerHandler.basicShadowPublish(self._shadowName, "delete", currentPayload)
+        except Exception:
+            self._discardRequest("delete", currentToken)  # Never sent, so no response or timeout will clear it
+            raise
         # Start the timer
-        self._tokenPool[currentToken].start()
+        self._startTimer("delete", currentToken, srcTimeout)
         return currentToken
 
     def shadowUpdate(self, srcJSONPayload, srcCallback, srcTimeout):
@@ -335,31 +585,28 @@ class deviceShadow:
 
         **Returns**
 
-        The token used for tracing in this shadow request.
+        The token used for tracing in this shadow request. Updates coalesced by configureUpdateCoalescing share
+        the token of the update they are sent in.
 
         """
         # Validate JSON
-        self._basicJSONParserHandler.setString(srcJSONPayload)
-        if self._basicJSONParserHandler.validateJSON():
-            with self._dataStructureLock:
-                # clientToken
-                currentToken = self._tokenHandler.getNextToken()
-                self._tokenPool[currentToken] = Timer(srcTimeout, self._timerHandler, ["update", currentToken])
-                self._basicJSONParserHandler.setAttributeValue("clientToken", currentToken)
-                JSONPayloadWithToken = self._basicJSONParserHandler.regenerateString()
-                # Update callback data structure
-                self._shadowSubscribeCallbackTable["update"] = srcCallback
-                # Update number of pending feedback
-                self._shadowSubscribeStatusTable["update"] += 1
-            # Two subscriptions
-            if not self._isPersistentSubscribe or not self._isUpdateSubscribed:
-                self._shadowManagerHandler.basicShadowSubscribe(self._shadowName, "update", self.generalCallback)
-                self._isUpdateSubscribed = True
-                self._logger.info("Subscribed to update accepted/rejected topics for deviceShadow: " + self._shadowName)
-            # One publish
-            self._shadowManagerHandler.basicShadowPublish(self._shadowName, "update", JSONPayloadWithToken)
-            # Start the timer
-            self._tokenPool[currentToken].start()
+        # Own parser, the shared one is used by generalCallback while this one is not locked
+        currentJSONParser = _basicJSONParser()
+        currentJSONParser.setString(srcJSONPayload)
+        if currentJSONParser.validateJSON():
+            currentToken = None
+            currentReportedState = self._getCoalescableReportedState(currentJSONParser)
+            if currentReportedState is not None:
+                currentToken = self._coalesceUpdate(currentReportedState, srcCallback, srcTimeout)
+            if currentToken is None:
+                with self._updateSendLock:
+                    # Anything coalesced before goes out first
+                    self._flushUpdateBatch()
+                    with self._dataStructureLock:
+                        currentToken = self._tokenHandler.getNextToken()
+                        # Update callback data structure
+                        self._shadowSubscribeCallbackTable["update"] = srcCallback
+                    self._sendUpdate(currentJSONParser, currentToken, srcTimeout)
         else:
             raise ValueError("Invalid JSON file.")
         return currentToken
@@ -428,3 +675,104 @@ class deviceShadow:
         # One unsubscription
         self._shadowManagerHandler.basicShadowUnsubscribe(self._shadowName, "delta")
         self._logger.info("Unsubscribed to delta topics for deviceShadow: " + self._shadowName)
+
+    def configureLocalCache(self, enabled=True):
+        """
+        **Description**
+
+        Keep a local copy of the shadow state, updated from the get/update/delete accepted responses and the
+        deltas that this handler receives, including the responses to requests of other clients while subscribed.
+        The state can then be read with getLocalState without a round trip to AWS IoT. Responses only arrive
+        while the handler is subscribed, so with non-persistent subscriptions or without a delta callback the
+        local copy may miss changes. Its version tells how current it is, a shadowGet brings it up to date.
+
+        **Syntax**
+
+        .. code:: python
+
+          BotShadow.configureLocalCache()
+          BotShadow.shadowGet(customCallback, 5)
+
+        **Parameters**
+
+        *enabled* - Whether to keep the local copy. Disabling it drops the copy.
+
+        **Returns**
+
+        None
+
+        """
+        with self._dataStructureLock:
+            if not enabled:
+                self._localCache = None
+            elif self._localCache is None:
+                self._localCache = _shadowLocalCache()
+
+    def getLocalState(self):
+        """
+        **Description**
+
+        Retrieve the local copy of the shadow state kept since configureLocalCache was called.
+
+        **Syntax**
+
+        .. code:: python
+
+          localState = BotShadow.getLocalState()
+          if localState is not None:
+              print(localState["version"], localState["state"].get("reported"))
+
+        **Parameters**
+
+        None
+
+        **Returns**
+
+        A dict with the *state* (its *desired* and *reported* sections) and the *version* of the shadow document
+        it was last updated from. None if the local copy is not enabled or no document has been received yet.
+
+        """
+        with self._dataStructureLock:
+            if self._localCache is None:
+                return None
+            return self._localCache.getState()
+
+    def configureUpdateCoalescing(self, windowSecond, maxPayloadBytes=_DEFAULT_UPDATE_COALESCING_MAX_BYTES):
+        """
+        **Description**
+
+        Coalesce the updates of the reported state made in quick succession into one shadow update. An update
+        whose document only has a *reported* section opens a window, and the following ones within it are merged
+        into it, later values overriding earlier ones. At the end of the window, or once the merged reported state
+        reaches maxPayloadBytes, one update is sent with a single token. That token is returned by shadowUpdate
+        for every merged update, and its accepted, rejected or timeout response is passed to all their callbacks.
+        Any other update sends the pending one first, so the updates reach AWS IoT in order.
+
+        **Syntax**
+
+        .. code:: python
+
+          # Send the reported state at most every 0.5 seconds
+          BotShadow.configureUpdateCoalescing(0.5)
+          BotShadow.shadowUpdate('{"state":{"reported":{"temperature":21.5}}}', customCallback, 5)
+
+        **Parameters**
+
+        *windowSecond* - Time in seconds an update waits for the ones to merge into it. 0 disables coalescing
+        and sends the pending update.
+
+        *maxPayloadBytes* - Size in bytes of the merged reported state at which it is sent before the end of the
+        window. Defaults to 7168, below the 8 KB limit of AWS IoT on shadow documents.
+
+        **Returns**
+
+        None
+
+        """
+        if windowSecond < 0 or maxPayloadBytes <= 0:
+            raise ValueError("Coalescing window must not be negative and the maximum size must be positive.")
+        with self._dataStructureLock:
+            self._updateCoalescingWindowSecond = windowSecond
+            self._updateCoalescingMaxBytes = maxPayloadBytes
+        if windowSecond == 0:
+            self._flushUpdateBatch()
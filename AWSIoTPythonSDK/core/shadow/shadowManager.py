@@ -14,7 +14,6 @@
 # */
 
 import logging
-import time
 from threading import Lock
 
 class _shadowAction:
@@ -55,29 +54,92 @@ class shadowManager:
         if srcMQTTCore is None:
             raise TypeError("None type inputs detected.")
         self._mqttCoreHandler = srcMQTTCore
-        self._shadowSubUnsubOperationLock = Lock()
+        # Sub/unsub operations are serialized per shadow, different shadows go ahead concurrently
+        self._shadowSubUnsubOperationLocks = dict()
+        self._shadowSubUnsubOperationLocksLock = Lock()
+
+    def _getShadowSubUnsubOperationLock(self, srcShadowName):
+        with self._shadowSubUnsubOperationLocksLock:
+            currentLock = self._shadowSubUnsubOperationLocks.get(srcShadowName)
+            if currentLock is None:
+                currentLock = Lock()
+                self._shadowSubUnsubOperationLocks[srcShadowName] = currentLock
+            return currentLock
 
     def basicShadowPublish(self, srcShadowName, srcShadowAction, srcPayload):
         currentShadowAction = _shadowAction(srcShadowName, srcShadowAction)
         self._mqttCoreHandler.publish(currentShadowAction.getTopicGeneral(), srcPayload, 0, False)
 
     def basicShadowSubscribe(self, srcShadowName, srcShadowAction, srcCallback):
-        with self._shadowSubUnsubOperationLock:
+        # Returns once the subscriptions are acked, raises subscribeTimeoutException otherwise
+        with self._getShadowSubUnsubOperationLock(srcShadowName):
             currentShadowAction = _shadowAction(srcShadowName, srcShadowAction)
             if currentShadowAction.isDelta:
                 self._mqttCoreHandler.subscribe(currentShadowAction.getTopicDelta(), 0, srcCallback)
             else:
-                self._mqttCoreHandler.subscribe(currentShadowAction.getTopicAccept(), 0, srcCallback)
-                self._mqttCoreHandler.subscribe(currentShadowAction.getTopicReject(), 0, srcCallback)
-            time.sleep(2)
+                self._mqttCoreHandler.subscribe_all([currentShadowAction.getTopicAccept(), currentShadowAction.getTopicReject()], 0, srcCallback)
 
     def basicShadowUnsubscribe(self, srcShadowName, srcShadowAction):
-        with self._shadowSubUnsubOperationLock:
+        with self._getShadowSubUnsubOperationLock(srcShadowName):
             currentShadowAction = _shadowAction(srcShadowName, srcShadowAction)
             if currentShadowAction.isDelta:
                 self._mqttCoreHandler.unsubscribe(currentShadowAction.getTopicDelta())
             else:
                 self._logger.debug(currentShadowAction.getTopicAccept())
-                self._mqttCoreHandler.unsubscribe(currentShadowAction.getTopicAccept())
                 self._logger.debug(currentShadowAction.getTopicReject())
-                self._mqttCoreHandler.unsubscribe(currentShadowAction.getTopicReject())
+                self._mqttCoreHandler.unsubscribe_all([currentShadowAction.getTopicAccept(), currentShadowAction.getTopicReject()])
+
+
+class shadowFleetManager(shadowManager):
+    """
+    Shadow manager that subscribes to the response topics of each action once, with a wildcard
+    in place of the shadow name, and routes incoming responses to the shadow they are for by a
+    dict lookup on the name. The number of subscriptions does not grow with the number of shadows,
+    and subscribing/unsubscribing a shadow after the first one costs no round trip.
+    """
+
+    _WILDCARD_SHADOW_NAME = "+"
+
+    def __init__(self, srcMQTTCore):
+        shadowManager.__init__(self, srcMQTTCore)
+        # Action -> {shadow name: callback}
+        self._shadowCallbackTables = dict()
+        for currentAction in _shadowAction._actionType:
+            self._shadowCallbackTables[currentAction] = dict()
+        self._wildcardSubscribedActions = set()
+        self._wildcardSubscribeLock = Lock()
+
+    def basicShadowSubscribe(self, srcShadowName, srcShadowAction, srcCallback):
+        _shadowAction(srcShadowName, srcShadowAction)  # Validate the action
+        currentCallbackTable = self._shadowCallbackTables[srcShadowAction]
+        currentCallbackTable[srcShadowName] = srcCallback
+        if srcShadowAction in self._wildcardSubscribedActions:
+            return
+        with self._wildcardSubscribeLock:
+            if srcShadowAction in self._wildcardSubscribedActions:  # Subscribed while waiting for the lock
+                return
+            wildcardShadowAction = _shadowAction(self._WILDCARD_SHADOW_NAME, srcShadowAction)
+            dispatchCallback = self._createDispatchCallback(currentCallbackTable)
+            try:
+                if wildcardShadowAction.isDelta:
+                    self._mqttCoreHandler.subscribe(wildcardShadowAction.getTopicDelta(), 0, dispatchCallback)
+                else:
+                    self._mqttCoreHandler.subscribe_all([wildcardShadowAction.getTopicAccept(), wildcardShadowAction.getTopicReject()], 0, dispatchCallback)
+            except Exception:
+                currentCallbackTable.pop(srcShadowName, None)
+                raise
+            self._wildcardSubscribedActions.add(srcShadowAction)
+            self._logger.info("Subscribed to wildcard " + srcShadowAction + " topics for the shadow fleet")
+
+    def basicShadowUnsubscribe(self, srcShadowName, srcShadowAction):
+        # The wildcard subscription stays for the other shadows, only stop routing to this one
+        _shadowAction(srcShadowName, srcShadowAction)
+        self._shadowCallbackTables[srcShadowAction].pop(srcShadowName, None)
+
+    def _createDispatchCallback(self, srcCallbackTable):
+        def dispatchCallback(client, userdata, message):
+            # $aws/things/<shadow name>/shadow/...
+            currentCallback = srcCallbackTable.get(message.topic.split("/", 3)[2])
+            if currentCallback is not None:
+                currentCallback(client, userdata, message)
+        return dispatchCallback
@@ -0,0 +1,211 @@
+# /*
+# * Copyright 2010-2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# *
+# * Licensed under the Apache License, Version 2.0 (the "License").
+# * You may not use this file except in compliance with the License.
+# * A copy of the License is located at
+# *
+# *  http://aws.amazon.com/apache2.0
+# *
+# * or in the "license" file accompanying this file. This file is distributed
+# * on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either
+# * express or implied. See the License for the specific language governing
+# * permissions and limitations under the License.
+# */
+
+import time
+import logging
+from threading import Condition, Lock, Thread
+
+_monotonic = getattr(time, "monotonic", time.time)  # Python 3.3+
+
+
+class TimerHandle(object):
+
+    def __init__(self, timer_wheel, expire_tick, callback, args):
+        self._timer_wheel = timer_wheel
+        self.expire_tick = expire_tick
+        self.callback = callback
+        self.args = args
+        self.slot = None  # The wheel slot holding this timer, None once fired or cancelled
+
+    def cancel(self):
+        """Return True if the timer was pending and will not fire."""
+        return self._timer_wheel.cancel(self)
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timer wheel running the callbacks of any number of timers on one thread.
+    Scheduling and cancelling are O(1): a timer goes into the slot of the first wheel that
+    covers its expiry and moves down a wheel each time the wheel below completes a turn.
+    Callbacks run on the timer thread and should return quickly, as they delay every other
+    timer of the wheel.
+    """
+
+    _logger = logging.getLogger(__name__)
+
+    _WHEEL_BITS = 8
+    _WHEEL_SIZE = 1 << _WHEEL_BITS
+    _WHEEL_MASK = _WHEEL_SIZE - 1
+    _WHEEL_COUNT = 4
+
+    def __init__(self, tick_sec=0.01, name="TimerWheel"):
+        if tick_sec <= 0:
+            raise ValueError("Tick must be positive.")
+        self._tick_sec = float(tick_sec)
+        self._name = name
+        self._wheels = [[set() for _ in range(self._WHEEL_SIZE)] for _ in range(self._WHEEL_COUNT)]
+        self._start_time = _monotonic()
+        self._current_tick = 0  # Every tick up to and including this one has been processed
+        self._next_wakeup_tick = None  # None while the thread waits for a timer to be scheduled
+        self._timer_count = 0
+        self._fired_count = 0
+        self._cancelled_count = 0
+        self._condition = Condition(Lock())
+        self._thread = None
+        self._stopped = False
+
+    def schedule(self, delay_sec, callback, *args):
+        """Call callback(*args) on the timer thread after delay_sec, rounded up to the next tick."""
+        with self._condition:
+            if self._stopped:
+                raise RuntimeError("Timer wheel is stopped.")
+            now = _monotonic()
+            if self._timer_count == 0:
+                # Nothing to process in between, skip the ticks that passed while idle
+                self._current_tick = max(self._current_tick, self._tick_at(now) - 1)
+            expire_tick = max(self._tick_at(now + delay_sec), self._current_tick + 1)
+            handle = TimerHandle(self, expire_tick, callback, args)
+            self._place(handle)
+            self._timer_count += 1
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self._name)
+                self._thread.daemon = True
+                self._thread.start()
+            elif self._next_wakeup_tick is None or expire_tick < self._next_wakeup_tick:
+                self._condition.notify()
+        return handle
+
+    def cancel(self, handle):
+        with self._condition:
+            if handle.slot is None:
+                return False
+            handle.slot.discard(handle)
+            handle.slot = None
+            self._timer_count -= 1
+            self._cancelled_count += 1
+            return True
+
+    def stop(self):
+        """Stop the timer thread. Pending timers do not fire."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def get_metrics(self):
+        with self._condition:
+            return {
+                "pending": self._timer_count,
+                "fired": self._fired_count,
+                "cancelled": self._cancelled_count
+            }
+
+    def _tick_at(self, at_time):
+        # Rounded up, so that no timer fires early
+        return int((at_time - self._start_time) / self._tick_sec) + 1
+
+    def _place(self, handle):
+        expire_tick = handle.expire_tick
+        for level in range(self._WHEEL_COUNT):
+            shift = level * self._WHEEL_BITS
+            if (expire_tick >> shift) - (self._current_tick >> shift) < self._WHEEL_SIZE:
+                break
+        else:
+            # Beyond the outermost wheel, park it in its farthest slot until it comes round
+            shift = (self._WHEEL_COUNT - 1) * self._WHEEL_BITS
+            expire_tick = ((self._current_tick >> shift) + self._WHEEL_MASK) << shift
+        slot = self._wheels[level][(expire_tick >> shift) & self._WHEEL_MASK]
+        slot.add(handle)
+        handle.slot = slot
+
+    def _advance(self, expired):
+        # Process the next tick, collecting the timers that are due
+        tick = self._current_tick + 1
+        self._current_tick = tick
+        if not tick & self._WHEEL_MASK:
+            # The innermost wheel completed a turn, move the timers of the next slot of each
+            # outer wheel that also did down a wheel, outermost first
+            level = 1
+            while level < self._WHEEL_COUNT - 1 and not (tick >> (level * self._WHEEL_BITS)) & self._WHEEL_MASK:
+                level += 1
+            while level > 0:
+                slot = self._wheels[level][(tick >> (level * self._WHEEL_BITS)) & self._WHEEL_MASK]
+                if slot:
+                    handles = list(slot)
+                    slot.clear()
+                    for handle in handles:
+                        self._place(handle)
+                level -= 1
+        slot = self._wheels[0][tick & self._WHEEL_MASK]
+        if slot:
+            for handle in slot:
+                handle.slot = None
+            expired.extend(slot)
+            self._timer_count -= len(slot)
+            self._fired_count += len(slot)
+            slot.clear()
+
+    def _next_tick_to_process(self):
+        # The next tick with timers due in the innermost wheel, or the end of its current turn,
+        # when timers from the outer wheels may move into it
+        if self._timer_count == 0:
+            return None
+        tick = self._current_tick + 1
+        turn_end = (self._current_tick | self._WHEEL_MASK) + 1
+        wheel = self._wheels[0]
+        while tick < turn_end and not wheel[tick & self._WHEEL_MASK]:
+            tick += 1
+        return tick
+
+    def _run(self):
+        expired = []
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    now_tick = self._tick_at(_monotonic()) - 1
+                    next_tick = self._next_tick_to_process()
+                    if next_tick is not None and next_tick <= now_tick:
+                        break
+                    self._next_wakeup_tick = next_tick
+                    if next_tick is None:
+                        self._condition.wait()
+                    else:
+                        self._condition.wait(self._start_time + next_tick * self._tick_sec - _monotonic())
+                self._next_wakeup_tick = None
+                while self._current_tick < now_tick:
+                    self._advance(expired)
+            for handle in expired:
+                try:
+                    handle.callback(*handle.args)
+                except Exception as e:
+                    self._logger.error("Timer callback %s raised: %s" % (handle.callback, e))
+            del expired[:]
+
+
+_shared_timer_wheel = None
+_shared_timer_wheel_lock = Lock()
+
+
+def get_shared_timer_wheel():
+    """Return the process-wide timer wheel used for the timeouts of the SDK."""
+    global _shared_timer_wheel
+    with _shared_timer_wheel_lock:
+        if _shared_timer_wheel is None:
+            _shared_timer_wheel = TimerWheel(name="AWSIoTTimerWheel")
+        return _shared_timer_wheel
@@ -3,15 +3,19 @@ sys.path.insert(0, 'AWSIoTPythonSDK')
 import AWSIoTPythonSDK
 currentVersion = AWSIoTPythonSDK.__version__
 
+packages = ['AWSIoTPythonSDK', 'AWSIoTPythonSDK.core',
+            'AWSIoTPythonSDK.core.util', 'AWSIoTPythonSDK.core.shadow', 'AWSIoTPythonSDK.core.protocol',
+            'AWSIoTPythonSDK.core.jobs',
+            'AWSIoTPythonSDK.core.protocol.paho', 'AWSIoTPythonSDK.core.protocol.internal',
+            'AWSIoTPythonSDK.core.protocol.connection', 'AWSIoTPythonSDK.core.greengrass',
+            'AWSIoTPythonSDK.core.greengrass.discovery', 'AWSIoTPythonSDK.exception']
+if sys.version_info >= (3, 5):
+    packages.append('AWSIoTPythonSDK.aio')  # async/await syntax
+
 from distutils.core import setup
 setup(
     name = 'AWSIoTPythonSDK',
-    packages=['AWSIoTPythonSDK', 'AWSIoTPythonSDK.core',
-              'AWSIoTPythonSDK.core.util', 'AWSIoTPythonSDK.core.shadow', 'AWSIoTPythonSDK.core.protocol',
-              'AWSIoTPythonSDK.core.jobs',
-              'AWSIoTPythonSDK.core.protocol.paho', 'AWSIoTPythonSDK.core.protocol.internal',
-              'AWSIoTPythonSDK.core.protocol.connection', 'AWSIoTPythonSDK.core.greengrass',
-              'AWSIoTPythonSDK.core.greengrass.discovery', 'AWSIoTPythonSDK.exception'],
+    packages=packages,
     version = currentVersion,
     description = 'SDK for connecting to AWS IoT using Python.',
     author = 'Amazon Web Service',